@@ -0,0 +1,256 @@
+import functools
+import os
+from logging import getLogger
+from typing import Optional, List, BinaryIO, AsyncIterator, Union, Tuple
+
+import httpx
+from starlette.concurrency import run_in_threadpool
+from webdav3.client import Urn
+from webdav3.exceptions import RemoteResourceNotFound, ResponseErrorCode, NoConnection, ConnectionException
+
+from text_extraction_system.config import get_settings
+from text_extraction_system.file_storage import FileStorage, WebDavClient, StoragePreconditionFailed, \
+    get_file_storage
+
+log = getLogger(__name__)
+
+
+class AsyncFileStorage:
+    """
+    Asyncio interface of the file storage used by the web api to not block the event loop on the storage i/o.
+    By default the methods of the synchronous storage are executed in the thread pool.
+    The network storages override them with the natively asynchronous implementations.
+    The semantics of the methods are the same as of FileStorage.
+    """
+
+    def __init__(self, storage: FileStorage):
+        self.storage = storage
+
+    async def mkdir(self, remote_path: str) -> bool:
+        return await run_in_threadpool(self.storage.mkdir, remote_path)
+
+    async def list(self, remote_path: str, get_info: bool = False) -> List:
+        return await run_in_threadpool(self.storage.list, remote_path, get_info)
+
+    async def clean(self, remote_path: str):
+        await run_in_threadpool(self.storage.clean, remote_path)
+
+    async def upload_to(self, buff: Union[bytes, str, BinaryIO], remote_path: str):
+        await run_in_threadpool(self.storage.upload_to, buff, remote_path)
+
+    async def get_size(self, remote_path: str) -> int:
+        return await run_in_threadpool(self.storage.get_size, remote_path)
+
+    async def stream(self,
+                     remote_path: str,
+                     chunk_size: int = 1024 * 1024,
+                     start: int = 0,
+                     end: Optional[int] = None) -> AsyncIterator[bytes]:
+        chunks = await run_in_threadpool(self.storage.stream, remote_path, chunk_size, start, end)
+
+        async def iterate():
+            try:
+                while True:
+                    chunk = await run_in_threadpool(next, chunks, None)
+                    if chunk is None:
+                        break
+                    yield chunk
+            finally:
+                await run_in_threadpool(chunks.close)
+
+        return iterate()
+
+    async def download_if_modified(self,
+                                   remote_path: str,
+                                   etag: Optional[str] = None) -> Tuple[Optional[bytes], Optional[str]]:
+        return await run_in_threadpool(self.storage.download_if_modified, remote_path, etag)
+
+    async def upload_if_match(self, content: bytes, remote_path: str, etag: Optional[str] = None) -> Optional[str]:
+        return await run_in_threadpool(self.storage.upload_if_match, content, remote_path, etag)
+
+    def local_path(self, remote_path: str) -> Optional[str]:
+        return self.storage.local_path(remote_path)
+
+    async def aclose(self):
+        pass
+
+
+def wrap_transport_error(fn):
+    """
+    Converts the httpx errors to the webdav3 ones the same way webdav3.client.wrap_connection_error()
+    does it for the synchronous client.
+    """
+    @functools.wraps(fn)
+    async def _wrapper(self, *args, **kwargs):
+        try:
+            return await fn(self, *args, **kwargs)
+        except httpx.ConnectError as e:
+            raise NoConnection(self.hostname) from e
+        except httpx.RequestError as e:
+            raise ConnectionException(e) from e
+
+    return _wrapper
+
+
+class AsyncWebDavStorage(AsyncFileStorage):
+    """
+    WebDAV storage accessed with httpx. All coroutines of the process share a single pool
+    of the keep-alive connections.
+    The rarely used methods (e.g. list) are executed by the synchronous client in the thread pool.
+    """
+
+    def __init__(self, storage: WebDavClient, transport: Optional[httpx.AsyncBaseTransport] = None):
+        super().__init__(storage)
+        settings = get_settings()
+        self.hostname = settings.webdav_url.rstrip('/')
+        self.chunk_size = settings.webdav_chunk_size_mb * 1024 * 1024
+        self.client = httpx.AsyncClient(
+            auth=(settings.webdav_username, settings.webdav_password) if settings.webdav_username else None,
+            limits=httpx.Limits(max_connections=settings.webdav_pool_size,
+                                max_keepalive_connections=settings.webdav_pool_size),
+            timeout=None,
+            transport=transport)
+
+    def _url(self, remote_path: str, directory: bool = False) -> str:
+        # the same way as webdav3 builds them
+        return self.hostname + Urn(remote_path, directory=directory).quote()
+
+    @staticmethod
+    async def _check(response: httpx.Response, remote_path: str):
+        if response.status_code == 404:
+            await response.aclose()
+            raise RemoteResourceNotFound(remote_path)
+        if response.status_code >= 400:
+            await response.aread()
+            raise ResponseErrorCode(url=str(response.url), code=response.status_code, message=response.text)
+
+    async def _send(self, method: str, remote_path: str, directory: bool = False, stream: bool = False,
+                    **kwargs) -> httpx.Response:
+        request = self.client.build_request(method, self._url(remote_path, directory), **kwargs)
+        response = await self.client.send(request, stream=stream)
+        await self._check(response, remote_path)
+        return response
+
+    @wrap_transport_error
+    async def mkdir(self, remote_path: str) -> bool:
+        request = self.client.build_request('MKCOL', self._url(remote_path, directory=True))
+        response = await self.client.send(request)
+        if response.status_code == 405:
+            # the directory already exists
+            return True
+        await self._check(response, remote_path)
+        return response.status_code in (200, 201)
+
+    @wrap_transport_error
+    async def clean(self, remote_path: str):
+        await self._send('DELETE', remote_path)
+
+    async def _read_chunks(self, buff: BinaryIO) -> AsyncIterator[bytes]:
+        while True:
+            chunk = await run_in_threadpool(buff.read, self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    @wrap_transport_error
+    async def upload_to(self, buff: Union[bytes, str, BinaryIO], remote_path: str):
+        if isinstance(buff, (bytes, str)):
+            await self._send('PUT', remote_path, content=buff)
+            return
+        # the file object is sent chunk by chunk - not loaded to memory as a whole
+        try:
+            pos = buff.tell()
+            size = buff.seek(0, os.SEEK_END) - pos
+            buff.seek(pos)
+            headers = {'Content-Length': str(size)}
+        except (AttributeError, OSError):
+            # unseekable - sent with the chunked transfer encoding
+            headers = None
+        await self._send('PUT', remote_path, content=self._read_chunks(buff), headers=headers)
+
+    @wrap_transport_error
+    async def get_size(self, remote_path: str) -> int:
+        response = await self._send('HEAD', remote_path)
+        size = response.headers.get('Content-Length')
+        return int(size) if size else await super().get_size(remote_path)
+
+    @wrap_transport_error
+    async def stream(self,
+                     remote_path: str,
+                     chunk_size: int = 1024 * 1024,
+                     start: int = 0,
+                     end: Optional[int] = None) -> AsyncIterator[bytes]:
+        ranged = start > 0 or end is not None
+        headers = {'Range': f'bytes={start}-{end if end is not None else ""}'} if ranged else None
+        response = await self._send('GET', remote_path, stream=True, headers=headers)
+        # the server may ignore the range header and send the whole file
+        skip = start if ranged and response.status_code != 206 else 0
+        remaining = end - start + 1 if ranged and response.status_code != 206 and end is not None else None
+
+        async def iterate():
+            nonlocal skip, remaining
+            try:
+                async for chunk in response.aiter_bytes(chunk_size):
+                    if skip:
+                        chunk, skip = chunk[skip:], max(skip - len(chunk), 0)
+                    if remaining is not None:
+                        chunk, remaining = chunk[:remaining], remaining - min(len(chunk), remaining)
+                    if chunk:
+                        yield chunk
+                    if remaining == 0:
+                        break
+            except httpx.ConnectError as e:
+                raise NoConnection(self.hostname) from e
+            except httpx.RequestError as e:
+                raise ConnectionException(e) from e
+            finally:
+                await response.aclose()
+
+        return iterate()
+
+    @wrap_transport_error
+    async def download_if_modified(self,
+                                   remote_path: str,
+                                   etag: Optional[str] = None) -> Tuple[Optional[bytes], Optional[str]]:
+        response = await self._send('GET', remote_path, headers={'If-None-Match': etag} if etag else None)
+        if response.status_code == 304:
+            return None, etag
+        return response.content, response.headers.get('ETag')
+
+    @wrap_transport_error
+    async def upload_if_match(self, content: bytes, remote_path: str, etag: Optional[str] = None) -> Optional[str]:
+        # If-Match uses the strong comparison - weak ETags would never match
+        headers = {'If-Match': etag} if etag and not etag.startswith('W/') else None
+        try:
+            response = await self._send('PUT', remote_path, content=content, headers=headers)
+        except ResponseErrorCode as e:
+            if e.code == 412:
+                raise StoragePreconditionFailed(remote_path) from e
+            raise
+        return response.headers.get('ETag')
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_async_file_storage: Optional[AsyncFileStorage] = None
+
+
+def get_async_file_storage() -> AsyncFileStorage:
+    """
+    Returns the asyncio interface of the storage backend configured in the settings.
+    Should be used from the coroutines of the web api only.
+    """
+    global _async_file_storage
+    if not _async_file_storage:
+        storage = get_file_storage()
+        _async_file_storage = AsyncWebDavStorage(storage) if isinstance(storage, WebDavClient) \
+            else AsyncFileStorage(storage)
+    return _async_file_storage
+
+
+async def close_async_file_storage():
+    global _async_file_storage
+    if _async_file_storage:
+        await _async_file_storage.aclose()
+        _async_file_storage = None
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 from pydantic import BaseSettings
 
@@ -8,12 +9,43 @@ project_root = os.path.dirname(os.path.join(os.path.dirname(__file__)))
 class Settings(BaseSettings):
     celery_broker: str
     celery_backend: str
-    webdav_url: str
-    webdav_username: str
-    webdav_password: str
+    file_storage_backend: str = 'webdav'
+    local_file_storage_root: str = '/data/text_extraction_system'
+    webdav_url: str = None
+    webdav_username: str = None
+    webdav_password: str = None
+    webdav_pool_size: int = 32
+    webdav_chunk_size_mb: int = 4
+    webdav_parallel_download_threads: int = 0
+    webdav_parallel_download_min_size_mb: int = 64
     java_modules_path: str = os.path.join(project_root, 'java_modules')
+    java_worker_enabled: bool = True
+    java_worker_max_calls: int = 200
+    tesseract_api_enabled: bool = True
+    page_artifacts_cache_dir: str = os.path.join(tempfile.gettempdir(), 'text_extraction_system_page_artifacts')
+    page_artifacts_cache_size_mb: int = 1024
+    request_metadata_cache_ttl_sec: float = 2
+    request_status_index_ttl_sec: int = 30 * 24 * 3600
+    request_status_load_concurrency: int = 32
+    sync_extraction_recheck_interval_sec: float = 30
+    task_health_lease_sec: int = 300
+    task_health_heartbeat_sec: int = 60
+    task_health_queued_lease_sec: int = 120
+    task_health_check_batch_size: int = 1000
+    page_batching_adaptive: bool = False
+    page_batch_min_cost: float = 10
+    page_batch_max_cost: float = 50
+    page_batch_max_pages: int = 20
+    page_batch_workers: int = None
     text_extraction_system_ui_path: str = os.path.join(project_root, 'text_extraction_system_ui')
     fasttext_lang_model: str = os.path.join(project_root, 'models/lid.176.bin')
+    lang_propagation_min_confidence: float = None
+    result_cache_enabled: bool = False
+    result_cache_root: str = 'result_cache'
+    result_cache_size_mb: int = 10 * 1024
+    result_cache_flight_ttl_sec: int = 6 * 3600
+    result_cache_flight_wait_sec: int = 30
+    result_cache_flight_max_waits: int = 120
     delete_temp_files_on_request_finish: bool = True
     keep_failed_files: bool = False
     celery_shutdown_when_no_tasks_longer_than_sec: int = None
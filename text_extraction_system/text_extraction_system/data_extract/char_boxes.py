@@ -0,0 +1,450 @@
+import struct
+from dataclasses import dataclass
+from typing import List, Optional, Tuple, Union, Any, Dict, BinaryIO
+
+import msgpack
+import numpy as np
+
+from text_extraction_system_api.dto import PlainTextStructure, PlainTextPage
+from text_extraction_system_api.pdf_coordinates.paged_char_boxes import PagedCharBoxesHeader
+
+# Row of a msgpack array of 4 doubles as written by the Java extractor: fixarray(4) + 4 x (float64 marker, value)
+_MSGPACK_F64_ROW = np.dtype([('h', 'u1'),
+                             ('m0', 'u1'), ('x', '>f8'),
+                             ('m1', 'u1'), ('y', '>f8'),
+                             ('m2', 'u1'), ('w', '>f8'),
+                             ('m3', 'u1'), ('hh', '>f8')])
+
+# The same row of 4 single floats - the way the results are packed with use_single_float=True
+_MSGPACK_F32_ROW = np.dtype([('h', 'u1'),
+                             ('m0', 'u1'), ('x', '>f4'),
+                             ('m1', 'u1'), ('y', '>f4'),
+                             ('m2', 'u1'), ('w', '>f4'),
+                             ('m3', 'u1'), ('hh', '>f4')])
+
+# Item of the char_bboxes field of the CharBboxes protobuf message (contract_char_bboxes.proto):
+# field 1 tag, length of the Coordinates message, packed coords field tag, its length, 4 little-endian floats
+_PROTOBUF_COORDINATES_ITEM = np.dtype([('tag', 'u1'), ('len', 'u1'), ('coords_tag', 'u1'), ('coords_len', 'u1'),
+                                       ('coords', '<f4', (4,))])
+_PROTOBUF_LEN_FIELD_1 = 0x0a
+
+_MSGPACK_FIXARRAY_4 = 0x94
+_MSGPACK_NIL = 0xc0
+_MSGPACK_FLOAT32 = 0xca
+_MSGPACK_FLOAT64 = 0xcb
+
+
+def _msgpack_array_header(n: int) -> bytes:
+    if n < 16:
+        return bytes((0x90 | n,))
+    if n < 0x10000:
+        return struct.pack('>BH', 0xdc, n)
+    return struct.pack('>BI', 0xdd, n)
+
+
+def _read_msgpack_array_header(buf: memoryview, offset: int) -> Tuple[Optional[int], int]:
+    """
+    Returns the length of the msgpack array starting at the offset and the offset of its first item
+    or None if there is no array at the offset.
+    """
+    b = buf[offset]
+    if 0x90 <= b <= 0x9f:
+        return b & 0x0f, offset + 1
+    if b == 0xdc:
+        return struct.unpack_from('>H', buf, offset + 1)[0], offset + 3
+    if b == 0xdd:
+        return struct.unpack_from('>I', buf, offset + 1)[0], offset + 5
+    return None, offset
+
+
+def _read_msgpack_bin(buf: memoryview, offset: int) -> Optional[memoryview]:
+    b = buf[offset]
+    if b == 0xc4:
+        size, start = buf[offset + 1], offset + 2
+    elif b == 0xc5:
+        size, start = struct.unpack_from('>H', buf, offset + 1)[0], offset + 3
+    elif b == 0xc6:
+        size, start = struct.unpack_from('>I', buf, offset + 1)[0], offset + 5
+    else:
+        return None
+    return buf[start:start + size]
+
+
+def _decode_fixed_rows(buf: memoryview, offset: int, n: int, row_dtype: np.dtype, marker: int) \
+        -> Optional[np.ndarray]:
+    """
+    Decodes n rows of 4 floats at once if all of them have the same fixed layout.
+    Returns None if any row differs (nulls, integers, other float sizes).
+    """
+    if offset + n * row_dtype.itemsize > len(buf):
+        return None
+    rows = np.frombuffer(buf, dtype=row_dtype, count=n, offset=offset)
+    if not ((rows['h'] == _MSGPACK_FIXARRAY_4).all()
+            and (rows['m0'] == marker).all() and (rows['m1'] == marker).all()
+            and (rows['m2'] == marker).all() and (rows['m3'] == marker).all()):
+        return None
+    boxes = np.empty((n, 4), dtype=np.float32)
+    for i, field in enumerate(('x', 'y', 'w', 'hh')):
+        boxes[:, i] = rows[field]
+    return boxes
+
+
+def _count_fixed_rows(buf: memoryview, offset: int, n: int, row_dtype: np.dtype, marker: int) -> int:
+    """
+    Returns the number of the rows of the fixed layout following each other from the offset (up to n).
+    """
+    rows = np.frombuffer(buf, dtype=row_dtype, count=n, offset=offset)
+    fixed = (rows['h'] == _MSGPACK_FIXARRAY_4) & (rows['m0'] == marker) & (rows['m1'] == marker) \
+        & (rows['m2'] == marker) & (rows['m3'] == marker)
+    return n if fixed.all() else int(np.argmin(fixed))
+
+
+# Max size of a msgpack array of 4 numbers: fixarray header + 4 x (marker, 8-byte value)
+_MSGPACK_MAX_ROW_SIZE = 1 + 4 * 9
+_SCAN_MIN_BLOCK_ROWS = 64
+_NULL_BOX = np.zeros((1, 4), dtype=np.float32)
+_NULL_BOX_VALID = np.zeros(1, dtype=bool)
+
+
+def _scan_box_rows(buf: memoryview, max_rows: int) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    Decodes up to max_rows items of a msgpack array of boxes from the beginning of the buffer
+    stopping at the first incomplete item.
+    Returns the boxes, their validity mask and the number of the bytes consumed.
+    The runs of the fixed-layout rows between the nulls are decoded by numpy in the growing blocks,
+    the nulls and the irregular items - one by one.
+    """
+    boxes: List[np.ndarray] = []
+    valid: List[np.ndarray] = []
+    pos, rows, block = 0, 0, _SCAN_MIN_BLOCK_ROWS
+    while rows < max_rows and pos < len(buf):
+        if buf[pos] == _MSGPACK_NIL:
+            boxes.append(_NULL_BOX)
+            valid.append(_NULL_BOX_VALID)
+            pos += 1
+            rows += 1
+            continue
+        if buf[pos] == _MSGPACK_FIXARRAY_4 and pos + 1 < len(buf):
+            marker = buf[pos + 1]
+            row_dtype = _MSGPACK_F64_ROW if marker == _MSGPACK_FLOAT64 \
+                else _MSGPACK_F32_ROW if marker == _MSGPACK_FLOAT32 else None
+            if row_dtype is not None:
+                n = min(block, max_rows - rows, (len(buf) - pos) // row_dtype.itemsize)
+                fixed = _count_fixed_rows(buf, pos, n, row_dtype, marker) if n else 0
+                if fixed:
+                    boxes.append(_decode_fixed_rows(buf, pos, fixed, row_dtype, marker))
+                    valid.append(np.ones(fixed, dtype=bool))
+                    pos += fixed * row_dtype.itemsize
+                    rows += fixed
+                    block = block * 2 if fixed == n else _SCAN_MIN_BLOCK_ROWS
+                    continue
+        # irregular item (e.g. integer coordinates) or an incomplete row
+        unpacker = msgpack.Unpacker(raw=False)
+        unpacker.feed(buf[pos:pos + _MSGPACK_MAX_ROW_SIZE])
+        try:
+            item = unpacker.unpack()
+        except msgpack.OutOfData:
+            if pos + _MSGPACK_MAX_ROW_SIZE <= len(buf):
+                raise ValueError(f'Unexpected msgpack data in the character boxes at {pos}')
+            break
+        boxes.append(np.array([item], dtype=np.float32).reshape(1, 4) if item is not None else _NULL_BOX)
+        valid.append(np.ones(1, dtype=bool) if item is not None else _NULL_BOX_VALID)
+        pos += unpacker.tell()
+        rows += 1
+    if not boxes:
+        return np.empty((0, 4), dtype=np.float32), np.empty(0, dtype=bool), pos
+    return np.concatenate(boxes), np.concatenate(valid), pos
+
+
+class CharBoxes:
+    """
+    Bounding boxes [left, top, width, height] of the characters of a document stored column-wise:
+    a float32 (N, 4) array plus the mask of the characters having a box.
+    The boxes of a multi-million-character document take tens of megabytes this way
+    instead of hundreds as the lists of Python floats.
+    """
+
+    def __init__(self, boxes: np.ndarray, valid: Optional[np.ndarray] = None):
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.valid = np.ones(len(self.boxes), dtype=bool) if valid is None else np.asarray(valid, dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    def __getitem__(self, index: int) -> Optional[List[float]]:
+        return self.boxes[index].tolist() if self.valid[index] else None
+
+    @classmethod
+    def empty(cls) -> 'CharBoxes':
+        return cls(np.empty((0, 4), dtype=np.float32))
+
+    @classmethod
+    def from_list(cls, char_bboxes: Optional[List[Optional[List[float]]]]) -> 'CharBoxes':
+        if not char_bboxes:
+            return cls.empty()
+        valid = np.fromiter((bbox is not None for bbox in char_bboxes), dtype=bool, count=len(char_bboxes))
+        boxes = np.zeros((len(char_bboxes), 4), dtype=np.float32)
+        if valid.all():
+            boxes[:] = char_bboxes
+        else:
+            boxes[valid] = [bbox for bbox in char_bboxes if bbox is not None]
+        return cls(boxes, valid)
+
+    @classmethod
+    def from_packed(cls, data: Union[bytes, memoryview]) -> 'CharBoxes':
+        """
+        Decodes the little-endian float32 blob of the boxes following each other.
+        The characters having no box are stored as NaN rows.
+        The boxes are a view of the blob - it is copied only if it is read-only and has NaN rows to reset.
+        """
+        boxes = np.frombuffer(data, dtype='<f4').reshape(-1, 4)
+        valid = ~np.isnan(boxes).any(axis=1)
+        if not valid.all():
+            if not boxes.flags.writeable:
+                boxes = boxes.copy()
+            boxes[~valid] = 0
+        return cls(boxes, valid)
+
+    @classmethod
+    def from_msgpack(cls, data: Union[bytes, memoryview], offset: int = 0) -> 'CharBoxes':
+        """
+        Decodes the boxes from the msgpack value starting at the offset of the buffer:
+        either an array of [x, y, w, h] arrays or nulls or a bin with the packed float32 boxes.
+        The rows of the same-sized floats (the usual output of the Java extractor and of this class)
+        are decoded by numpy without creating a Python object per value.
+        """
+        buf = memoryview(data).cast('B')
+        if buf[offset] == _MSGPACK_NIL:
+            return cls.empty()
+        packed = _read_msgpack_bin(buf, offset)
+        if packed is not None:
+            return cls.from_packed(packed)
+        n, items_offset = _read_msgpack_array_header(buf, offset)
+        if n is not None:
+            for row_dtype, marker in ((_MSGPACK_F64_ROW, _MSGPACK_FLOAT64), (_MSGPACK_F32_ROW, _MSGPACK_FLOAT32)):
+                boxes = _decode_fixed_rows(buf, items_offset, n, row_dtype, marker)
+                if boxes is not None:
+                    return cls(boxes)
+            # the runs of the fixed-layout rows between the nulls and the irregular items
+            boxes, valid, _consumed = _scan_box_rows(buf[items_offset:], n)
+            if len(boxes) != n:
+                raise ValueError(f'Truncated character boxes: {len(boxes)} of {n} decoded')
+            return cls(boxes, valid)
+        # not an array - decoded by msgpack
+        unpacker = msgpack.Unpacker(raw=False, max_buffer_size=len(buf) - offset)
+        unpacker.feed(buf[offset:])
+        return cls.from_list(unpacker.unpack())
+
+    def to_list(self) -> List[Optional[List[float]]]:
+        boxes = self.boxes.tolist()
+        if not self.valid.all():
+            for i in np.flatnonzero(~self.valid):
+                boxes[i] = None
+        return boxes
+
+    def to_packed(self) -> bytes:
+        boxes = self.boxes.astype('<f4')
+        boxes[~self.valid] = np.nan
+        return boxes.tobytes()
+
+    def to_msgpack(self) -> bytes:
+        """
+        Packs the boxes into a msgpack array of [x, y, w, h] single float arrays or nulls.
+        The result is the same as of msgpack.packb(self.to_list(), use_single_float=True).
+        """
+        n = len(self.boxes)
+        rows = np.empty(n, dtype=_MSGPACK_F32_ROW)
+        rows['h'] = _MSGPACK_FIXARRAY_4
+        for i, field in enumerate(('x', 'y', 'w', 'hh')):
+            rows[f'm{i}'] = _MSGPACK_FLOAT32
+            rows[field] = self.boxes[:, i]
+        if self.valid.all():
+            return _msgpack_array_header(n) + rows.tobytes()
+        # a null takes the first byte of its row only
+        row_bytes = rows.view(np.uint8).reshape(n, _MSGPACK_F32_ROW.itemsize)
+        row_bytes[~self.valid, 0] = _MSGPACK_NIL
+        keep = np.ones(row_bytes.shape, dtype=bool)
+        keep[~self.valid, 1:] = False
+        return _msgpack_array_header(n) + row_bytes[keep].tobytes()
+
+    def to_paged_binary(self, pages: List[PlainTextPage]) -> bytes:
+        """
+        Serializes the boxes into the compact binary file with the page offset table
+        (see text_extraction_system_api.pdf_coordinates.paged_char_boxes).
+        """
+        header = PagedCharBoxesHeader.for_document(char_count=len(self.boxes), page_count=len(pages))
+        page_table = np.array([(page.start, page.end) for page in pages], dtype='<u8').reshape(-1, 2)
+        padding = header.boxes_offset - len(header.pack()) - page_table.nbytes
+        return header.pack() + page_table.tobytes() + bytes(padding) + self.to_packed()
+
+    def to_protobuf(self) -> bytes:
+        """
+        Serializes the boxes into the CharBboxes protobuf message.
+        The message is built by numpy right in the wire format: every box takes 20 bytes of a fixed layout,
+        a null is stored as an empty Coordinates message.
+        The result is the same as of serializing a CharBboxes message built item by item.
+        """
+        n = len(self.boxes)
+        items = np.empty(n, dtype=_PROTOBUF_COORDINATES_ITEM)
+        items['tag'] = _PROTOBUF_LEN_FIELD_1
+        items['len'] = _PROTOBUF_COORDINATES_ITEM.itemsize - 2
+        items['coords_tag'] = _PROTOBUF_LEN_FIELD_1
+        items['coords_len'] = _PROTOBUF_COORDINATES_ITEM.itemsize - 4
+        items['coords'] = self.boxes
+        if self.valid.all():
+            return items.tobytes()
+        item_bytes = items.view(np.uint8).reshape(n, _PROTOBUF_COORDINATES_ITEM.itemsize)
+        item_bytes[~self.valid, 1] = 0
+        keep = np.ones(item_bytes.shape, dtype=bool)
+        keep[~self.valid, 2:] = False
+        return item_bytes[keep].tobytes()
+
+    def to_json(self) -> str:
+        """
+        Formats the boxes as a json array of [x, y, w, h] arrays or nulls.
+        The numbers are formatted by numpy in the shortest form representing the float32 value exactly.
+        """
+        if not len(self.boxes):
+            return '[]'
+        values = self.boxes.astype(str)
+        rows = np.char.add(np.char.add(np.char.add('[', values[:, 0]), ', '), values[:, 1])
+        rows = np.char.add(np.char.add(np.char.add(rows, ', '), values[:, 2]), ', ')
+        rows = np.char.add(np.char.add(rows, values[:, 3]), ']')
+        rows = np.where(self.valid, rows, 'null')
+        return '[' + ', '.join(rows.tolist()) + ']'
+
+    def left_top(self, indexes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the left and top coordinates of the characters at the indexes.
+        The indexes out of the document are clipped to its last character.
+        """
+        indexes = np.clip(indexes, 0, len(self.boxes) - 1)
+        return self.boxes[indexes, 0], self.boxes[indexes, 1]
+
+    def find_closest_symbol_pos(self, x: float, y: float, page_loc_start: int, page_loc_end: int) -> int:
+        """
+        Returns the position of the character (between page_loc_start and page_loc_end)
+        which left-top corner is closest to the (x, y) point.
+        See CoordTextMap.find_closest_symbol_pos().
+        """
+        if page_loc_start == page_loc_end:
+            return page_loc_start
+        page_boxes = self.boxes[page_loc_start:page_loc_end, :2].astype(np.float64)
+        dist = (x - page_boxes[:, 0]) ** 2 + (y - page_boxes[:, 1]) ** 2
+        dist[~self.valid[page_loc_start:page_loc_end]] = np.inf
+        return page_loc_start + int(np.argmin(dist))
+
+
+@dataclass
+class ColumnarPDFCoordinates:
+    """
+    Server-side counterpart of text_extraction_system_api.dto.PDFCoordinates keeping the boxes in CharBoxes.
+    Serialized to the same json / msgpack structures the clients load as PDFCoordinates.
+    """
+    char_boxes: CharBoxes
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'char_bboxes': self.char_boxes.to_list()}
+
+    def to_json(self) -> str:
+        return '{"char_bboxes": ' + self.char_boxes.to_json() + '}'
+
+    def to_msgpack(self) -> bytes:
+        return b'\x81' + msgpack.packb('char_bboxes', use_bin_type=True) + self.char_boxes.to_msgpack()
+
+    def to_protobuf(self) -> bytes:
+        # CharBboxes message consists of the repeated char_bboxes field only
+        return self.char_boxes.to_protobuf()
+
+
+@dataclass
+class TextAndColumnarPDFCoordinates:
+    text_structure: PlainTextStructure
+    pdf_coordinates: ColumnarPDFCoordinates
+
+
+def unpack_pdfbox_result(data: bytes, char_bboxes_key: str = 'charBBoxes') -> Tuple[Dict[str, Any], CharBoxes]:
+    """
+    Unpacks the msgpack output of the Java text extractor (com.lexpredict.textextraction.dto.PDFPlainText).
+    The character boxes are decoded into CharBoxes directly from the buffer and are not included into the
+    returned dict - the other values are unpacked as usual.
+    """
+    unpacker = msgpack.Unpacker(raw=False, max_buffer_size=len(data))
+    unpacker.feed(data)
+    res: Dict[str, Any] = dict()
+    char_boxes = CharBoxes.empty()
+    for _ in range(unpacker.read_map_header()):
+        key = unpacker.unpack()
+        if key == char_bboxes_key:
+            char_boxes = CharBoxes.from_msgpack(data, unpacker.tell())
+            unpacker.skip()
+        else:
+            res[key] = unpacker.unpack()
+    return res, char_boxes
+
+
+def _read_exactly(unpacker: msgpack.Unpacker, buf: bytearray, read_size: int) -> bytearray:
+    pos = 0
+    while pos < len(buf):
+        data = unpacker.read_bytes(min(read_size, len(buf) - pos))
+        if not data:
+            raise msgpack.OutOfData(f'Unexpected end of the character boxes: {len(buf) - pos} bytes missing')
+        buf[pos:pos + len(data)] = data
+        pos += len(data)
+    return buf
+
+
+def _read_char_boxes(unpacker: msgpack.Unpacker, read_size: int) -> CharBoxes:
+    """
+    Reads the character boxes from the stream of the unpacker not reading anything past their end:
+    either a bin with the packed float32 boxes, an array of [x, y, w, h] arrays or nulls, or nil.
+    """
+    header = _read_exactly(unpacker, bytearray(1), read_size)
+    if header[0] == _MSGPACK_NIL:
+        return CharBoxes.empty()
+    size_len = {0xc4: 1, 0xc5: 2, 0xc6: 4, 0xdc: 2, 0xdd: 4}.get(header[0], 0)
+    header += _read_exactly(unpacker, bytearray(size_len), read_size)
+    if 0xc4 <= header[0] <= 0xc6:
+        # the blob is read into a writable buffer the boxes array is a view of
+        size = int.from_bytes(header[1:], 'big')
+        return CharBoxes.from_packed(_read_exactly(unpacker, bytearray(size), read_size))
+    remaining, _items_offset = _read_msgpack_array_header(memoryview(header), 0)
+    if remaining is None:
+        raise ValueError(f'Unexpected msgpack type of the character boxes: {header[0]:#x}')
+    boxes: List[np.ndarray] = []
+    valid: List[np.ndarray] = []
+    pending = b''
+    while remaining:
+        # every box takes at least a byte - never reading past the end of the array
+        data = unpacker.read_bytes(min(read_size, max(remaining - len(pending), 1)))
+        if not data:
+            raise msgpack.OutOfData(f'Unexpected end of the character boxes: {remaining} boxes missing')
+        buf = pending + data
+        chunk_boxes, chunk_valid, consumed = _scan_box_rows(memoryview(buf), remaining)
+        boxes.append(chunk_boxes)
+        valid.append(chunk_valid)
+        remaining -= len(chunk_boxes)
+        pending = buf[consumed:]
+    return CharBoxes(np.concatenate(boxes), np.concatenate(valid)) if boxes else CharBoxes.empty()
+
+
+def read_pdfbox_result(f: BinaryIO,
+                       char_bboxes_key: str = 'charBBoxes',
+                       read_size: int = 1024 * 1024) -> Tuple[Dict[str, Any], CharBoxes]:
+    """
+    Reads the msgpack output of the Java text extractor (com.lexpredict.textextraction.dto.PDFPlainText)
+    from the stream while it is being written - e.g. from the pipe the extractor writes to.
+    The same result as of unpack_pdfbox_result() but neither the raw output nor the Python lists
+    of the character boxes are held in memory: the boxes are decoded chunk by chunk into the numpy arrays
+    or, if the extractor packed them into a float32 blob, read into the buffer the boxes array is a view of.
+    """
+    unpacker = msgpack.Unpacker(f, raw=False, read_size=read_size, max_buffer_size=0)
+    res: Dict[str, Any] = dict()
+    char_boxes = CharBoxes.empty()
+    for _ in range(unpacker.read_map_header()):
+        key = unpacker.unpack()
+        if key == char_bboxes_key:
+            char_boxes = _read_char_boxes(unpacker, read_size)
+        else:
+            res[key] = unpacker.unpack()
+    return res, char_boxes
@@ -1,7 +1,6 @@
 import gc
 import os
 import shutil
-import subprocess
 from contextlib import contextmanager
 
 import cv2
@@ -9,11 +8,10 @@ from PIL import Image
 from dataclasses import dataclass
 from io import StringIO
 from logging import getLogger
-from subprocess import CompletedProcess, PIPE
 from tempfile import mkdtemp
-from typing import Tuple, Generator, Optional, Dict, Any, List
+from typing import Tuple, Generator, Optional, Dict, List, Union, Callable
 
-import msgpack
+import numpy as np
 from lexnlp.nlp.en.segments.paragraphs import get_paragraph_spans
 from lexnlp.nlp.en.segments.sections import get_document_sections_with_titles
 from lexnlp.nlp.en.segments.sentences import get_sentence_span_list
@@ -28,9 +26,14 @@ from pdfminer.pdfpage import PDFPage
 from pdfminer.pdfparser import PDFParser
 
 from text_extraction_system.config import get_settings
-from text_extraction_system.constants import TESSERACT_DEFAULT_LANGUAGE
+from text_extraction_system.data_extract.char_boxes import CharBoxes, ColumnarPDFCoordinates, \
+    TextAndColumnarPDFCoordinates, read_pdfbox_result
 from text_extraction_system.data_extract.lang import get_lang_detector
-from text_extraction_system.ocr.ocr import ocr_page_to_pdf, get_page_orientation, OCRException
+from text_extraction_system.data_extract.structure import find_pages, find_section_ends, find_closest_symbols, \
+    page_bounds
+from text_extraction_system.java_worker.java_worker import run_java_class, run_java_class_reading_pipe
+from text_extraction_system.ocr.ocr import ocr_page_to_pdf
+from text_extraction_system.ocr.page_analysis import PageAnalysisContext
 from text_extraction_system.ocr.rotation_detection import determine_rotation, \
     RotationDetectionMethod, PageRotationStatus
 from text_extraction_system.pdf.pdf import extract_page_ocr_images, \
@@ -38,10 +41,7 @@ from text_extraction_system.pdf.pdf import extract_page_ocr_images, \
 from text_extraction_system.processes import raise_from_process
 from text_extraction_system.utils import LanguageConverter
 from text_extraction_system_api.dto import PlainTextParagraph, PlainTextSection, PlainTextPage, \
-    PlainTextStructure, PlainTextSentence, TextAndPDFCoordinates, PDFCoordinates, \
-    PlainTableOfContentsRecord
-from text_extraction_system_api.pdf_coordinates.pdf_coords_common import find_page_by_smb_index
-from text_extraction_system_api.pdf_coordinates.coord_text_map import CoordTextMap
+    PlainTextStructure, PlainTextSentence, PlainTableOfContentsRecord
 
 log = getLogger(__name__)
 PAGE_SEPARATOR = '\n\n\f'
@@ -56,15 +56,13 @@ def extract_text_and_structure(pdf_fn: str,
                                correct_pdf: bool = False,
                                render_coords_debug: bool = False,
                                read_sections_from_toc: bool = True) \
-        -> Tuple[
-            str, TextAndPDFCoordinates, str, Dict[int, float]]:  # text, structure, corrected_pdf_fn, page_rotate_angles
+        -> Tuple[  # text, structure, corrected_pdf_fn, page_rotate_angles
+            str, TextAndColumnarPDFCoordinates, str, Dict[int, float]]:
     # pdf_fn file already contains text, no OCR is required at this step
 
     if render_coords_debug:
         correct_pdf = True
 
-    java_modules_path = get_settings().java_modules_path
-
     # Convert language to language code
     lang_converter = LanguageConverter()
     language, locale_code = lang_converter.get_language_and_locale_code(language)
@@ -73,11 +71,10 @@ def extract_text_and_structure(pdf_fn: str,
     out_fn = os.path.join(temp_dir, os.path.splitext(os.path.basename(pdf_fn))[0] + '.msgpack')
     out_pdf_fn = pdf_fn
     try:
-        args = ['java', '-cp', f'{java_modules_path}/*',
-                'com.lexpredict.textextraction.GetTextFromPDF',
-                pdf_fn,
+        args = [pdf_fn,
                 out_fn,
-                '-f', 'pages_msgpack']
+                # the char boxes are written as a single float32 blob - see PackedCharBBoxesSerializer.java
+                '-f', 'pages_msgpack_packed_boxes']
 
         if pdf_password:
             args.append('-p')
@@ -91,8 +88,15 @@ def extract_text_and_structure(pdf_fn: str,
             if render_coords_debug:
                 args.append('-render_char_rects')
 
-        completed_process: CompletedProcess = subprocess.run(args, check=False, timeout=timeout_sec,
-                                                             universal_newlines=True, stderr=PIPE, stdout=PIPE)
+        try:
+            gc.disable()
+            # see object structure in com.lexpredict.textextraction.dto.PDFPlainText
+            # the result is decoded from the pipe while the Java extractor is still writing it,
+            # the character boxes go into numpy arrays not passing through the Python lists
+            completed_process, pdfbox_result = run_java_class_reading_pipe(
+                'com.lexpredict.textextraction.GetTextFromPDF', args, out_fn, read_pdfbox_result, timeout_sec)
+        finally:
+            gc.enable()
         try:
             log.info('Page rotation data:')
             log.info(completed_process.stdout)
@@ -102,18 +106,12 @@ def extract_text_and_structure(pdf_fn: str,
 
         raise_from_pdfbox_error_messages(completed_process)
 
-        with open(out_fn, 'rb') as pages_f:
-            try:
-                gc.disable()
-                # see object structure in com.lexpredict.textextraction.dto.PDFPlainText
-                pdfbox_res: Dict[str, Any] = msgpack.unpack(pages_f, raw=False)
-            finally:
-                gc.enable()
+        pdfbox_res, char_boxes = pdfbox_result
 
         # Remove Null characters because of incompatibility with PostgreSQL
         text = pdfbox_res['text'].replace("\x00", "")
         if len(text) == 0:
-            pdf_coordinates = PDFCoordinates(char_bboxes=pdfbox_res['charBBoxes'])
+            pdf_coordinates = ColumnarPDFCoordinates(char_boxes=char_boxes)
             text_struct = PlainTextStructure(title='',
                                              language=language or 'en',  # FastText returns English for empty strings
                                              pages=[],
@@ -122,7 +120,7 @@ def extract_text_and_structure(pdf_fn: str,
                                              sections=[],
                                              table_of_contents=[])
             yield text, \
-                  TextAndPDFCoordinates(text_structure=text_struct, pdf_coordinates=pdf_coordinates), \
+                  TextAndColumnarPDFCoordinates(text_structure=text_struct, pdf_coordinates=pdf_coordinates), \
                   out_pdf_fn, \
                   None
 
@@ -148,23 +146,37 @@ def extract_text_and_structure(pdf_fn: str,
 
         sentence_spans = get_sentence_span_list(text)
 
-        lang = get_lang_detector()
+        paragraph_spans = list(get_paragraph_spans(text))
+
+        if language:
+            sentence_langs = [language] * len(sentence_spans)
+            paragraph_langs = [language] * len(paragraph_spans)
+        else:
+            lang = get_lang_detector()
+            propagate_min_confidence = get_settings().lang_propagation_min_confidence
+            if propagate_min_confidence is not None:
+                paragraph_langs, sentence_langs = lang.predict_nested_langs(paragraph_spans,
+                                                                            sentence_spans,
+                                                                            propagate_min_confidence)
+            else:
+                sentence_langs = lang.predict_langs([segment for _start, _end, segment in sentence_spans])
+                paragraph_langs = lang.predict_langs([segment for _start, _end, segment in paragraph_spans])
 
         sentences = [PlainTextSentence(start=start,
                                        end=end,
-                                       language=language or lang.predict_lang(segment))
-                     for start, end, segment in sentence_spans]
+                                       language=sentence_lang)
+                     for (start, end, _segment), sentence_lang in zip(sentence_spans, sentence_langs)]
 
         # There was a try-except in Contraxsuite catching some lexnlp exception.
         # Not putting it here because it should be solved on lexnlp side.
         paragraphs = [PlainTextParagraph(start=start,
                                          end=end,
-                                         language=language or lang.predict_lang(segment))
-                      for start, end, segment, in get_paragraph_spans(text)]
+                                         language=paragraph_lang)
+                      for (start, end, _segment), paragraph_lang in zip(paragraph_spans, paragraph_langs)]
 
         if read_sections_from_toc and table_of_contents:
             sections = get_sections_from_table_of_contents(table_of_contents,
-                                                           pdfbox_res['charBBoxes'],
+                                                           char_boxes,
                                                            pages)
         else:
             sections = [PlainTextSection(title=sect.title,
@@ -178,7 +190,7 @@ def extract_text_and_structure(pdf_fn: str,
                                          top=0,
                                          page=0)
                         for sect in get_document_sections_with_titles(text, sentence_list=sentence_spans)]
-            set_section_coordinates(sections, pdfbox_res['charBBoxes'], pages)
+            set_section_coordinates(sections, char_boxes, pages)
 
         try:
             title = next(get_titles(text))
@@ -187,17 +199,16 @@ def extract_text_and_structure(pdf_fn: str,
 
         text_struct = PlainTextStructure(
             title=title,
-            language=language or lang.predict_lang(text),
+            language=language or get_lang_detector().predict_lang(text),
             pages=pages,
             sentences=sentences,
             paragraphs=paragraphs,
             sections=sections,
             table_of_contents=table_of_contents)
 
-        char_bboxes = pdfbox_res['charBBoxes']
-        pdf_coordinates = PDFCoordinates(char_bboxes=char_bboxes)
-        yield text, TextAndPDFCoordinates(text_structure=text_struct,
-                                          pdf_coordinates=pdf_coordinates), out_pdf_fn, page_rotate_angles
+        pdf_coordinates = ColumnarPDFCoordinates(char_boxes=char_boxes)
+        yield text, TextAndColumnarPDFCoordinates(text_structure=text_struct,
+                                                  pdf_coordinates=pdf_coordinates), out_pdf_fn, page_rotate_angles
         return
 
     finally:
@@ -205,61 +216,62 @@ def extract_text_and_structure(pdf_fn: str,
 
 
 def set_section_coordinates(sections: List[PlainTextSection],
-                            char_bboxes: List[List[float]],
+                            char_boxes: Union[CharBoxes, List[List[float]]],
                             pages: List[PlainTextPage]):
     # calculates left / top coordinates and the page number
     # for each section found by ML in plain text
-    page_bounds = [(p.start, p.end) for p in pages]
-    for sect in sections:
-        char_index = sect.start if sect.start < len(char_bboxes) else len(char_bboxes) - 1
-        sect.left = char_bboxes[char_index][0]
-        sect.top = char_bboxes[char_index][1]
-        sect.page = find_page_by_smb_index(page_bounds, sect.start) or 0
+    if not sections:
+        return
+    if not isinstance(char_boxes, CharBoxes):
+        char_boxes = CharBoxes.from_list(char_boxes)
+    starts = np.array([sect.start for sect in sections], dtype=np.int64)
+    lefts, tops = char_boxes.left_top(starts)
+    sect_pages = find_pages(*page_bounds(pages), starts)
+    for sect, left, top, page in zip(sections, lefts.tolist(), tops.tolist(), sect_pages.tolist()):
+        sect.left = left
+        sect.top = top
+        sect.page = page
 
 
 def get_sections_from_table_of_contents(
         toc_items: List[PlainTableOfContentsRecord],
-        char_bboxes: List[List[float]],
+        char_boxes: Union[CharBoxes, List[List[float]]],
         pages: List[PlainTextPage]) -> List[PlainTextSection]:
     """
+    Builds the sections from the table of contents read from the PDF.
+    A section starts at the character closest to the TOC item coordinates on its page
+    and ends where the next section of the same or a higher level starts.
     """
+    if not isinstance(char_boxes, CharBoxes):
+        char_boxes = CharBoxes.from_list(char_boxes)
+    if not toc_items:
+        return []
+    page_starts, page_ends = page_bounds(pages)
+    toc_pages = np.array([ti.page for ti in toc_items], dtype=np.int64)
+    # NB: we don't invert Y-coordinate here
+    starts = find_closest_symbols(char_boxes,
+                                  np.array([ti.left for ti in toc_items], dtype=np.float64),
+                                  np.array([ti.top for ti in toc_items], dtype=np.float64),
+                                  page_starts[toc_pages],
+                                  page_ends[toc_pages])
+    order = np.argsort(starts, kind='stable')
+    starts = starts[order]
+    ends = find_section_ends(starts, np.array([toc_items[i].level for i in order.tolist()]), int(page_ends[-1]))
+
     sects: List[PlainTextSection] = []
-    for ti in toc_items:
-        sect = PlainTextSection(start=0,
-                                end=0,
-                                title=ti.title,
-                                title_start=0,
-                                title_end=0,
-                                level=ti.level,
-                                abs_level=ti.level,
-                                left=ti.left,
-                                top=ti.top,
-                                page=ti.page)
-        # find coordinates (start / end) by left and top
-        page = pages[ti.page]
-        top = ti.top  # NB: we don't invert Y-coordinate here
-        start = CoordTextMap.find_closest_symbol_pos(char_bboxes, ti.left, top, page.start, page.end)
-        sect.start = start
-        sect.end = start + 1
-        sects.append(sect)
-    sects.sort(key=lambda s: s.start)
-
-    # make the beginning of the next section the ending of the current one
-    for i, sect in enumerate(sects):
-        last_page = pages[-1]
-        sect.end = last_page.end
-        # find the next section on the same level
-        # or assume the section ends with the last document symbol
-        for j in range(i + 1, len(sects)):
-            if sects[j].level > sect.level:
-                continue
-            sect.end = sects[j].start
-            break
-
-        sect.title_start = sect.start
-        sect.title_end = sect.title_start + len(sect.title)
+    for i, start, end in zip(order.tolist(), starts.tolist(), ends.tolist()):
+        ti = toc_items[i]
         # TODO: detect title start - title end
-
+        sects.append(PlainTextSection(start=start,
+                                      end=end,
+                                      title=ti.title,
+                                      title_start=start,
+                                      title_end=start + len(ti.title),
+                                      level=ti.level,
+                                      abs_level=ti.level,
+                                      left=ti.left,
+                                      top=ti.top,
+                                      page=ti.page))
     return sects
 
 
@@ -300,6 +312,10 @@ class PDFPageProcessingResults:
     ocred_page_fn: Optional[str] = None
     ocred_page_rotation_angle: Optional[float] = None
     rotation_angle: Optional[float] = None
+    # orientation detected by Tesseract and corrected before the rotation detection
+    orientation_angle: Optional[int] = None
+    # the text layer is not OCR-ed but taken by restore_text_layer(..)
+    text_layer_restored: bool = False
 
 
 @contextmanager
@@ -308,34 +324,37 @@ def process_pdf_page(pdf_fn: str,
                      ocr_enabled: bool = True,
                      ocr_language: str = None,
                      ocr_timeout_sec: int = 60,
-                     detect_orientation_tesseract=False) -> PDFPageProcessingResults:
+                     detect_orientation_tesseract=False,
+                     restore_text_layer: Optional[Callable[[Optional[int], float], bool]] = None) \
+        -> PDFPageProcessingResults:
+    """
+    :param restore_text_layer: called with the orientation and rotation angles of the page image
+    before OCR-ing it; returns True if the text layer of the page rotated by these angles is available
+    elsewhere (e.g. in the result cache) and the page should not be OCR-ed.
+    """
     if not ocr_enabled:
         yield PDFPageProcessingResults(page_requires_ocr=False)
         return
 
     rot_angle = 0
-    orientation = None
-    if detect_orientation_tesseract:
-        try:
-            orientation = get_page_orientation(page_image_without_text_fn,
-                                               language=ocr_language or TESSERACT_DEFAULT_LANGUAGE)
-        except Exception as e:
-            error_text = OCRException.TOO_FEW_CHARACTERS_ERROR if OCRException.TOO_FEW_CHARACTERS_ERROR in str(e) else e
-            log.error(f'Cant get page orientation by Tesseract: {error_text}')
-
-        # TODO: presently orientation "probability" threshold is taken arbitrary
-        ORIENTATION_THRESHOLD = 3
-        if orientation and orientation[0] and orientation[1] > ORIENTATION_THRESHOLD:
-            # rotate the document
-            # rotate_pdf_pages(pdf_fn, pdf_fn, orientation[0])
-            # rotate the image
-            rotate_image(orientation[0], page_image_without_text_fn, page_image_without_text_fn)
+    orientation_angle = None
+    # Tesseract OSD is executed for the page image only once and its results are shared
+    # by the orientation correction, rotation detection and OCR below
+    page_context = PageAnalysisContext(page_image_without_text_fn, dpi=DPI)
+    if detect_orientation_tesseract and page_context.orientation_confident():
+        # rotate the document
+        # rotate_pdf_pages(pdf_fn, pdf_fn, orientation[0])
+        # rotate the image
+        orientation_angle = page_context.osd.orientation
+        rotate_image(orientation_angle, page_image_without_text_fn, page_image_without_text_fn)
+        page_context.mark_orientation_corrected()
 
     # the image might be rotated. Then we try to determine the image rotation angle
     # based on opencv algorithms and rotate the image back.
     # Even if the image is still rotated, OCR will extract the text. That's fine
     # if the image rotation angle is a multiple of 90 degree.
-    rot_status = determine_rotation(page_image_without_text_fn, RotationDetectionMethod.DILATED_ROWS)
+    rot_status = determine_rotation(page_image_without_text_fn, RotationDetectionMethod.DILATED_ROWS,
+                                    pre_calculated_orientation=page_context.orientation)
 
     if should_correct_rotation(pdf_fn, rot_status):
         # we don't rotate images by more than 45 degree angle
@@ -347,19 +366,28 @@ def process_pdf_page(pdf_fn: str,
         # rotate extracted image
         rotate_image(rot_angle, page_image_without_text_fn, page_image_without_text_fn)
 
+    if restore_text_layer and restore_text_layer(orientation_angle, rot_angle):
+        yield PDFPageProcessingResults(page_requires_ocr=True,
+                                       rotation_angle=rot_angle,
+                                       orientation_angle=orientation_angle,
+                                       text_layer_restored=True)
+        return
+
     # this returns a text-based PDF with glyph-less text only
     # to be used for merging in front of the original PDF page layout
     with ocr_page_to_pdf(page_image_fn=page_image_without_text_fn,
                          language=ocr_language,
                          timeout=ocr_timeout_sec,
                          glyphless_text_only=True,
-                         tesseract_page_orientation_detection=True) as ocred_text_layer_pdf_fn:
+                         tesseract_page_orientation_detection=page_context.ocr_requires_orientation_detection) \
+            as ocred_text_layer_pdf_fn:
         # we return only the transparent text layer PDF and not the merged page
         # because in the final step we will need to merge these transparent layer in front
         # of the pages in the original PDF file to keep its small size and structure/bookmarks.
         yield PDFPageProcessingResults(page_requires_ocr=True,
                                        ocred_page_fn=ocred_text_layer_pdf_fn,
-                                       rotation_angle=rot_angle)
+                                       rotation_angle=rot_angle,
+                                       orientation_angle=orientation_angle)
 
 
 def normalize_angle_90(rot_angle: float) -> float:
@@ -396,16 +424,11 @@ def should_correct_rotation(pdf_fn: str, rot_status: PageRotationStatus) -> bool
     if rot_status.occupied_area_percent is None:
         return True
 
-    java_modules_path = get_settings().java_modules_path
-    args = ['java', '-cp', f'{java_modules_path}/*',
-            'com.lexpredict.textextraction.PDFSymbolsCalculator',
-            '--original-pdf', pdf_fn]
-
     # compare area, occupied by image parts (that might be text) and the rest of the page
     try:
-        p = subprocess.Popen(args, stderr=PIPE, stdout=PIPE)
-        (out, err) = p.communicate()
-        symbol_count = int(out.decode("utf-8"))
+        completed_process = run_java_class('com.lexpredict.textextraction.PDFSymbolsCalculator',
+                                           ['--original-pdf', pdf_fn])
+        symbol_count = int(completed_process.stdout)
     except Exception as e:
         log.error(f'Error in should_correct_rotation({pdf_fn}) while calling PDFSymbolsCalculator: {e}')
         symbol_count = 0
@@ -1,5 +1,5 @@
 import re
-from typing import Optional
+from typing import Optional, List, Tuple
 
 # we instantiate this _ class instead of using load_model
 # to avoid printing a useless warning coded in load_model
@@ -26,6 +26,48 @@ class FastTextLangDetector:
         # the model returns labels in format: __label__en
         return label[9:]
 
+    def predict_langs_with_confidence(self, texts: List[str]) -> List[Tuple[str, float]]:
+        """
+        Detects the languages of the texts with a single call to FastText.
+        Returns the list of (language, probability) in the order of the texts.
+        """
+        if not texts:
+            return []
+        labels, probs = self.model.predict([TO_REMOVE.sub(' ', text) for text in texts])
+        return [(label[0][9:], float(prob[0])) for label, prob in zip(labels, probs)]
+
+    def predict_langs(self, texts: List[str]) -> List[str]:
+        return [lang for lang, _prob in self.predict_langs_with_confidence(texts)]
+
+    def predict_nested_langs(self,
+                             outer_spans: List[Tuple[int, int, str]],
+                             inner_spans: List[Tuple[int, int, str]],
+                             min_confidence: float) -> Tuple[List[str], List[str]]:
+        """
+        Detects the languages of the outer text spans (e.g. paragraphs) and of the inner ones (e.g. sentences).
+        An inner span located entirely inside an outer span detected with the probability not less than
+        min_confidence gets the language of the outer span without running the detection.
+        The languages of the rest of the inner spans are detected in a batch.
+        Both lists of the spans are (start, end, text) sorted by start.
+        Returns the lists of the languages of the outer and the inner spans.
+        """
+        outer_res = self.predict_langs_with_confidence([text for _start, _end, text in outer_spans])
+        inner_langs: List[Optional[str]] = [None] * len(inner_spans)
+        to_detect: List[int] = list()
+        i_outer = 0
+        for i_inner, (start, end, _text) in enumerate(inner_spans):
+            while i_outer < len(outer_spans) and outer_spans[i_outer][1] <= start:
+                i_outer += 1
+            if i_outer < len(outer_spans) \
+                    and outer_spans[i_outer][0] <= start and end <= outer_spans[i_outer][1] \
+                    and outer_res[i_outer][1] >= min_confidence:
+                inner_langs[i_inner] = outer_res[i_outer][0]
+            else:
+                to_detect.append(i_inner)
+        for i_inner, lang in zip(to_detect, self.predict_langs([inner_spans[i][2] for i in to_detect])):
+            inner_langs[i_inner] = lang
+        return [lang for lang, _prob in outer_res], inner_langs
+
 
 _lang_detector: Optional[FastTextLangDetector] = None
 
@@ -0,0 +1,72 @@
+import text_extraction_system_api.python_pb2_files.contract_pages_pb2 as pages_pb2
+import text_extraction_system_api.python_pb2_files.contract_tables_pb2 as tables_pb2
+from text_extraction_system_api.dto import PlainTextStructure, TableList
+
+# The protobuf messages are built field by field from the DTOs.
+# Going through to_dict() -> json -> google.protobuf.json_format.Parse() makes three extra copies
+# of the whole structure and is several times slower.
+# The pdf coordinates are serialized by ColumnarPDFCoordinates.to_protobuf().
+
+
+def text_structure_to_protobuf(text_structure: PlainTextStructure) -> bytes:
+    msg = pages_pb2.Pages()
+    if text_structure.title is not None:
+        msg.title.value = text_structure.title
+    if text_structure.language is not None:
+        msg.language.value = text_structure.language
+
+    for page in text_structure.pages:
+        page_msg = msg.pages.add(number=page.number, start=page.start, end=page.end, bbox=page.bbox)
+        if page.rotation is not None:
+            page_msg.rotation = page.rotation
+
+    for sentence in text_structure.sentences:
+        sentence_msg = msg.sentences.add(start=sentence.start, end=sentence.end)
+        if sentence.language is not None:
+            sentence_msg.language.value = sentence.language
+
+    for paragraph in text_structure.paragraphs:
+        paragraph_msg = msg.paragraphs.add(start=paragraph.start, end=paragraph.end)
+        if paragraph.language is not None:
+            paragraph_msg.language.value = paragraph.language
+
+    for sect in text_structure.sections:
+        sect_msg = msg.sections.add(start=sect.start,
+                                    end=sect.end,
+                                    level=sect.level,
+                                    abs_level=sect.abs_level,
+                                    left=sect.left,
+                                    top=sect.top,
+                                    page=sect.page)
+        if sect.title is not None:
+            sect_msg.title.value = sect.title
+        if sect.title_start is not None:
+            sect_msg.title_start = sect.title_start
+        if sect.title_end is not None:
+            sect_msg.title_end = sect.title_end
+
+    for toc_item in text_structure.table_of_contents:
+        toc_msg = msg.table_of_contents.add(level=toc_item.level,
+                                            left=toc_item.left,
+                                            top=toc_item.top,
+                                            page=toc_item.page)
+        if toc_item.title is not None:
+            toc_msg.title.value = toc_item.title
+
+    return msg.SerializeToString()
+
+
+def tables_to_protobuf(tables: TableList) -> bytes:
+    msg = tables_pb2.TableList()
+    for table in tables.tables:
+        table_msg = msg.tables.add()
+        coords = table.coordinates
+        table_msg.coordinates.left = coords.left
+        table_msg.coordinates.top = coords.top
+        table_msg.coordinates.width = coords.width
+        table_msg.coordinates.height = coords.height
+        for row in table.data:
+            table_msg.data.add(cells=row)
+        if table.page is not None:
+            table_msg.page = table.page
+    return msg.SerializeToString()
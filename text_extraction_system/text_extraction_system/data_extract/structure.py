@@ -0,0 +1,88 @@
+from typing import Tuple, List
+
+import numpy as np
+
+from text_extraction_system.data_extract.char_boxes import CharBoxes
+from text_extraction_system_api.dto import PlainTextPage
+
+# Assembling of the document structure (pages, sections, table of contents) on the arrays of spans.
+# All positions are character indexes in the document text, pages are given by the arrays
+# of their starts and ends sorted by start.
+
+# Max number of the elements in the distance matrix computed at once when matching the TOC items
+# to the characters of a page.
+_MAX_DISTANCE_MATRIX_SIZE = 4 * 1024 * 1024
+
+
+def find_pages(page_starts: np.ndarray, page_ends: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    """
+    Returns the indexes of the pages containing the positions: page_start <= position < page_end.
+    -1 for the positions out of any page.
+    Position 0 always belongs to the first page - the same as in find_page_by_smb_index().
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    if not len(page_starts):
+        return np.full(len(positions), -1, dtype=np.int64)
+    pages = np.searchsorted(page_starts, positions, side='right') - 1
+    found = (pages >= 0) & (positions < page_ends[np.maximum(pages, 0)])
+    pages[~found] = -1
+    pages[positions == 0] = 0
+    return pages
+
+
+def find_section_ends(starts: np.ndarray, levels: np.ndarray, doc_end: int) -> np.ndarray:
+    """
+    Returns the ends of the sections sorted by start.
+    A section ends where the next section of the same or a higher (lower number) level starts
+    or at the end of the document.
+    Single pass with the stack of the sections still waiting for their end.
+    """
+    ends = np.full(len(starts), doc_end, dtype=np.int64)
+    levels = levels.tolist()
+    open_sections = []
+    for i, (start, level) in enumerate(zip(starts.tolist(), levels)):
+        while open_sections and levels[open_sections[-1]] >= level:
+            ends[open_sections.pop()] = start
+        open_sections.append(i)
+    return ends
+
+
+def find_closest_symbols(char_boxes: CharBoxes,
+                         xs: np.ndarray,
+                         ys: np.ndarray,
+                         page_starts: np.ndarray,
+                         page_ends: np.ndarray) -> np.ndarray:
+    """
+    Returns the positions of the characters which left-top corners are closest to the (x, y) points.
+    Each point is searched among the characters of its page: page_starts[i] <= position < page_ends[i].
+    The same result as CharBoxes.find_closest_symbol_pos() called for each point
+    but the points of a page are matched against its characters at once.
+    """
+    positions = np.array(page_starts, dtype=np.int64)
+    page_starts = positions.copy()
+    page_ends = np.asarray(page_ends, dtype=np.int64)
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    pages, point_pages = np.unique(np.stack([page_starts, page_ends], axis=1), axis=0, return_inverse=True)
+    point_pages = point_pages.reshape(-1)
+    for page_i, (start, end) in enumerate(pages.tolist()):
+        if start >= end:
+            continue
+        points = np.flatnonzero(point_pages == page_i)
+        corners = char_boxes.boxes[start:end, :2].astype(np.float64)
+        invalid = ~char_boxes.valid[start:end]
+        chunk = max(1, _MAX_DISTANCE_MATRIX_SIZE // (end - start))
+        for chunk_start in range(0, len(points), chunk):
+            chunk_points = points[chunk_start:chunk_start + chunk]
+            dist = (xs[chunk_points, None] - corners[None, :, 0]) ** 2 \
+                + (ys[chunk_points, None] - corners[None, :, 1]) ** 2
+            dist[:, invalid] = np.inf
+            positions[chunk_points] = start + np.argmin(dist, axis=1)
+    return positions
+
+
+def page_bounds(pages: List[PlainTextPage]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the arrays of the starts and ends of the PlainTextPage-s.
+    """
+    return np.array([p.start for p in pages], dtype=np.int64), np.array([p.end for p in pages], dtype=np.int64)
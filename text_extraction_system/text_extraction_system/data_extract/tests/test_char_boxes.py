@@ -0,0 +1,127 @@
+import io
+import json
+import os
+import threading
+
+import msgpack
+import numpy as np
+
+from text_extraction_system_api.dto import PlainTextPage
+from text_extraction_system_api.pdf_coordinates.paged_char_boxes import PagedCharBoxesHeader, read_page_boxes
+
+from text_extraction_system.data_extract.char_boxes import CharBoxes, ColumnarPDFCoordinates, unpack_pdfbox_result, \
+    read_pdfbox_result
+
+
+def test_unpack_pdfbox_result():
+    char_bboxes = [[10.5, 20.25, 5.0, 8.0], [16.0, 20.25, 4.5, 8.0], [0.0, 0.0, 0.0, 0.0]]
+    data = msgpack.packb({'text': 'ab\n', 'charBBoxes': char_bboxes, 'pages': []}, use_bin_type=True)
+    res, char_boxes = unpack_pdfbox_result(data)
+    assert res == {'text': 'ab\n', 'pages': []}
+    assert char_boxes.boxes.dtype == np.float32
+    assert char_boxes.to_list() == char_bboxes
+
+
+def _read_pdfbox_result_from_pipe(data: bytes):
+    read_fd, write_fd = os.pipe()
+
+    def write():
+        # small writes - the reader gets the data in arbitrary pieces
+        with os.fdopen(write_fd, 'wb', buffering=0) as w:
+            for i in range(0, len(data), 1000):
+                w.write(data[i:i + 1000])
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    with os.fdopen(read_fd, 'rb', buffering=0) as f:
+        res = read_pdfbox_result(f, read_size=4096)
+    writer.join()
+    return res
+
+
+def test_read_pdfbox_result():
+    rng = np.random.default_rng(1)
+    char_bboxes = [None if i % 37 == 0 else [1, 2, 3, 4] if i % 101 == 0 else [1.5, 2, 3.25, 4.5] if i % 211 == 0
+                   else (rng.random(4) * 600).tolist() for i in range(20000)]
+    # the boxes are followed by other values which must not be consumed while reading the boxes
+    data = msgpack.packb({'text': 'a' * len(char_bboxes),
+                          'charBBoxes': char_bboxes,
+                          'pages': [{'bbox': [0, 0, 600, 800], 'location': [0, len(char_bboxes)]}],
+                          'tableOfContents': []}, use_bin_type=True)
+    res, char_boxes = _read_pdfbox_result_from_pipe(data)
+
+    expected_res, expected_char_boxes = unpack_pdfbox_result(data)
+    assert res == expected_res
+    assert char_boxes.valid.tolist() == expected_char_boxes.valid.tolist()
+    assert char_boxes.boxes.tolist() == expected_char_boxes.boxes.tolist()
+    assert char_boxes.to_list()[:2] == [None, np.array(char_bboxes[1], dtype=np.float32).tolist()]
+
+
+def test_read_pdfbox_result_packed_boxes():
+    # the output of GetTextFromPDF -f pages_msgpack_packed_boxes
+    boxes = (np.random.default_rng(1).random((5000, 4)) * 600).astype(np.float32)
+    boxes[::50] = np.nan
+    data = msgpack.packb({'text': 'a' * len(boxes),
+                          'charBBoxes': boxes.astype('<f4').tobytes(),
+                          'pages': [{'bbox': [0, 0, 600, 800], 'location': [0, len(boxes)]}]}, use_bin_type=True)
+    res, char_boxes = _read_pdfbox_result_from_pipe(data)
+    assert res == {'text': 'a' * len(boxes), 'pages': [{'bbox': [0, 0, 600, 800], 'location': [0, len(boxes)]}]}
+    assert char_boxes.valid.tolist() == [i % 50 != 0 for i in range(len(boxes))]
+    assert char_boxes.boxes[char_boxes.valid].tolist() == boxes[char_boxes.valid].tolist()
+    assert not char_boxes.boxes[~char_boxes.valid].any()
+    assert unpack_pdfbox_result(data)[1].boxes.tolist() == char_boxes.boxes.tolist()
+
+
+def test_from_packed_zero_copy():
+    boxes = np.arange(40, dtype='<f4').reshape(10, 4)
+    boxes[3] = np.nan
+    blob = bytearray(boxes.tobytes())
+    char_boxes = CharBoxes.from_packed(blob)
+    assert np.shares_memory(char_boxes.boxes, np.frombuffer(blob, dtype='<f4'))
+    assert char_boxes.valid.tolist() == [i != 3 for i in range(10)]
+    assert char_boxes[3] is None
+    # a read-only blob is copied only to reset the NaN rows
+    assert CharBoxes.from_packed(bytes(blob)).boxes[3].tolist() == [0, 0, 0, 0]
+
+
+def test_nulls():
+    char_bboxes = [[1, 2, 3, 4], None, [1.5, 2.5, 3.5, 4.5]]
+    char_boxes = CharBoxes.from_msgpack(msgpack.packb(char_bboxes))
+    assert char_boxes.valid.tolist() == [True, False, True]
+    assert char_boxes.to_list() == char_bboxes
+    assert json.loads(char_boxes.to_json()) == char_bboxes
+    assert CharBoxes.from_packed(char_boxes.to_packed()).to_list() == char_bboxes
+    assert char_boxes.find_closest_symbol_pos(0, 0, 0, 3) == 0
+
+
+def test_serialization_compatible():
+    boxes = (np.random.default_rng(1).random((1000, 4)) * 600).astype(np.float32)
+    pdf_coordinates = ColumnarPDFCoordinates(char_boxes=CharBoxes(boxes))
+    assert pdf_coordinates.to_msgpack() == msgpack.packb(pdf_coordinates.to_dict(),
+                                                         use_bin_type=True,
+                                                         use_single_float=True)
+    assert CharBoxes.from_msgpack(CharBoxes(boxes).to_msgpack()).boxes.tolist() == boxes.tolist()
+    # json keeps the shortest representation of the float32 values
+    json_boxes = json.loads(pdf_coordinates.to_json())['char_bboxes']
+    assert np.array(json_boxes, dtype=np.float32).tolist() == boxes.tolist()
+
+
+def test_find_closest_symbol_pos():
+    char_boxes = CharBoxes(np.array([[0, 0, 1, 1], [10, 10, 1, 1], [20, 10, 1, 1], [30, 10, 1, 1]]))
+    assert char_boxes.find_closest_symbol_pos(19, 11, 0, 4) == 2
+    assert char_boxes.find_closest_symbol_pos(19, 11, 3, 4) == 3
+    assert char_boxes.find_closest_symbol_pos(19, 11, 2, 2) == 2
+    lefts, tops = char_boxes.left_top(np.array([1, 100]))
+    assert lefts.tolist() == [10, 30] and tops.tolist() == [10, 10]
+
+
+def test_paged_binary():
+    char_boxes = CharBoxes.from_list([[1, 2, 3, 4], [5, 6, 7, 8], None, [9, 10, 11, 12]])
+    pages = [PlainTextPage(number=0, start=0, end=2, bbox=[0, 0, 600, 800], rotation=0),
+             PlainTextPage(number=1, start=2, end=4, bbox=[0, 0, 600, 800], rotation=0)]
+    data = char_boxes.to_paged_binary(pages)
+    assert read_page_boxes(io.BytesIO(data), 1) == (2, [None, [9, 10, 11, 12]])
+    header = PagedCharBoxesHeader.parse(data)
+    boxes = np.frombuffer(data, dtype='<f4', offset=header.boxes_offset).reshape(header.char_count, 4)
+    assert np.array_equal(boxes[[0, 1, 3]], char_boxes.boxes[[0, 1, 3]])
+    assert np.isnan(boxes[2]).all()
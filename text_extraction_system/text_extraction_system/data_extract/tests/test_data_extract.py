@@ -1,6 +1,8 @@
 import gc
 import json
+import os
 import pathlib
+import shutil
 import tempfile
 
 import cv2
@@ -70,6 +72,41 @@ def test_text_too_short():
                 assert 'financial statements' in text.lower()
 
 
+@with_default_settings
+def test_process_pdf_page_restores_text_layer():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        # the page PDF and image are rotated in place
+        fn = shutil.copy(data_dir_path / 'finstat90_rotation_set.pdf', temp_dir)
+        image_fns, temp_images_dir = extract_page_ocr_images(fn)
+        ocred_image_fn = shutil.copy(image_fns[1], os.path.join(temp_dir, 'ocred.png'))
+        restored_image_fn = shutil.copy(image_fns[1], os.path.join(temp_dir, 'restored.png'))
+        with process_pdf_page(fn, ocred_image_fn) as ocred_res:
+            assert not ocred_res.text_layer_restored
+            assert ocred_res.ocred_page_fn
+
+        fn = shutil.copy(data_dir_path / 'finstat90_rotation_set.pdf', temp_dir)
+        restore_args = list()
+
+        def restore_text_layer(orientation_angle, rotation_angle):
+            restore_args.append((orientation_angle, rotation_angle))
+            return True
+
+        with process_pdf_page(fn, restored_image_fn, restore_text_layer=restore_text_layer) as restored_res:
+            assert restored_res.text_layer_restored
+            assert restored_res.ocred_page_fn is None
+            assert restore_args == [(ocred_res.orientation_angle, ocred_res.rotation_angle)]
+            assert (restored_res.orientation_angle, restored_res.rotation_angle) == restore_args[0]
+
+        # the image used for the table detection is rotated the same way
+        with Image.open(ocred_image_fn) as ocred_image, Image.open(restored_image_fn) as restored_image:
+            assert ocred_image.size == restored_image.size
+            assert ocred_image.tobytes() == restored_image.tobytes()
+        shutil.rmtree(temp_images_dir)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
 @with_default_settings
 def test_get_sections_from_table_of_contents():
     toc_items: List[PlainTableOfContentsRecord] = [
@@ -177,8 +214,7 @@ def test_proto_memory_comparison():
 
                 try:
                     gc.disable()
-                    msgpack_pdf_coords = msgpack.packb(full_struct.pdf_coordinates.__dict__, use_bin_type=True,
-                                                       use_single_float=True)
+                    msgpack_pdf_coords = full_struct.pdf_coordinates.to_msgpack()
                     msgpack_text_struct = msgpack.packb(full_struct.text_structure.to_dict(), use_bin_type=True,
                                                         use_single_float=True)
                 finally:
@@ -220,7 +256,7 @@ def test_proto_speed_comparison():
                     gc.disable()
                     t1 = datetime.datetime.now()
                     for _ in range(iterate_amount):
-                        msgpack.packb(full_struct.pdf_coordinates.__dict__, use_bin_type=True, use_single_float=True)
+                        full_struct.pdf_coordinates.to_msgpack()
                         msgpack.packb(full_struct.text_structure.to_dict(), use_bin_type=True, use_single_float=True)
                     msgpack_execute_time = datetime.datetime.now() - t1
                 finally:
@@ -38,3 +38,38 @@ def test_lang_detection4():
     lang_detector = get_lang_detector()
     text = 'скажи що-небудь по-українськи'
     assert lang_detector.predict_lang(text) == 'uk'
+
+
+@patch.object(config,
+              attribute='_settings',
+              new=config.Settings.construct(webdav_url='', webdav_username='', webdav_password=''))
+def test_lang_detection_batched():
+    lang_detector = get_lang_detector()
+    texts = ['emotionale Bedingungen Fruchtbarkeit',
+             'London is the capital of\nGreat Britain.',
+             'скажи що-небудь по-українськи']
+    assert lang_detector.predict_langs(texts) == ['de', 'en', 'uk']
+    assert lang_detector.predict_langs([]) == []
+
+
+@patch.object(config,
+              attribute='_settings',
+              new=config.Settings.construct(webdav_url='', webdav_username='', webdav_password=''))
+def test_lang_detection_propagated_to_nested_spans():
+    lang_detector = get_lang_detector()
+    paragraph1 = 'London is the capital of Great Britain. It is a big city.'
+    paragraph2 = 'emotionale Bedingungen Fruchtbarkeit'
+    text = paragraph1 + '\n' + paragraph2
+    paragraphs = [(0, len(paragraph1), paragraph1), (len(paragraph1) + 1, len(text), paragraph2)]
+    sentences = [(0, 39, text[0:39]),
+                 (40, len(paragraph1), text[40:len(paragraph1)]),
+                 (len(paragraph1) + 1, len(text), paragraph2)]
+
+    paragraph_langs, sentence_langs = lang_detector.predict_nested_langs(paragraphs, sentences, min_confidence=0)
+    assert paragraph_langs == ['en', 'de']
+    assert sentence_langs == ['en', 'en', 'de']
+
+    # nothing is propagated if the paragraph languages are not confident enough
+    with patch.object(lang_detector, 'predict_langs', wraps=lang_detector.predict_langs) as predict_langs:
+        lang_detector.predict_nested_langs(paragraphs, sentences, min_confidence=1.1)
+        assert len(predict_langs.call_args[0][0]) == 3
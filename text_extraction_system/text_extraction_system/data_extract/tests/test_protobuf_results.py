@@ -0,0 +1,68 @@
+import json
+
+import numpy as np
+from google.protobuf.json_format import Parse
+
+import text_extraction_system_api.python_pb2_files.contract_char_bboxes_pb2 as char_bboxes_pb2
+import text_extraction_system_api.python_pb2_files.contract_pages_pb2 as pages_pb2
+import text_extraction_system_api.python_pb2_files.contract_tables_pb2 as tables_pb2
+from text_extraction_system_api.dto import PlainTextStructure, PlainTextPage, PlainTextSentence, \
+    PlainTextParagraph, PlainTextSection, PlainTableOfContentsRecord, TableList, Table, Rectangle
+
+from text_extraction_system.data_extract.char_boxes import CharBoxes, ColumnarPDFCoordinates
+from text_extraction_system.data_extract.protobuf_results import text_structure_to_protobuf, tables_to_protobuf
+
+
+def _build_text_structure(pages: int = 100) -> PlainTextStructure:
+    return PlainTextStructure(
+        title='Title',
+        language='en',
+        pages=[PlainTextPage(number=i, start=i * 1000, end=(i + 1) * 1000, bbox=[0, 0, 595.3, 841.9], rotation=0)
+               for i in range(pages)],
+        sentences=[PlainTextSentence(start=i * 100, end=(i + 1) * 100, language='en') for i in range(pages * 10)],
+        paragraphs=[PlainTextParagraph(start=i * 500, end=(i + 1) * 500, language='en') for i in range(pages * 2)],
+        sections=[PlainTextSection(start=i * 1000, end=(i + 1) * 1000, title=f'Section {i}', title_start=None,
+                                   title_end=None, level=1, abs_level=1, left=72.5, top=700.25, page=i)
+                  for i in range(pages)],
+        table_of_contents=[PlainTableOfContentsRecord(title=f'Section {i}', level=1, left=72, top=700, page=i)
+                           for i in range(pages)])
+
+
+def test_pdf_coordinates_same_as_json_parse():
+    boxes = (np.random.default_rng(1).random((1000, 4)) * 600).astype(np.float32)
+    pdf_coordinates = ColumnarPDFCoordinates(char_boxes=CharBoxes(boxes))
+    pdf_coords = pdf_coordinates.to_dict()
+    pdf_coords['char_bboxes'] = [{'coords': item} for item in pdf_coords['char_bboxes']]
+    expected = Parse(json.dumps(pdf_coords), char_bboxes_pb2.CharBboxes()).SerializeToString()
+    assert pdf_coordinates.to_protobuf() == expected
+
+
+def test_pdf_coordinates_nulls():
+    char_boxes = CharBoxes.from_list([[1, 2, 3, 4], None, [5, 6, 7, 8]])
+    msg = char_bboxes_pb2.CharBboxes()
+    msg.ParseFromString(char_boxes.to_protobuf())
+    assert [list(item.coords) for item in msg.char_bboxes] == [[1, 2, 3, 4], [], [5, 6, 7, 8]]
+
+
+def test_text_structure_same_as_json_parse():
+    text_structure = _build_text_structure(pages=3)
+    expected = Parse(json.dumps(text_structure.to_dict()), pages_pb2.Pages()).SerializeToString()
+    assert text_structure_to_protobuf(text_structure) == expected
+
+
+def test_tables():
+    tables = TableList(tables=[Table(coordinates=Rectangle(left=10, top=20, width=300, height=100.5),
+                                     data=[['a', 'b'], ['c', '']],
+                                     page=2)])
+    msg = tables_pb2.TableList()
+    msg.ParseFromString(tables_to_protobuf(tables))
+    assert len(msg.tables) == 1
+    assert msg.tables[0].page == 2
+    assert msg.tables[0].coordinates.height == 100.5
+    assert [list(row.cells) for row in msg.tables[0].data] == [['a', 'b'], ['c', '']]
+
+
+def test_protobuf_vs_msgpack_size():
+    pdf_coordinates = ColumnarPDFCoordinates(
+        char_boxes=CharBoxes((np.random.default_rng(1).random((100_000, 4)) * 600).astype(np.float32)))
+    assert len(pdf_coordinates.to_protobuf()) < len(pdf_coordinates.to_msgpack())
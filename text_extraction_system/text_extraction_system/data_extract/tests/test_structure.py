@@ -0,0 +1,68 @@
+from typing import List
+
+import numpy as np
+
+from text_extraction_system.data_extract.char_boxes import CharBoxes
+from text_extraction_system.data_extract.structure import find_pages, find_section_ends, find_closest_symbols
+from text_extraction_system_api.pdf_coordinates.pdf_coords_common import find_page_by_smb_index
+
+
+def _section_ends_nested_loop(starts: List[int], levels: List[int], doc_end: int) -> List[int]:
+    ends = []
+    for i in range(len(starts)):
+        end = doc_end
+        for j in range(i + 1, len(starts)):
+            if levels[j] > levels[i]:
+                continue
+            end = starts[j]
+            break
+        ends.append(end)
+    return ends
+
+
+def test_find_pages():
+    page_starts = np.array([0, 10, 25, 25, 40] + list(range(50, 200, 10)))
+    page_ends = np.array([10, 25, 25, 40, 50] + list(range(60, 210, 10)))
+    page_bounds = list(zip(page_starts.tolist(), page_ends.tolist()))
+    positions = np.arange(-5, 220)
+    pages = find_pages(page_starts, page_ends, positions)
+    assert pages.tolist() == [find_page_by_smb_index(page_bounds, pos) for pos in positions.tolist()]
+
+
+def test_find_pages_no_pages():
+    assert find_pages(np.array([]), np.array([]), np.array([0, 5])).tolist() == [-1, -1]
+
+
+def test_find_section_ends():
+    rng = np.random.default_rng(1)
+    starts = np.sort(rng.integers(0, 10000, 500))
+    levels = rng.integers(1, 5, 500)
+    ends = find_section_ends(starts, levels, 10000)
+    assert ends.tolist() == _section_ends_nested_loop(starts.tolist(), levels.tolist(), 10000)
+
+
+def test_find_closest_symbols():
+    rng = np.random.default_rng(1)
+    boxes = rng.integers(0, 50, (3000, 4)).astype(np.float32)
+    valid = rng.random(3000) > 0.1
+    char_boxes = CharBoxes(boxes, valid)
+    page_starts = np.array([0, 1000, 1000, 2500])
+    page_ends = np.array([1000, 1000, 2500, 3000])
+    toc_pages = rng.integers(0, 4, 300)
+    xs, ys = rng.random(300) * 50, rng.random(300) * 50
+
+    positions = find_closest_symbols(char_boxes, xs, ys, page_starts[toc_pages], page_ends[toc_pages])
+    assert positions.tolist() == [char_boxes.find_closest_symbol_pos(x, y, page_starts[p], page_ends[p])
+                                  for x, y, p in zip(xs.tolist(), ys.tolist(), toc_pages.tolist())]
+
+
+def test_structure_assembly_large_document():
+    rng = np.random.default_rng(1)
+    sections = 10000
+    starts = np.sort(rng.integers(0, 10_000_000, sections))
+    levels = rng.integers(1, 5, sections)
+
+    ends = find_section_ends(starts, levels, 10_000_000)
+    assert ends.tolist() == _section_ends_nested_loop(starts.tolist(), levels.tolist(), 10_000_000)
+    pages = find_pages(np.arange(0, 10_000_000, 3000), np.arange(3000, 10_003_000, 3000), starts)
+    assert pages.tolist() == (starts // 3000).tolist()
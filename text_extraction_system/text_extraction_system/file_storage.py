@@ -1,28 +1,127 @@
-import io
+import fcntl
 import os
 import pickle
+import shutil
 import tempfile
-from contextlib import contextmanager
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, closing
 from io import BytesIO
-from typing import Optional, Any, List
+from logging import getLogger
+from typing import Optional, Any, List, BinaryIO, Iterator, Union, Tuple
 
+from requests.adapters import HTTPAdapter
 from webdav3.client import Client, wrap_connection_error, Urn, MethodNotSupported, WebDavXmlUtils, \
     LocalResourceNotFound, OptionNotValid
+from webdav3.exceptions import RemoteResourceNotFound, ResponseErrorCode
 
 from text_extraction_system.config import get_settings
 
-
-class WebDavClient(Client):
-
-    def __init__(self):
-        settings = get_settings()
-
-        super().__init__({
-            'webdav_hostname': settings.webdav_url,
-            'webdav_login': settings.webdav_username,
-            'webdav_password': settings.webdav_password,
-            'disable_check': True
-        })
+log = getLogger(__name__)
+
+STORAGE_BACKEND_WEBDAV = 'webdav'
+STORAGE_BACKEND_LOCAL = 'local'
+
+
+class StoragePreconditionFailed(Exception):
+    """
+    The stored file has been changed by someone else since the specified version (ETag) was read.
+    """
+    pass
+
+
+class FileStorage(ABC):
+    """
+    Storage of the request files shared by the web api and the Celery workers.
+    The paths are relative to the storage root and use "/" as the separator.
+    All implementations raise webdav3.exceptions.RemoteResourceNotFound if the requested path does not exist.
+    """
+
+    @abstractmethod
+    def mkdir(self, remote_path: str) -> bool:
+        pass
+
+    @abstractmethod
+    def list(self, remote_path: str, get_info: bool = False) -> List:
+        """
+        Returns the names of the files and sub-folders of the folder.
+        Names of the sub-folders end with "/".
+        """
+
+    @abstractmethod
+    def is_dir(self, remote_path: str) -> bool:
+        pass
+
+    @abstractmethod
+    def clean(self, remote_path: str):
+        """
+        Deletes the file or the folder with all its contents.
+        """
+
+    @abstractmethod
+    def upload_file(self, remote_path: str, local_path: str, progress=None):
+        pass
+
+    @abstractmethod
+    def upload_to(self, buff: Union[bytes, str, BinaryIO], remote_path: str):
+        pass
+
+    @abstractmethod
+    def copy(self, remote_path_from: str, remote_path_to: str):
+        pass
+
+    @abstractmethod
+    def download_file(self, remote_path: str, local_path: str, progress=None):
+        pass
+
+    @abstractmethod
+    def download_from(self, buff: BinaryIO, remote_path: str):
+        pass
+
+    @abstractmethod
+    def stream(self,
+               remote_path: str,
+               chunk_size: int = 1024 * 1024,
+               start: int = 0,
+               end: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Returns an iterator over the file content or over its byte range [start, end] (end is inclusive).
+        The path is checked at the call - before the iteration starts.
+        """
+
+    @abstractmethod
+    def get_size(self, remote_path: str) -> int:
+        pass
+
+    @abstractmethod
+    def download_if_modified(self,
+                             remote_path: str,
+                             etag: Optional[str] = None) -> Tuple[Optional[bytes], Optional[str]]:
+        """
+        Conditional download of a small file.
+        Returns (None, etag) if the file is not changed since the version with the specified ETag
+        or (content, new etag) otherwise. The ETag can be None if the storage does not provide it.
+        """
+
+    @abstractmethod
+    def upload_if_match(self, content: bytes, remote_path: str, etag: Optional[str] = None) -> Optional[str]:
+        """
+        Compare-and-swap upload of a small file: the file is replaced only if it is still of the version
+        with the specified ETag (unconditionally if the ETag is None).
+        Raises StoragePreconditionFailed otherwise. Returns the ETag of the new version if known.
+        """
+
+    def local_path(self, remote_path: str) -> Optional[str]:
+        """
+        Returns the local file system path of the stored file if the storage is located on a local
+        or shared volume. Such files can be served / read directly without copying.
+        """
+        return None
+
+    def download_files(self, remote_paths: List[str], dst_dir: str):
+        for remote_path in remote_paths:
+            self.download_file(remote_path, os.path.join(dst_dir, os.path.basename(remote_path)))
 
     def unpickle(self, remote_path: str) -> Any:
         bytes_io = BytesIO()
@@ -36,22 +135,119 @@ class WebDavClient(Client):
     def get_as_local_fn(self, remote_path: str):
         _, ext = os.path.splitext(remote_path)
         _fd, fn = tempfile.mkstemp(suffix=ext)
+        os.close(_fd)
         try:
             self.download_file(remote_path=remote_path, local_path=fn)
             yield fn, remote_path
         finally:
             os.remove(fn)
 
+
+def _iterate_response(response, chunk_size: int) -> Iterator[bytes]:
+    with closing(response):
+        yield from response.iter_content(chunk_size)
+
+
+def _slice_chunks(chunks: Iterator[bytes], start: int, end: Optional[int]) -> Iterator[bytes]:
+    pos = 0
+    try:
+        for chunk in chunks:
+            chunk_start, chunk_end = pos, pos + len(chunk)
+            pos = chunk_end
+            if chunk_end <= start:
+                continue
+            if end is not None and chunk_start > end:
+                break
+            yield chunk[max(start - chunk_start, 0):(end + 1 - chunk_start) if end is not None else None]
+    finally:
+        chunks.close()
+
+
+class _RangeNotSatisfied(Exception):
+    pass
+
+
+class WebDavClient(Client, FileStorage):
+
+    def __init__(self):
+        settings = get_settings()
+
+        super().__init__({
+            'webdav_hostname': settings.webdav_url,
+            'webdav_login': settings.webdav_username,
+            'webdav_password': settings.webdav_password,
+            'disable_check': True
+        })
+        # keep-alive connections are re-used by all threads of the process (e.g. the web api thread pool)
+        adapter = HTTPAdapter(pool_connections=settings.webdav_pool_size, pool_maxsize=settings.webdav_pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.chunk_size = settings.webdav_chunk_size_mb * 1024 * 1024
+        self.parallel_download_threads = settings.webdav_parallel_download_threads
+        self.parallel_download_min_size = settings.webdav_parallel_download_min_size_mb * 1024 * 1024
+
+    @staticmethod
+    def log_transfer(action: str, remote_path: str, size: int, start_time: float):
+        seconds = time.time() - start_time
+        mb = size / 1024 / 1024
+        log.debug(f'WebDAV {action} {remote_path}: {mb:.2f} MB in {seconds:.3f}s '
+                  f'({(mb / seconds) if seconds else 0:.2f} MB/s)')
+
+    def _copy_response_to(self, response, dst: BinaryIO) -> int:
+        with closing(response):
+            response.raw.decode_content = True
+            start_pos = dst.tell()
+            shutil.copyfileobj(response.raw, dst, self.chunk_size)
+            return dst.tell() - start_pos
+
+    def _get_content_length(self, urn: Urn) -> Optional[int]:
+        with closing(self.execute_request(action='check', path=urn.quote())) as response:
+            if response.headers.get('Accept-Ranges') != 'bytes':
+                return None
+            size = response.headers.get('Content-Length')
+            return int(size) if size else None
+
+    def _download_range(self, urn: Urn, local_path: str, start: int, end: int, size: int):
+        response = self.execute_request('download', urn.quote(), headers_ext=[f'Range: bytes={start}-{end}'])
+        # a server or proxy ignoring the range sends the whole file with 200
+        content_range = response.headers.get('Content-Range')
+        if response.status_code != 206 or content_range != f'bytes {start}-{end}/{size}':
+            response.close()
+            raise _RangeNotSatisfied(f'Requested bytes {start}-{end}/{size}, got {response.status_code} '
+                                     f'with Content-Range: {content_range}')
+        with open(local_path, 'r+b') as local_file:
+            local_file.seek(start)
+            if self._copy_response_to(response, local_file) != end - start + 1:
+                raise _RangeNotSatisfied(f'Unexpected length of bytes {start}-{end}/{size}')
+
+    def _download_file_parallel(self, urn: Urn, local_path: str) -> bool:
+        size = self._get_content_length(urn)
+        if not size or size < self.parallel_download_min_size:
+            return False
+        with open(local_path, 'wb') as local_file:
+            local_file.truncate(size)
+        part_size = -(-size // self.parallel_download_threads)
+        ranges = [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+        try:
+            with ThreadPoolExecutor(max_workers=self.parallel_download_threads) as executor:
+                for future in [executor.submit(self._download_range, urn, local_path, start, end, size)
+                               for start, end in ranges]:
+                    future.result()
+        except _RangeNotSatisfied as e:
+            log.warning(f'Unable to download {urn.path()} in parallel, downloading as a single stream: {e}')
+            return False
+        return True
+
     @wrap_connection_error
     def mkdir(self, remote_path):
         # copy-pasted from the webdav lib with the non-needed additional http queries returned
         directory_urn = Urn(remote_path, directory=True)
         try:
-            response = self.execute_request(action='mkdir', path=directory_urn.quote())
+            with closing(self.execute_request(action='mkdir', path=directory_urn.quote())) as response:
+                return response.status_code in (200, 201)
         except MethodNotSupported:
             # Yandex WebDAV returns 405 status code when directory already exists
             return True
-        return response.status_code in (200, 201)
 
     @wrap_connection_error
     def list(self, remote_path=Client.root, get_info=False):
@@ -73,22 +269,16 @@ class WebDavClient(Client):
     def download_file(self, remote_path, local_path, progress=None):
         # copy-pasted from the webdav lib with the non-needed additional http queries returned
 
+        start_time = time.time()
         urn = Urn(remote_path)
+        # large objects are optionally downloaded with several ranged GET requests in parallel
+        if self.parallel_download_threads > 1 and self._download_file_parallel(urn, local_path):
+            self.log_transfer('parallel download', remote_path, os.path.getsize(local_path), start_time)
+            return
         with open(local_path, 'wb') as local_file:
             response = self.execute_request('download', urn.quote())
-            for block in response.iter_content(1024):
-                local_file.write(block)
-
-    @wrap_connection_error
-    def download_files(self, remote_paths: List[str], dst_dir: str) -> io.BytesIO:
-        # copy-pasted from the webdav lib with the non-needed additional http queries returned
-        for remote_path in remote_paths:
-            urn = Urn(remote_path)
-            file_name = os.path.join(dst_dir, os.path.basename(remote_path))
-            with open(file_name, 'wb') as local_file:
-                response = self.execute_request('download', urn.quote())
-                for block in response.iter_content(1024):
-                    local_file.write(block)
+            size = self._copy_response_to(response, local_file)
+        self.log_transfer('download', remote_path, size, start_time)
 
     @wrap_connection_error
     def upload_file(self, remote_path, local_path, progress=None):
@@ -104,8 +294,10 @@ class WebDavClient(Client):
         if os.path.isdir(local_path):
             raise OptionNotValid(name="local_path", value=local_path)
 
+        start_time = time.time()
         with open(local_path, "rb") as local_file:
-            self.execute_request(action='upload', path=urn.quote(), data=local_file)
+            self.execute_request(action='upload', path=urn.quote(), data=local_file).close()
+        self.log_transfer('upload', remote_path, os.path.getsize(local_path), start_time)
 
     @wrap_connection_error
     def upload_to(self, buff, remote_path):
@@ -115,16 +307,234 @@ class WebDavClient(Client):
         if urn.is_dir():
             raise OptionNotValid(name="remote_path", value=remote_path)
 
-        self.execute_request(action='upload', path=urn.quote(), data=buff)
+        start_time = time.time()
+        self.execute_request(action='upload', path=urn.quote(), data=buff).close()
+        self.log_transfer('upload', remote_path, len(buff) if isinstance(buff, (bytes, str)) else buff.tell(),
+                          start_time)
 
     @wrap_connection_error
     def download_from(self, buff, remote_path):
         # copy-pasted from the webdav lib with the non-needed additional http queries returned
 
+        start_time = time.time()
         urn = Urn(remote_path)
         response = self.execute_request(action='download', path=urn.quote())
-        for chunk in response.iter_content(chunk_size=128):
-            buff.write(chunk)
+        size = self._copy_response_to(response, buff)
+        self.log_transfer('download', remote_path, size, start_time)
+
+    @wrap_connection_error
+    def stream(self,
+               remote_path: str,
+               chunk_size: int = 1024 * 1024,
+               start: int = 0,
+               end: Optional[int] = None) -> Iterator[bytes]:
+        ranged = start > 0 or end is not None
+        headers = [f'Range: bytes={start}-{end if end is not None else ""}'] if ranged else None
+        response = self.execute_request(action='download', path=Urn(remote_path).quote(), headers_ext=headers)
+        if ranged and response.status_code != 206:
+            # the server ignored the range header and sends the whole file
+            return _slice_chunks(_iterate_response(response, chunk_size), start, end)
+        return _iterate_response(response, chunk_size)
+
+    @wrap_connection_error
+    def get_size(self, remote_path: str) -> int:
+        with closing(self.execute_request(action='check', path=Urn(remote_path).quote())) as response:
+            size = response.headers.get('Content-Length')
+        return int(size) if size else int(self.info(remote_path)['size'])
+
+    @wrap_connection_error
+    def download_if_modified(self,
+                             remote_path: str,
+                             etag: Optional[str] = None) -> Tuple[Optional[bytes], Optional[str]]:
+        urn = Urn(remote_path)
+        headers = [f'If-None-Match: {etag}'] if etag else None
+        with closing(self.execute_request(action='download', path=urn.quote(), headers_ext=headers)) as response:
+            if response.status_code == 304:
+                return None, etag
+            return response.content, response.headers.get('ETag')
+
+    @wrap_connection_error
+    def upload_if_match(self, content: bytes, remote_path: str, etag: Optional[str] = None) -> Optional[str]:
+        urn = Urn(remote_path)
+        # If-Match uses the strong comparison - weak ETags would never match
+        headers = [f'If-Match: {etag}'] if etag and not etag.startswith('W/') else None
+        try:
+            with closing(self.execute_request(action='upload', path=urn.quote(), data=content,
+                                              headers_ext=headers)) as response:
+                return response.headers.get('ETag')
+        except ResponseErrorCode as e:
+            if e.code == 412:
+                raise StoragePreconditionFailed(remote_path) from e
+            raise
+
+
+class LocalFileStorage(FileStorage):
+    """
+    Storage located in a local folder or on a volume shared by all hosts (NFS).
+    Used in the single-host deployments to not pay the HTTP round trips for every page file.
+    The files are written under temp names and moved in place with os.replace() so the readers never see
+    half-written files. The copying is done with shutil.copyfile() which uses the zero-copy
+    sendfile() / copy_file_range() system calls on Linux.
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir = os.path.abspath(root_dir)
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    def local_path(self, remote_path: str) -> str:
+        path = os.path.normpath(os.path.join(self.root_dir, remote_path.strip('/')))
+        if path != self.root_dir and not path.startswith(self.root_dir + os.sep):
+            raise OptionNotValid(name='remote_path', value=remote_path)
+        return path
+
+    def _existing_path(self, remote_path: str) -> str:
+        path = self.local_path(remote_path)
+        if not os.path.exists(path):
+            raise RemoteResourceNotFound(remote_path)
+        return path
+
+    @contextmanager
+    def _replaced_atomically(self, remote_path: str):
+        path = self.local_path(remote_path)
+        if remote_path.endswith('/') or os.path.isdir(path):
+            raise OptionNotValid(name='remote_path', value=remote_path)
+        dir_name = os.path.dirname(path)
+        if not os.path.isdir(dir_name):
+            raise RemoteResourceNotFound(os.path.dirname(remote_path.strip('/')))
+        fd, tmp_fn = tempfile.mkstemp(dir=dir_name, prefix='.', suffix='.tmp')
+        os.close(fd)
+        try:
+            yield tmp_fn
+            os.replace(tmp_fn, path)
+        finally:
+            if os.path.exists(tmp_fn):
+                os.remove(tmp_fn)
+
+    def mkdir(self, remote_path: str) -> bool:
+        os.makedirs(self.local_path(remote_path), exist_ok=True)
+        return True
+
+    def list(self, remote_path: str, get_info: bool = False) -> List:
+        path = self._existing_path(remote_path)
+        res = list()
+        for entry in os.scandir(path):
+            if entry.name.startswith('.') and (entry.name.endswith('.tmp') or entry.name.endswith('.lock')):
+                continue
+            is_dir = entry.is_dir()
+            if get_info:
+                stat = entry.stat()
+                res.append({'path': os.path.relpath(entry.path, self.root_dir),
+                            'name': entry.name,
+                            'isdir': is_dir,
+                            'size': None if is_dir else stat.st_size,
+                            'modified': stat.st_mtime})
+            else:
+                res.append(entry.name + '/' if is_dir else entry.name)
+        return res
+
+    def is_dir(self, remote_path: str) -> bool:
+        return os.path.isdir(self._existing_path(remote_path))
+
+    def clean(self, remote_path: str):
+        path = self._existing_path(remote_path)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+    def upload_file(self, remote_path: str, local_path: str, progress=None):
+        if not os.path.exists(local_path):
+            raise LocalResourceNotFound(local_path)
+        with self._replaced_atomically(remote_path) as tmp_fn:
+            shutil.copyfile(local_path, tmp_fn)
+
+    def upload_to(self, buff: Union[bytes, str, BinaryIO], remote_path: str):
+        with self._replaced_atomically(remote_path) as tmp_fn:
+            with open(tmp_fn, 'wb') as f:
+                if isinstance(buff, str):
+                    f.write(buff.encode('utf-8'))
+                elif isinstance(buff, bytes):
+                    f.write(buff)
+                else:
+                    shutil.copyfileobj(buff, f, 4 * 1024 * 1024)
+
+    def copy(self, remote_path_from: str, remote_path_to: str):
+        """
+        Stores the same content under another path. The files are immutable in the storage
+        (they are always replaced, never modified in place) so a hard link is enough.
+        """
+        src = self._existing_path(remote_path_from)
+        with self._replaced_atomically(remote_path_to) as tmp_fn:
+            os.remove(tmp_fn)
+            try:
+                os.link(src, tmp_fn)
+            except OSError:
+                shutil.copyfile(src, tmp_fn)
+
+    def download_file(self, remote_path: str, local_path: str, progress=None):
+        # the callers are free to modify the downloaded file - so it is a copy, not a link
+        shutil.copyfile(self._existing_path(remote_path), local_path)
+
+    def download_from(self, buff: BinaryIO, remote_path: str):
+        with open(self._existing_path(remote_path), 'rb') as f:
+            shutil.copyfileobj(f, buff, 4 * 1024 * 1024)
+
+    def stream(self,
+               remote_path: str,
+               chunk_size: int = 1024 * 1024,
+               start: int = 0,
+               end: Optional[int] = None) -> Iterator[bytes]:
+        f = open(self._existing_path(remote_path), 'rb')
+
+        def iterate():
+            with f:
+                f.seek(start)
+                remaining = end - start + 1 if end is not None else None
+                while remaining is None or remaining > 0:
+                    chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                    if not chunk:
+                        break
+                    if remaining is not None:
+                        remaining -= len(chunk)
+                    yield chunk
+
+        return iterate()
+
+    def get_size(self, remote_path: str) -> int:
+        return os.path.getsize(self._existing_path(remote_path))
+
+    @staticmethod
+    def _etag(stat: os.stat_result) -> str:
+        return f'"{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    def download_if_modified(self,
+                             remote_path: str,
+                             etag: Optional[str] = None) -> Tuple[Optional[bytes], Optional[str]]:
+        path = self._existing_path(remote_path)
+        with open(path, 'rb') as f:
+            # the file is always replaced (never modified in place) - so the opened version is stable
+            current_etag = self._etag(os.fstat(f.fileno()))
+            if etag and etag == current_etag:
+                return None, etag
+            return f.read(), current_etag
+
+    def upload_if_match(self, content: bytes, remote_path: str, etag: Optional[str] = None) -> Optional[str]:
+        path = self.local_path(remote_path)
+        lock_fn = os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.lock')
+        with open(lock_fn, 'a') as lock_f:
+            fcntl.flock(lock_f, fcntl.LOCK_EX)
+            try:
+                if etag:
+                    try:
+                        current_etag = self._etag(os.stat(path))
+                    except FileNotFoundError:
+                        current_etag = None
+                    if current_etag != etag:
+                        raise StoragePreconditionFailed(remote_path)
+                self.upload_to(content, remote_path)
+                return self._etag(os.stat(path))
+            finally:
+                fcntl.flock(lock_f, fcntl.LOCK_UN)
 
 
 _webdav_client: Optional[WebDavClient] = None
@@ -135,3 +545,20 @@ def get_webdav_client():
     if not _webdav_client:
         _webdav_client = WebDavClient()
     return _webdav_client
+
+
+_local_file_storage: Optional[LocalFileStorage] = None
+
+
+def get_file_storage() -> FileStorage:
+    """
+    Returns the storage backend configured in the settings (file_storage_backend):
+    "webdav" (default) or "local" - the folder specified in local_file_storage_root.
+    """
+    global _local_file_storage
+    settings = get_settings()
+    if settings.file_storage_backend == STORAGE_BACKEND_LOCAL:
+        if not _local_file_storage:
+            _local_file_storage = LocalFileStorage(settings.local_file_storage_root)
+        return _local_file_storage
+    return get_webdav_client()
@@ -0,0 +1,223 @@
+import json
+import os
+import queue
+import subprocess
+import threading
+from logging import getLogger
+from subprocess import CompletedProcess, PIPE, TimeoutExpired
+from threading import Thread
+from typing import List, Optional, Callable, BinaryIO, Tuple, TypeVar
+
+from text_extraction_system.config import get_settings
+from text_extraction_system.processes import io_pipe_lines
+
+log = getLogger(__name__)
+
+JVM_WORKER_CLASS = 'com.lexpredict.textextraction.JVMWorkerServer'
+
+T = TypeVar('T')
+
+
+class JVMWorkerCrashed(Exception):
+    pass
+
+
+def build_java_cmd(java_class: str, args: List[str]) -> List[str]:
+    java_modules_path = get_settings().java_modules_path
+    return ['java', '-cp', f'{java_modules_path}/*', java_class] + [str(a) for a in args]
+
+
+class JVMWorker:
+    """
+    Client of a long-living JVM process (see JVMWorkerServer.java) executing the "main" methods
+    of our Java command line tools one by one. The JVM is started on the first call,
+    restarted after a crash or a timeout and recycled after max_calls calls to limit the possible leaks.
+    The protocol is one JSON object per line over stdin / stdout of the JVM process.
+    """
+
+    def __init__(self, max_calls: int = 200, startup_timeout_sec: int = 60):
+        self.max_calls = max_calls
+        self.startup_timeout_sec = startup_timeout_sec
+        self._proc: Optional[subprocess.Popen] = None
+        self._responses: Optional[queue.Queue] = None
+        self._owner_pid: Optional[int] = None
+        self._calls_done: int = 0
+        self._next_id: int = 0
+        self._lock = threading.Lock()
+
+    def _is_alive(self) -> bool:
+        # the JVM started in the parent process before fork() is not usable in a child
+        return self._proc is not None and self._proc.poll() is None and self._owner_pid == os.getpid()
+
+    def _start(self):
+        args = build_java_cmd(JVM_WORKER_CLASS, [])
+        log.info(f'Starting JVM worker for process {os.getpid()}')
+        self._proc = subprocess.Popen(args,
+                                      stdin=PIPE,
+                                      stdout=PIPE,
+                                      stderr=PIPE,
+                                      universal_newlines=True,
+                                      encoding='utf-8',
+                                      bufsize=1,
+                                      preexec_fn=os.setpgrp)
+        self._owner_pid = os.getpid()
+        self._calls_done = 0
+        self._responses = queue.Queue()
+        Thread(target=io_pipe_lines, args=(self._proc.stdout, self._responses.put), daemon=True).start()
+        Thread(target=io_pipe_lines, args=(self._proc.stderr, lambda line: log.debug(f'JVM worker: {line}')),
+               daemon=True).start()
+        ready = self._read_response(self.startup_timeout_sec)
+        if not ready.get('ready'):
+            self.stop()
+            raise JVMWorkerCrashed(f'Unexpected JVM worker greeting: {ready}')
+
+    def _read_response(self, timeout_sec: float) -> dict:
+        while True:
+            try:
+                line = self._responses.get(timeout=timeout_sec)
+            except queue.Empty:
+                raise TimeoutExpired(JVM_WORKER_CLASS, timeout_sec)
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                return json.loads(line)
+            except ValueError:
+                if self._proc.poll() is not None:
+                    raise JVMWorkerCrashed(f'JVM worker exited with code {self._proc.returncode}')
+                log.warning(f'Unexpected JVM worker output: {line}')
+
+    def _wait_response(self, call_id: int, timeout_sec: float) -> dict:
+        while True:
+            if self._proc.poll() is not None and self._responses.empty():
+                raise JVMWorkerCrashed(f'JVM worker exited with code {self._proc.returncode}')
+            try:
+                resp = self._read_response(min(timeout_sec, 1))
+            except TimeoutExpired:
+                timeout_sec -= 1
+                if timeout_sec <= 0:
+                    raise
+                continue
+            if resp.get('id') == call_id:
+                return resp
+
+    def stop(self):
+        if self._proc is None:
+            return
+        if self._owner_pid == os.getpid():
+            try:
+                self._proc.stdin.close()
+                self._proc.wait(timeout=5)
+            except Exception:
+                try:
+                    self._proc.kill()
+                except Exception:
+                    pass
+        self._proc = None
+        self._responses = None
+
+    def run(self, java_class: str, args: List[str], timeout_sec: int) -> CompletedProcess:
+        cmd = build_java_cmd(java_class, args)
+        with self._lock:
+            if not self._is_alive():
+                self._proc = None
+                try:
+                    self._start()
+                except (OSError, TimeoutExpired) as e:
+                    self.stop()
+                    raise JVMWorkerCrashed(f'Unable to start JVM worker: {e}') from e
+            self._next_id += 1
+            call_id = self._next_id
+            try:
+                self._proc.stdin.write(json.dumps({'id': call_id,
+                                                   'cls': java_class,
+                                                   'args': [str(a) for a in args]}) + '\n')
+                self._proc.stdin.flush()
+                resp = self._wait_response(call_id, timeout_sec)
+            except TimeoutExpired:
+                # the worker is busy with a hanging call - kill it, the next call will start a new one
+                self._proc.kill()
+                self.stop()
+                raise TimeoutExpired(cmd, timeout_sec)
+            except (OSError, ValueError) as e:
+                self.stop()
+                raise JVMWorkerCrashed(f'Unable to communicate with JVM worker: {e}') from e
+
+            self._calls_done += 1
+            if self.max_calls and self._calls_done >= self.max_calls:
+                self.stop()
+        return CompletedProcess(args=cmd, returncode=resp['code'], stdout=resp['out'], stderr=resp['err'])
+
+
+_jvm_worker: Optional[JVMWorker] = None
+
+
+def get_jvm_worker() -> JVMWorker:
+    global _jvm_worker
+    if not _jvm_worker:
+        _jvm_worker = JVMWorker(max_calls=get_settings().java_worker_max_calls)
+    return _jvm_worker
+
+
+def run_java_class(java_class: str, args: List[str], timeout_sec: int = 1800) -> CompletedProcess:
+    """
+    Executes the "main" method of the specified Java class with the specified command line args.
+    Uses the long-living JVM worker of the current process if it is enabled in the settings
+    and falls back to starting a separate "java" process if the worker is disabled or crashed.
+    The result is the same as of subprocess.run(..) for the corresponding "java -cp ..." command line.
+    """
+    if get_settings().java_worker_enabled:
+        try:
+            return get_jvm_worker().run(java_class, args, timeout_sec)
+        except JVMWorkerCrashed as e:
+            log.warning(f'JVM worker failed, executing {java_class} in a separate process: {e}')
+    return subprocess.run(build_java_cmd(java_class, args), check=False, timeout=timeout_sec,
+                          universal_newlines=True, stderr=PIPE, stdout=PIPE)
+
+
+def run_java_class_reading_pipe(java_class: str,
+                                args: List[str],
+                                pipe_fn: str,
+                                read_output: Callable[[BinaryIO], T],
+                                timeout_sec: int = 1800) -> Tuple[CompletedProcess, Optional[T]]:
+    """
+    Executes the Java class the same way as run_java_class() with a named pipe created at pipe_fn
+    and reads the output the class writes to the pipe while the class is still working.
+    The output is not stored in a file and can be decoded incrementally by read_output()
+    which gets the unbuffered stream returning the data as soon as it is written.
+    Returns the completed process and the result of read_output().
+    The result is None if the process failed - the caller should check the process first.
+    """
+    os.mkfifo(pipe_fn)
+    # The pipe is opened for reading without waiting for the writer. The extra write end keeps it open
+    # until the Java class finishes: the reader gets EOF even if the class fails before opening the pipe.
+    read_fd = os.open(pipe_fn, os.O_RDONLY | os.O_NONBLOCK)
+    keep_open_fd = os.open(pipe_fn, os.O_WRONLY)
+    os.set_blocking(read_fd, True)
+    completed = []
+
+    def run():
+        try:
+            completed.append(run_java_class(java_class, args, timeout_sec))
+        except BaseException as e:
+            completed.append(e)
+        finally:
+            os.close(keep_open_fd)
+
+    thread = Thread(target=run, daemon=True)
+    thread.start()
+    output, read_error = None, None
+    with os.fdopen(read_fd, 'rb', buffering=0) as f:
+        try:
+            output = read_output(f)
+        except Exception as e:
+            read_error = e
+    thread.join()
+
+    if isinstance(completed[0], BaseException):
+        raise completed[0]
+    if completed[0].returncode != 0:
+        return completed[0], None
+    if read_error is not None:
+        raise read_error
+    return completed[0], output
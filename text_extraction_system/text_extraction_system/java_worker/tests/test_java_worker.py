@@ -0,0 +1,70 @@
+import os
+import tempfile
+from subprocess import CompletedProcess
+from unittest.mock import patch
+
+from text_extraction_system.commons.tests.commons import with_default_settings
+from text_extraction_system.java_worker import java_worker
+from text_extraction_system.java_worker.java_worker import JVMWorker, build_java_cmd, run_java_class_reading_pipe
+
+data_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'pdf', 'tests', 'data')
+
+SYMBOLS_CALCULATOR = 'com.lexpredict.textextraction.PDFSymbolsCalculator'
+
+
+@with_default_settings
+def test_worker_reuses_jvm():
+    fn = os.path.join(data_dir, 'pdf_text_4_pages.pdf')
+    worker = JVMWorker(max_calls=10)
+    try:
+        res1 = worker.run(SYMBOLS_CALCULATOR, ['--original-pdf', fn], timeout_sec=60)
+        jvm_pid = worker._proc.pid
+        res2 = worker.run(SYMBOLS_CALCULATOR, ['--original-pdf', fn], timeout_sec=60)
+        assert worker._proc.pid == jvm_pid
+        assert res1.returncode == 0
+        assert int(res1.stdout) > 0
+        assert res1.stdout == res2.stdout
+        assert res1.args == build_java_cmd(SYMBOLS_CALCULATOR, ['--original-pdf', fn])
+    finally:
+        worker.stop()
+
+
+@with_default_settings
+def test_worker_reports_errors():
+    worker = JVMWorker(max_calls=10)
+    try:
+        res = worker.run(SYMBOLS_CALCULATOR, ['--original-pdf', '/non/existing/file.pdf'], timeout_sec=60)
+        assert res.returncode != 0
+        assert 'FileNotFoundException' in res.stderr
+        # the worker survives the failed call
+        assert worker.run(SYMBOLS_CALCULATOR, ['--original-pdf', os.path.join(data_dir, 'smile.pdf')],
+                          timeout_sec=60).returncode == 0
+    finally:
+        worker.stop()
+
+
+def test_run_java_class_reading_pipe():
+    def write_to_pipe(java_class, args, timeout_sec):
+        with open(args[0], 'wb') as f:
+            f.write(b'abc' * 100000)
+        return CompletedProcess(args=[java_class] + args, returncode=0, stdout='', stderr='')
+
+    with tempfile.TemporaryDirectory() as temp_dir, patch.object(java_worker, 'run_java_class', write_to_pipe):
+        pipe_fn = os.path.join(temp_dir, 'out.bin')
+        completed_process, output = run_java_class_reading_pipe(SYMBOLS_CALCULATOR, [pipe_fn], pipe_fn,
+                                                                lambda f: f.readall())
+    assert completed_process.returncode == 0
+    assert output == b'abc' * 100000
+
+
+def test_run_java_class_reading_pipe_not_opened_by_failed_process():
+    def fail(java_class, args, timeout_sec):
+        return CompletedProcess(args=[java_class] + args, returncode=1, stdout='', stderr='FileNotFoundException')
+
+    with tempfile.TemporaryDirectory() as temp_dir, patch.object(java_worker, 'run_java_class', fail):
+        pipe_fn = os.path.join(temp_dir, 'out.bin')
+        # the reader gets EOF instead of waiting for the writer forever
+        completed_process, output = run_java_class_reading_pipe(SYMBOLS_CALCULATOR, [pipe_fn], pipe_fn,
+                                                                lambda f: f.readall())
+    assert completed_process.returncode == 1
+    assert output is None
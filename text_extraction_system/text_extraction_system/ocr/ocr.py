@@ -12,6 +12,8 @@ import regex as re
 from PIL import Image
 
 from text_extraction_system.constants import TESSERACT_DEFAULT_LANGUAGE
+from text_extraction_system.ocr.tesseract_api import get_tesseract_engine_pool, ocr_to_pdf_in_process, \
+    detect_orientation_in_process, tesseract_version_in_process, PSM_AUTO_OSD, PSM_AUTO
 
 log = getLogger(__name__)
 
@@ -32,6 +34,13 @@ def get_page_orientation(page_image_fn: str,
     Gets: path to the page's image
     Returns: None or (orientation_angle_degree, confidence_value)
     """
+    engine_pool = get_tesseract_engine_pool()
+    if engine_pool:
+        osd = detect_orientation_in_process(engine_pool, page_image_fn)
+        if not osd:
+            raise OCRException(OCRException.TOO_FEW_CHARACTERS_ERROR)
+        return int(osd['orient_deg']), float(osd['orient_conf'])
+
     args = ['tesseract', '--psm', '0', '-l', language]
     args.append(page_image_fn)
     with tempfile.TemporaryDirectory() as ocr_results_dir:
@@ -88,6 +97,20 @@ def ocr_page_to_pdf(page_image_fn: str,
     try:
         basename = os.path.basename(page_image_fn)
         dstfn = os.path.join(page_dir, os.path.splitext(basename)[0])
+
+        engine_pool = get_tesseract_engine_pool()
+        if engine_pool:
+            if not ocr_to_pdf_in_process(engine_pool,
+                                         page_image_fn=page_image_fn,
+                                         dst_base_fn=dstfn,
+                                         language=language or 'eng',
+                                         psm=PSM_AUTO_OSD if tesseract_page_orientation_detection else PSM_AUTO,
+                                         glyphless_text_only=glyphless_text_only,
+                                         timeout_sec=timeout):
+                raise OCRException(f'Tesseract failed to OCR the page image or timed out: {page_image_fn}')
+            yield dstfn + '.pdf'
+            return
+
         args = ['tesseract',
                 '--psm', '1' if tesseract_page_orientation_detection else '3',
                 '-c', 'tessedit_create_pdf=1',
@@ -131,6 +154,31 @@ def ocr_page_to_pdf(page_image_fn: str,
         shutil.rmtree(page_dir)
 
 
+_tesseract_version: Optional[str] = None
+
+
+def get_tesseract_version() -> str:
+    """
+    Returns the version of the Tesseract used by ocr_page_to_pdf(..) in this process:
+    either the in-process binding or the command line tool.
+    """
+    global _tesseract_version
+    if _tesseract_version is None:
+        if get_tesseract_engine_pool():
+            _tesseract_version = tesseract_version_in_process()
+        else:
+            proc = Popen(['tesseract', '--version'], stdout=PIPE, stderr=PIPE)
+            try:
+                data, err = proc.communicate(timeout=30)
+            except TimeoutExpired as te:
+                proc.kill()
+                proc.communicate()
+                raise OCRException('Timeout waiting for tesseract --version to finish') from te
+            # older versions print the version to stderr
+            _tesseract_version = (data or err).decode('utf8', 'ignore').strip()
+    return _tesseract_version
+
+
 @contextmanager
 def rotate_image(image_fn: str,
                  angle: Optional[float] = None,
@@ -191,6 +239,18 @@ def osd_to_dict(osd: str):
 
 
 def image_to_osd(page_image_fn: str, timeout: int = 180, dpi: int = 300) -> OSD:
+    engine_pool = get_tesseract_engine_pool()
+    if engine_pool:
+        osd = detect_orientation_in_process(engine_pool, page_image_fn, dpi=dpi)
+        if not osd:
+            return OSD_TOO_FEW_CHARACTERS
+        return OSD(page_num=0,
+                   orientation=int(osd['orient_deg']),
+                   rotate=(360 - int(osd['orient_deg'])) % 360,
+                   orientation_conf=float(osd['orient_conf']),
+                   script=osd['script_name'],
+                   script_conf=float(osd['script_conf']))
+
     proc = None
     try:
         args = ['tesseract', page_image_fn, 'stdout', '--psm', '0', '--dpi', str(dpi)]
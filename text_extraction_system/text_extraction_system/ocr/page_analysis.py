@@ -0,0 +1,61 @@
+import dataclasses
+from logging import getLogger
+from typing import Optional
+
+from text_extraction_system.ocr.ocr import OSD, OSD_TOO_FEW_CHARACTERS, OCRException, image_to_osd, \
+    orientation_and_script_detected_in_osd
+
+log = getLogger(__name__)
+
+# TODO: presently orientation "probability" threshold is taken arbitrary
+ORIENTATION_THRESHOLD = 3
+
+
+class PageAnalysisContext:
+    """
+    Page image being processed and the results of its orientation and script detection (OSD).
+    OSD is executed by Tesseract at most once per page and the result is shared by the orientation
+    correction, rotation detection and OCR steps.
+    """
+
+    def __init__(self, image_fn: str, dpi: int = 300):
+        self.image_fn = image_fn
+        self.dpi = dpi
+        self._osd: Optional[OSD] = None
+        self.orientation_corrected: bool = False
+
+    @property
+    def osd(self) -> OSD:
+        if self._osd is None:
+            try:
+                self._osd = image_to_osd(self.image_fn, dpi=self.dpi)
+            except OCRException as e:
+                log.error(f'Cant get page orientation by Tesseract: {e}')
+                self._osd = OSD_TOO_FEW_CHARACTERS
+        return self._osd
+
+    def orientation_confident(self) -> bool:
+        return bool(self.osd.orientation) and self.osd.orientation_conf > ORIENTATION_THRESHOLD
+
+    def mark_orientation_corrected(self):
+        """
+        Should be called after the page image is rotated by the detected orientation angle.
+        """
+        self.orientation_corrected = True
+        self._osd = dataclasses.replace(self.osd, orientation=0, rotate=0)
+
+    @property
+    def orientation(self) -> int:
+        """
+        Orientation of the page image in its current state as it is used for the rotation detection:
+        0 if the orientation and script were not detected reliably.
+        """
+        return self.osd.orientation if orientation_and_script_detected_in_osd(self.osd) else 0
+
+    @property
+    def ocr_requires_orientation_detection(self) -> bool:
+        """
+        Tesseract needs to detect the orientation while OCR-ing the page (psm 1) only if the page image
+        is known to be not upright. Otherwise the OSD pass is not repeated (psm 3).
+        """
+        return bool(self.osd.orientation) and not self.orientation_corrected
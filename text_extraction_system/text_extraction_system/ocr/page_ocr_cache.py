@@ -0,0 +1,120 @@
+import hashlib
+import json
+from logging import getLogger
+from typing import Optional
+
+from PIL import Image
+
+from text_extraction_system.constants import pages_ocred
+from text_extraction_system.ocr.ocr import get_tesseract_version
+from text_extraction_system.result_cache import ResultCache, PAGE_OCR
+from text_extraction_system.utils import page_ocred_fn
+from text_extraction_system.version import VERSION_NUMBER, GIT_COMMIT
+
+log = getLogger(__name__)
+
+# Keys of the cached OCR results of the single pages (see PAGE_OCR in result_cache.py).
+# Scanned documents repeat pages heavily (letterheads, signature pages, exhibits) so the page
+# is identified by its rendered image, not by the document it belongs to.
+
+# name of the text layer PDF in the cache entry
+page_ocr_cached_fn = 'page.pdf'
+
+
+def page_image_fingerprint(page_image_fn: str) -> str:
+    """
+    Returns the hash of the pixels of the page image normalized to 8-bit grayscale.
+    It does not depend on the image file format, compression or metadata.
+    The image is not downscaled: the pages differing in a date or a name only must not share the OCR results.
+    """
+    with Image.open(page_image_fn) as image:  # type: Image.Image
+        image = image.convert('L')
+        h = hashlib.sha256(f'{image.width}x{image.height}:'.encode('utf-8'))
+        h.update(image.tobytes())
+    return h.hexdigest()
+
+
+def build_page_ocr_key(image_fingerprint: str,
+                       ocr_language: str,
+                       dpi: int,
+                       detect_orientation_tesseract: bool,
+                       orientation_angle: Optional[int],
+                       rotation_angle: Optional[float]) -> str:
+    """
+    Returns the cache key of the text layer of the page image rendered by extract_page_ocr_image(..)
+    and OCR-ed by process_pdf_page(..) with the specified options after rotating the image
+    by the detected orientation and rotation angles.
+    The angles are a part of the key: the rotation correction depends on the native text of the page PDF
+    too (see should_correct_rotation(..)) so the same image may be OCR-ed differently in another document.
+    """
+    key_src = {'version': [VERSION_NUMBER, GIT_COMMIT],
+               'tesseract': get_tesseract_version(),
+               'image': image_fingerprint,
+               'language': ocr_language,
+               'dpi': dpi,
+               'detect_orientation_tesseract': detect_orientation_tesseract,
+               'orientation_angle': orientation_angle or 0,
+               'rotation_angle': rotation_angle or 0}
+    return hashlib.sha256(json.dumps(key_src, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class PageOCRCache:
+    """
+    Text layers of a PDF page of the request in the result cache.
+    The text layer is looked up by process_pdf_page(..) when the orientation and rotation of the page are known
+    and is copied into the pages_ocred folder of the request under the same name as the OCR-ed one.
+    The failures are logged and handled as misses.
+    """
+
+    def __init__(self,
+                 result_cache: ResultCache,
+                 request_id: str,
+                 page_number: int,
+                 page_image_fn: str,
+                 ocr_language: str,
+                 dpi: int,
+                 detect_orientation_tesseract: bool):
+        self.result_cache = result_cache
+        self.request_id = request_id
+        self.page_number = page_number
+        self.ocr_language = ocr_language
+        self.dpi = dpi
+        self.detect_orientation_tesseract = detect_orientation_tesseract
+        # process_pdf_page(..) rotates the image in place - it is identified before that
+        try:
+            self.image_fingerprint = page_image_fingerprint(page_image_fn)
+        except Exception as e:
+            log.warning(f'Unable to fingerprint page image {page_image_fn}: {e}')
+            self.image_fingerprint = None
+
+    def ocred_page_path(self, rotation_angle: Optional[float]) -> str:
+        return f'{self.request_id}/{pages_ocred}/{page_ocred_fn(self.page_number, rotation_angle)}'
+
+    def _key(self, orientation_angle: Optional[int], rotation_angle: Optional[float]) -> Optional[str]:
+        if not self.image_fingerprint:
+            return None
+        try:
+            return build_page_ocr_key(self.image_fingerprint, self.ocr_language, self.dpi,
+                                      self.detect_orientation_tesseract, orientation_angle, rotation_angle)
+        except Exception as e:
+            log.warning(f'Unable to build the page OCR cache key of page {self.page_number}: {e}')
+            return None
+
+    def restore(self, orientation_angle: Optional[int], rotation_angle: Optional[float]) -> bool:
+        """
+        Copies the cached text layer of the page into the request folder.
+        Returns False if the page is not cached.
+        """
+        key = self._key(orientation_angle, rotation_angle)
+        if not key or self.result_cache.get(PAGE_OCR, key) is None:
+            return False
+        return self.result_cache.copy_from_entry(PAGE_OCR, key, page_ocr_cached_fn,
+                                                 self.ocred_page_path(rotation_angle))
+
+    def store(self, orientation_angle: Optional[int], rotation_angle: Optional[float]):
+        """
+        Stores the text layer of the page uploaded into the request folder.
+        """
+        key = self._key(orientation_angle, rotation_angle)
+        if key:
+            self.result_cache.put(PAGE_OCR, key, {page_ocr_cached_fn: self.ocred_page_path(rotation_angle)}, dict())
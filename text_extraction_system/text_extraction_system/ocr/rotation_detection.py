@@ -149,11 +149,16 @@ _methods = {
 
 def determine_rotation(image_fn: str,
                        detecting_method: RotationDetectionMethod = RotationDetectionMethod.DESKEW,
-                       max_diff_from_closest_90: float = 10) -> PageRotationStatus:
+                       max_diff_from_closest_90: float = 10,
+                       pre_calculated_orientation: Optional[int] = None) -> PageRotationStatus:
     # default method is set to DESKEW (plain deskew lib) because it works on
     # larger amount of cases including images rotated on ~~90 degrees
     # (but is slower)
-    rs = _methods[detecting_method](image_fn)
+    if detecting_method == RotationDetectionMethod.DILATED_ROWS:
+        # orientation detected by Tesseract before (if any) is re-used to not run OSD for the page again
+        rs = detect_rotation_dilated_rows(image_fn, pre_calculated_orientation)
+    else:
+        rs = _methods[detecting_method](image_fn)
     angle = norm_angle(rs.angle)
 
     if abs(angle - 90 * round(angle / 90)) > max_diff_from_closest_90:
@@ -0,0 +1,123 @@
+import os
+import threading
+from contextlib import contextmanager
+from logging import getLogger
+from typing import Dict, Optional, Tuple, Generator, Any
+
+from text_extraction_system.config import get_settings
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+log = getLogger(__name__)
+
+# Tesseract page segmentation modes used by the system
+PSM_OSD_ONLY = 0
+PSM_AUTO_OSD = 1
+PSM_AUTO = 3
+
+OSD_LANGUAGE = 'osd'
+
+
+class TesseractEnginePool:
+    """
+    Keeps initialized Tesseract API handles (one per language + page segmentation mode)
+    for the current worker process and reuses them across pages.
+    Initializing a handle loads the traineddata which takes much more time than OCR of a short page
+    when running the tesseract command line tool once per page.
+    """
+
+    def __init__(self):
+        self._engines: Dict[Tuple[str, int], Any] = dict()
+        self._engine_locks: Dict[Tuple[str, int], threading.Lock] = dict()
+        self._lock = threading.Lock()
+        self._owner_pid = os.getpid()
+
+    def _check_fork(self):
+        # the handles created in the parent process before fork() are not shared with the children
+        if self._owner_pid != os.getpid():
+            self._engines = dict()
+            self._engine_locks = dict()
+            self._lock = threading.Lock()
+            self._owner_pid = os.getpid()
+
+    @contextmanager
+    def engine(self, language: str, psm: int) -> Generator[Any, None, None]:
+        self._check_fork()
+        key = (language, psm)
+        with self._lock:
+            api = self._engines.get(key)
+            if api is None:
+                log.info(f'Initializing Tesseract engine: language={language}, psm={psm}')
+                api = tesserocr.PyTessBaseAPI(lang=language, psm=psm)
+                self._engines[key] = api
+                self._engine_locks[key] = threading.Lock()
+            engine_lock = self._engine_locks[key]
+        with engine_lock:
+            try:
+                yield api
+            finally:
+                api.Clear()
+
+    def close(self):
+        with self._lock:
+            for api in self._engines.values():
+                try:
+                    api.End()
+                except Exception:
+                    pass
+            self._engines = dict()
+            self._engine_locks = dict()
+
+
+_engine_pool: Optional[TesseractEnginePool] = None
+
+
+def get_tesseract_engine_pool() -> Optional[TesseractEnginePool]:
+    """
+    Returns the process-wide Tesseract engine pool or None if the in-process engines are disabled
+    in the settings or the Tesseract binding (tesserocr) is not installed.
+    In the latter case the callers use the tesseract command line tool.
+    """
+    global _engine_pool
+    if tesserocr is None or not get_settings().tesseract_api_enabled:
+        return None
+    if not _engine_pool:
+        _engine_pool = TesseractEnginePool()
+    return _engine_pool
+
+
+def ocr_to_pdf_in_process(pool: TesseractEnginePool,
+                          page_image_fn: str,
+                          dst_base_fn: str,
+                          language: str,
+                          psm: int,
+                          glyphless_text_only: bool,
+                          timeout_sec: int) -> bool:
+    """
+    Renders <dst_base_fn>.pdf the same way "tesseract <image> <dst_base_fn> -c tessedit_create_pdf=1" does.
+    """
+    with pool.engine(language, psm) as api:
+        api.SetVariable('tessedit_create_pdf', '1')
+        api.SetVariable('textonly_pdf', '1' if glyphless_text_only else '0')
+        return api.ProcessPages(dst_base_fn, page_image_fn, timeout=timeout_sec * 1000)
+
+
+def detect_orientation_in_process(pool: TesseractEnginePool,
+                                  page_image_fn: str,
+                                  dpi: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    Returns None if Tesseract is unable to detect orientation (too few characters)
+    or dict: {'orient_deg': int, 'orient_conf': float, 'script_name': str, 'script_conf': float}.
+    """
+    with pool.engine(OSD_LANGUAGE, PSM_OSD_ONLY) as api:
+        api.SetImageFile(page_image_fn)
+        if dpi:
+            api.SetSourceResolution(dpi)
+        return api.DetectOrientationScript()
+
+
+def tesseract_version_in_process() -> str:
+    return tesserocr.tesseract_version()
@@ -1,7 +1,11 @@
 import os
+from unittest.mock import patch
+
+import pytest
 
 from text_extraction_system.commons.tests.commons import with_default_settings
 from text_extraction_system.data_extract.data_extract import extract_text_pdfminer, extract_text_and_structure
+from text_extraction_system.ocr import tesseract_api
 from text_extraction_system.ocr.ocr import ocr_page_to_pdf, orientation_and_script_detected, get_page_orientation
 from text_extraction_system.pdf.pdf import extract_page_images
 
@@ -59,3 +63,17 @@ def test_image_contains_text1():
 def test_image_contains_text3():
     fn = os.path.join(data_dir, 'multi_angle_multi_lang.png')
     assert not orientation_and_script_detected(fn)
+
+
+@with_default_settings
+def test_ocr_engine_reused_across_pages():
+    pytest.importorskip('tesserocr')
+    engine_pool = tesseract_api.TesseractEnginePool()
+    fn = os.path.join(data_dir, 'ocr1.pdf')
+    with patch.object(tesseract_api, '_engine_pool', engine_pool), extract_page_images(fn) as image_fns:
+        for image in image_fns:
+            with ocr_page_to_pdf(image, glyphless_text_only=True) as pdf_fn:
+                assert os.path.getsize(pdf_fn) > 0
+    # one engine initialized for all the pages
+    assert list(engine_pool._engines.keys()) == [('eng', 3)]
+    engine_pool.close()
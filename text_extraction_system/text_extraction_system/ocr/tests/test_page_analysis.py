@@ -0,0 +1,31 @@
+from unittest.mock import patch
+
+from text_extraction_system.ocr import page_analysis
+from text_extraction_system.ocr.ocr import OSD, OSD_TOO_FEW_CHARACTERS
+from text_extraction_system.ocr.page_analysis import PageAnalysisContext
+
+ROTATED_PAGE_OSD = OSD(page_num=0, orientation=90, rotate=270, orientation_conf=10.5,
+                       script='Latin', script_conf=5.2)
+
+
+@patch.object(page_analysis, 'image_to_osd', return_value=ROTATED_PAGE_OSD)
+def test_osd_executed_once(image_to_osd_mock):
+    ctx = PageAnalysisContext('page.png')
+    assert ctx.orientation_confident()
+    assert ctx.orientation == 90
+    assert ctx.ocr_requires_orientation_detection
+
+    ctx.mark_orientation_corrected()
+    assert ctx.orientation == 0
+    assert not ctx.orientation_confident()
+    assert not ctx.ocr_requires_orientation_detection
+    assert image_to_osd_mock.call_count == 1
+
+
+@patch.object(page_analysis, 'image_to_osd', return_value=OSD_TOO_FEW_CHARACTERS)
+def test_osd_nothing_detected(image_to_osd_mock):
+    ctx = PageAnalysisContext('page.png')
+    assert not ctx.orientation_confident()
+    assert ctx.orientation == 0
+    assert not ctx.ocr_requires_orientation_detection
+    assert image_to_osd_mock.call_count == 1
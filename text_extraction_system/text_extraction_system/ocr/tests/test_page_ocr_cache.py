@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from PIL import Image
+
+from text_extraction_system.constants import pages_ocred
+from text_extraction_system.file_storage import LocalFileStorage
+from text_extraction_system.ocr import page_ocr_cache
+from text_extraction_system.ocr.page_ocr_cache import page_image_fingerprint, build_page_ocr_key, PageOCRCache
+from text_extraction_system.result_cache import ResultCache, redis_result_cache_total_size
+from text_extraction_system.tests.test_result_cache import result_cache_env
+from text_extraction_system.utils import page_ocred_fn
+
+
+def _save_page(dst_fn: str, mark: bool = False, **save_kwargs):
+    image = Image.new('RGB', (200, 300), color='white')
+    image.paste((0, 0, 0), (20, 20, 180, 40))
+    if mark:
+        image.putpixel((100, 200), (0, 0, 0))
+    image.save(dst_fn, **save_kwargs)
+
+
+def test_fingerprint_ignores_file_format():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        png_fn = os.path.join(temp_dir, 'page.png')
+        tiff_fn = os.path.join(temp_dir, 'page.tiff')
+        marked_fn = os.path.join(temp_dir, 'marked.png')
+        _save_page(png_fn, dpi=(300, 300))
+        _save_page(tiff_fn, compression='tiff_lzw')
+        _save_page(marked_fn, mark=True)
+        assert page_image_fingerprint(png_fn) == page_image_fingerprint(tiff_fn)
+        assert page_image_fingerprint(png_fn) != page_image_fingerprint(marked_fn)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+@patch.object(page_ocr_cache, 'get_tesseract_version', return_value='tesseract 4.1.1')
+def test_key_depends_on_options(_get_tesseract_version_mock):
+    key = build_page_ocr_key('image1', 'eng', 300, False, None, 0)
+    assert key == build_page_ocr_key('image1', 'eng', 300, False, 0, None)
+    assert key != build_page_ocr_key('image2', 'eng', 300, False, None, 0)
+    assert key != build_page_ocr_key('image1', 'deu', 300, False, None, 0)
+    assert key != build_page_ocr_key('image1', 'eng', 200, False, None, 0)
+    assert key != build_page_ocr_key('image1', 'eng', 300, True, None, 0)
+    assert key != build_page_ocr_key('image1', 'eng', 300, False, 90, 0)
+    assert key != build_page_ocr_key('image1', 'eng', 300, False, None, -0.75)
+    _get_tesseract_version_mock.return_value = 'tesseract 5.0.0'
+    assert key != build_page_ocr_key('image1', 'eng', 300, False, None, 0)
+
+
+def _build_page_ocr_cache(storage: LocalFileStorage, cache: ResultCache, request_id: str, page_fn: str) \
+        -> PageOCRCache:
+    storage.mkdir(f'{request_id}/{pages_ocred}')
+    return PageOCRCache(cache, request_id, 3, page_fn, 'eng', 300, False)
+
+
+@patch.object(page_ocr_cache, 'get_tesseract_version', return_value='tesseract 4.1.1')
+def test_store_and_restore(_get_tesseract_version_mock):
+    with result_cache_env() as (storage, cache, redis):
+        page_fn = storage.local_path('page.png')
+        _save_page(page_fn)
+
+        page1 = _build_page_ocr_cache(storage, cache, 'req1', page_fn)
+        assert not page1.restore(None, -0.75)
+        # OCR-ed and uploaded by process_pdf_page_from_storage(..)
+        storage.upload_to(b'text layer', 'req1/pages_ocred/00003.-0.75.pdf')
+        page1.store(None, -0.75)
+
+        page2 = _build_page_ocr_cache(storage, cache, 'req2', page_fn)
+        # the same image rotated differently in another document
+        assert not page2.restore(None, 0)
+        assert not page2.restore(90, -0.75)
+        assert page2.restore(None, -0.75)
+        with open(storage.local_path('req2/pages_ocred/00003.-0.75.pdf'), 'rb') as f:
+            assert f.read() == b'text layer'
+        # nothing but the text layer is added to the request folder
+        assert storage.list('req2') == [f'{pages_ocred}/']
+
+        stats = cache.get_stats()
+        assert stats['levels']['page_ocr'] == {'hits': 1, 'misses': 3, 'hit_rate': 0.25}
+        assert stats['entries'] == 1
+        assert stats['total_size'] == int(redis.get(redis_result_cache_total_size)) > len(b'text layer')
+        assert stats['max_size'] == cache.max_size
+
+
+@patch.object(page_ocr_cache, 'get_tesseract_version', return_value='tesseract 4.1.1')
+def test_restore_fails(_get_tesseract_version_mock):
+    with result_cache_env() as (storage, cache, redis):
+        page_fn = storage.local_path('page.png')
+        _save_page(page_fn)
+        page1 = _build_page_ocr_cache(storage, cache, 'req1', page_fn)
+        storage.upload_to(b'text layer', 'req1/pages_ocred/00003.pdf')
+        page1.store(None, 0)
+
+        # the entry is evicted while the page is processed - the page is OCR-ed
+        page2 = _build_page_ocr_cache(storage, cache, 'req2', page_fn)
+        with patch.object(cache, 'copy_from_entry', return_value=False):
+            assert not page2.restore(None, 0)
+        assert not os.path.exists(storage.local_path('req2/pages_ocred/00003.pdf'))
+
+        # the image can not be read - the cache is not used
+        page3 = _build_page_ocr_cache(storage, cache, 'req3', storage.local_path('missing.png'))
+        assert not page3.restore(None, 0)
+        page3.store(None, 0)
+        assert cache.get_stats()['entries'] == 1
+
+
+def test_page_ocred_fn():
+    assert page_ocred_fn(3, None) == '00003.pdf'
+    assert page_ocred_fn(3, 0) == '00003.pdf'
+    assert page_ocred_fn(12, -0.75) == '00012.-0.75.pdf'
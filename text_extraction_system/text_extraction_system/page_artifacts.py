@@ -0,0 +1,156 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from logging import getLogger
+from typing import Generator, Optional, Tuple
+
+from webdav3.exceptions import RemoteResourceNotFound
+
+from text_extraction_system.config import get_settings
+from text_extraction_system.file_storage import FileStorage, get_file_storage
+
+log = getLogger(__name__)
+
+
+def file_sha256(fn: str) -> str:
+    h = hashlib.sha256()
+    with open(fn, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class PageArtifactStore:
+    """
+    Storage of the intermediate per-page files (page PDFs, page images) passed between the Celery tasks
+    processing a document. The files are stored in the shared file storage under content-addressed names
+    (<sha256>.<ext>) so any worker of any host can process any page. The tasks pass only the remote paths
+    to each other - never the local file names.
+
+    The files put or downloaded on this host are kept in a local disk cache (limited by size)
+    so the tasks running on the same host as the producer don't download them again.
+    """
+
+    def __init__(self, storage: FileStorage, cache_dir: str, max_cache_size_mb: int = 1024):
+        self.storage = storage
+        self.cache_dir = cache_dir
+        self.max_cache_size = max_cache_size_mb * 1024 * 1024
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def build_key(local_fn: str) -> str:
+        return file_sha256(local_fn) + os.path.splitext(local_fn)[1]
+
+    def _cached_fn(self, remote_path: str) -> str:
+        return os.path.join(self.cache_dir, os.path.basename(remote_path))
+
+    def _add_to_cache(self, local_fn: str, cached_fn: str):
+        if self.max_cache_size <= 0:
+            return
+        # the file is copied under a temp name first to not let the other processes read it half-written
+        fd, tmp_fn = tempfile.mkstemp(dir=self.cache_dir, prefix='.', suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copyfile(local_fn, tmp_fn)
+            os.replace(tmp_fn, cached_fn)
+        except OSError as e:
+            log.warning(f'Unable to cache page artifact {cached_fn}: {e}')
+            if os.path.exists(tmp_fn):
+                os.remove(tmp_fn)
+            return
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = list()
+            total_size = 0
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.startswith('.') or not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_atime, stat.st_size, entry.path))
+                total_size += stat.st_size
+            if total_size <= self.max_cache_size:
+                return
+            # the least recently used files are removed first
+            for _atime, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total_size -= size
+                if total_size <= self.max_cache_size:
+                    return
+
+    def put(self, remote_dir: str, local_fn: str) -> str:
+        """
+        Uploads the file to the specified folder of the shared storage under its content-addressed name.
+        Returns the remote path of the stored file.
+        """
+        remote_path = f'{remote_dir}/{self.build_key(local_fn)}'
+        self.storage.upload_file(remote_path=remote_path, local_path=local_fn)
+        self._add_to_cache(local_fn, self._cached_fn(remote_path))
+        return remote_path
+
+    @contextmanager
+    def get_as_local_fn(self, remote_path: str) -> Generator[Tuple[str, str], None, None]:
+        """
+        Provides a private local copy of the stored file which the caller is free to modify.
+        The copy is deleted on exit.
+        """
+        _, ext = os.path.splitext(remote_path)
+        fd, fn = tempfile.mkstemp(suffix=ext)
+        os.close(fd)
+        try:
+            self.download_file(remote_path, fn)
+            yield fn, remote_path
+        finally:
+            os.remove(fn)
+
+    def download_file(self, remote_path: str, local_fn: str):
+        cached_fn = self._cached_fn(remote_path)
+        try:
+            shutil.copyfile(cached_fn, local_fn)
+            os.utime(cached_fn)
+        except FileNotFoundError:
+            self.storage.download_file(remote_path=remote_path, local_path=local_fn)
+            self._add_to_cache(local_fn, cached_fn)
+
+    def remove_from_cache(self, remote_path: str):
+        try:
+            os.remove(self._cached_fn(remote_path))
+        except FileNotFoundError:
+            pass
+
+    def delete(self, remote_path: str):
+        """
+        Removes the consumed file from the shared storage and from the local cache.
+        """
+        try:
+            self.storage.clean(remote_path)
+        except RemoteResourceNotFound:
+            pass
+        self.remove_from_cache(remote_path)
+
+
+_page_artifact_store: Optional[PageArtifactStore] = None
+
+
+def get_page_artifact_store() -> PageArtifactStore:
+    global _page_artifact_store
+    if not _page_artifact_store:
+        settings = get_settings()
+        storage = get_file_storage()
+        # no need to cache the files if the storage itself is on a local / shared volume
+        _page_artifact_store = PageArtifactStore(storage,
+                                                 cache_dir=settings.page_artifacts_cache_dir,
+                                                 max_cache_size_mb=0 if storage.local_path('')
+                                                 else settings.page_artifacts_cache_size_mb)
+    return _page_artifact_store
@@ -8,7 +8,7 @@ from typing import Generator
 
 from PIL import Image
 
-from text_extraction_system.config import get_settings
+from text_extraction_system.java_worker.java_worker import run_java_class
 from text_extraction_system.locking.socket_lock import get_lock
 from text_extraction_system.pdf.errors import InputFileDoesNotExist, \
     OutputPDFDoesNotExistAfterConversion
@@ -28,10 +28,7 @@ def convert_image_to_pdf(src_fn: str,
     """
     Converts image to pdf file using custom Java solution
     """
-    args = ['java', '-cp', f'{get_settings().java_modules_path}/*',
-            'com.lexpredict.textextraction.MakePDFFromImages',
-            out_fn, src_fn]
-    return run_process(args, timeout_sec)
+    return run_java_class('com.lexpredict.textextraction.MakePDFFromImages', [out_fn, src_fn], timeout_sec)
 
 
 def soffice_convert_to_pdf(src_fn: str,
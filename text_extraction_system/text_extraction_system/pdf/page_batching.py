@@ -0,0 +1,86 @@
+from dataclasses import dataclass
+from typing import List
+
+import pikepdf
+
+# US Letter - used if the page has no media box
+DEFAULT_PAGE_SIZE_PT = (612, 792)
+
+# Relative price of rendering and OCR-ing a page image vs. the fixed overhead of a page processing task
+# (downloading the page from the storage, loading the request metadata, delivering the progress, uploading results).
+# The cost unit is one megapixel of the rendered page image.
+COST_PER_IMAGE = 0.5
+
+
+@dataclass
+class PageCost:
+    page_num: int
+    images: int
+    megapixels: float
+
+    @property
+    def cost(self) -> float:
+        return self.megapixels + COST_PER_IMAGE * self.images
+
+
+def _page_size_pt(page: pikepdf.Object):
+    # MediaBox can be inherited from the parent page tree nodes
+    node = page
+    while node is not None:
+        box = node.get('/MediaBox')
+        if box is not None:
+            x0, y0, x1, y1 = [float(c) for c in box]
+            return abs(x1 - x0), abs(y1 - y0)
+        node = node.get('/Parent')
+    return DEFAULT_PAGE_SIZE_PT
+
+
+def estimate_page_costs(pdf_fn: str, dpi: int = 300, pdf_password: str = None) -> List[PageCost]:
+    """
+    Estimates the processing cost of the pages containing images (the pages processed by the per-page tasks)
+    by the amount of the images and the size of the page image rendered at the specified DPI.
+    """
+    doc = pikepdf.Pdf.open(pdf_fn) if not pdf_password else pikepdf.Pdf.open(pdf_fn, password=pdf_password)
+    res: List[PageCost] = list()
+    for i in range(0, len(doc.pages)):
+        page = doc.pages[i]
+        images = len(page.images.keys())
+        if not images:
+            continue
+        width_pt, height_pt = _page_size_pt(page)
+        megapixels = (width_pt / 72 * dpi) * (height_pt / 72 * dpi) / 1e6
+        res.append(PageCost(page_num=i + 1, images=images, megapixels=megapixels))
+    return res
+
+
+def plan_page_batches(page_costs: List[PageCost],
+                      workers: int,
+                      min_batch_cost: float,
+                      max_batch_cost: float,
+                      max_pages_per_batch: int) -> List[List[int]]:
+    """
+    Groups the consecutive pages into batches processed by a single task each.
+    The target cost of a batch is the total cost divided by the number of workers - to keep all workers busy -
+    but not less than min_batch_cost (to amortize the per-task overhead on small pages)
+    and not more than max_batch_cost (to spread large scans across the cluster).
+    A page costing more than the target is always processed in a batch of its own.
+    Returns the lists of 1-based page numbers.
+    """
+    if not page_costs:
+        return []
+    total_cost = sum(pc.cost for pc in page_costs)
+    target_cost = min(max(total_cost / max(workers, 1), min_batch_cost), max_batch_cost)
+
+    batches: List[List[int]] = list()
+    batch: List[int] = list()
+    batch_cost: float = 0
+    for pc in page_costs:
+        if batch and (batch_cost + pc.cost > target_cost or len(batch) >= max_pages_per_batch):
+            batches.append(batch)
+            batch = list()
+            batch_cost = 0
+        batch.append(pc.page_num)
+        batch_cost += pc.cost
+    if batch:
+        batches.append(batch)
+    return batches
@@ -1,11 +1,9 @@
 import os
 import re
 import shutil
-import subprocess
 from contextlib import contextmanager
 from logging import getLogger
 from subprocess import CompletedProcess
-from subprocess import PIPE
 from tempfile import mkdtemp
 from typing import Generator
 from typing import List, Optional, Tuple, Dict
@@ -20,7 +18,7 @@ from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
 from pdfminer.pdfpage import PDFPage
 from pdfminer.pdfparser import PDFParser
 
-from text_extraction_system.config import get_settings
+from text_extraction_system.java_worker.java_worker import run_java_class
 from text_extraction_system.pdf.utils import pikepdf_opened_w_error
 from text_extraction_system.processes import raise_from_process, render_process_msg
 from text_extraction_system.utils import page_num_to_fn
@@ -79,12 +77,9 @@ def extract_pdf_images(pdf_fn: str,
     """
     if not temp_dir:
         temp_dir = mkdtemp(prefix='pdf_images_')
-    java_modules_path = get_settings().java_modules_path
     basefn = os.path.splitext(os.path.basename(pdf_fn))[0]
 
-    args = ['java', '-cp', f'{java_modules_path}/*',
-            'org.apache.pdfbox.tools.PDFToImage',
-            '-format', 'png',
+    args = ['-format', 'png',
             '-dpi', f'{dpi}',
             '-quality', '1',
             '-prefix', f'{temp_dir}/{basefn}__']
@@ -99,8 +94,7 @@ def extract_pdf_images(pdf_fn: str,
 
     args += [pdf_fn]
 
-    completed_process: CompletedProcess = subprocess.run(args, check=False, timeout=timeout_sec,
-                                                         universal_newlines=True, stderr=PIPE, stdout=PIPE)
+    completed_process: CompletedProcess = run_java_class('org.apache.pdfbox.tools.PDFToImage', args, timeout_sec)
     raise_from_process(log, completed_process, process_title=lambda: f'Extract page images from {pdf_fn}')
 
     raise_from_pdfbox_error_messages(completed_process)
@@ -189,13 +183,48 @@ def extract_page_images(pdf_fn: str,
 #         shutil.rmtree(temp_dir_no_text, ignore_errors=True)
 
 
-def get_page_images_amount(pdf_fn: str, pdf_password: str = None) -> int:
+def get_page_nums_with_images(pdf_fn: str, pdf_password: str = None) -> List[int]:
+    """
+    Returns 1-based numbers of the pages containing images - the pages which may require OCR.
+    """
     doc = pikepdf.Pdf.open(pdf_fn) if not pdf_password else pikepdf.Pdf.open(pdf_fn, password=pdf_password)
-    res = 0
-    for i in range(0, len(doc.pages)):
-        if doc.pages[i].images.keys():
-            res += 1
-    return res
+    return [i + 1 for i in range(0, len(doc.pages)) if doc.pages[i].images.keys()]
+
+
+def get_page_images_amount(pdf_fn: str, pdf_password: str = None) -> int:
+    return len(get_page_nums_with_images(pdf_fn, pdf_password))
+
+
+def remove_page_text(doc: pikepdf.Pdf, page_index: int):
+    page = doc.pages[page_index]
+    content_stream = pikepdf.parse_content_stream(page)
+    to_remove = [i for i, (_, op) in enumerate(content_stream)
+                 if op == pikepdf.Operator("BT") or op == pikepdf.Operator("ET")]
+    to_remove = [to_remove[i:i + 2] for i in range(0, len(to_remove), 2)][::-1]
+    for start, end in to_remove:
+        del content_stream[start:end]
+    new_content_stream = pikepdf.unparse_content_stream(content_stream)
+    doc.pages[page_index].Contents = doc.make_stream(new_content_stream)
+
+
+def render_page_without_text(doc: pikepdf.Pdf, page_index: int, dst_pdf_fn: str, dpi: int = 300) -> str:
+    """
+    Removes the text from the specified page of the document, saves the page as a separate PDF file
+    and renders it to a PNG image placed next to it.
+    Returns the image file name.
+    """
+    remove_page_text(doc, page_index)
+
+    # Create separate pdf-page
+    dst = pikepdf.Pdf.new()
+    dst.pages.append(doc.pages[page_index])
+    dst.save(dst_pdf_fn)
+
+    # Convert pdf to image
+    pdf_pages = convert_from_path(dst_pdf_fn, dpi)
+    page_no_text_fn = f"{os.path.splitext(dst_pdf_fn)[0]}.png"
+    pdf_pages[0].save(page_no_text_fn, 'PNG')
+    return page_no_text_fn
 
 
 def extract_page_ocr_images(pdf_fn: str, start_page: int = 1, end_page: int = 0, pdf_password: str = None,
@@ -206,32 +235,29 @@ def extract_page_ocr_images(pdf_fn: str, start_page: int = 1, end_page: int = 0,
 
     doc = pikepdf.Pdf.open(pdf_fn) if not pdf_password else pikepdf.Pdf.open(pdf_fn, password=pdf_password)
     for i in range(start_page-1, abs(end_page) or len(doc.pages)):
-        page = doc.pages[i]
-        if not page.images.keys():
+        if not doc.pages[i].images.keys():
             continue
-        content_stream = pikepdf.parse_content_stream(page)
-        to_remove = [i for i, (_, op) in enumerate(content_stream)
-                     if op == pikepdf.Operator("BT") or op == pikepdf.Operator("ET")]
-        to_remove = [to_remove[i:i + 2] for i in range(0, len(to_remove), 2)][::-1]
-        for start, end in to_remove:
-            del content_stream[start:end]
-        new_content_stream = pikepdf.unparse_content_stream(content_stream)
-        doc.pages[i].Contents = doc.make_stream(new_content_stream)
-
-        # Create separate pdf-page
-        dst = pikepdf.Pdf.new()
-        dst.pages.append(doc.pages[i])
         page_no_text_fn = os.path.join(temp_dir_no_text, f'{base_fn}__{page_num_to_fn(i+1)}.pdf')
-        dst.save(page_no_text_fn)
-
-        # Convert pdf to image
-        pdf_pages = convert_from_path(page_no_text_fn, dpi)
-        page_no_text_fn = f"{page_no_text_fn[:-3]}png"
-        pdf_pages[0].save(page_no_text_fn, 'PNG')
-        page_by_num_no_text[i+1] = page_no_text_fn
+        page_by_num_no_text[i+1] = render_page_without_text(doc, i, page_no_text_fn, dpi)
     return page_by_num_no_text, temp_dir_no_text
 
 
+@contextmanager
+def extract_page_ocr_image(pdf_page_fn: str, dpi: int = 300) -> Generator[str, None, None]:
+    """
+    Renders the image of the single-page PDF file with the text removed for the OCR needs.
+    Used by the per-page processing tasks so the pages of a document are rasterized in parallel
+    on the workers processing them.
+    """
+    temp_dir_no_text = mkdtemp(prefix='pdf_images_')
+    try:
+        base_fn = os.path.splitext(os.path.basename(pdf_page_fn))[0]
+        with pikepdf_opened_w_error(pdf_page_fn) as doc:
+            yield render_page_without_text(doc, 0, os.path.join(temp_dir_no_text, f'{base_fn}__no_text.pdf'), dpi)
+    finally:
+        shutil.rmtree(temp_dir_no_text, ignore_errors=True)
+
+
 @contextmanager
 def extract_full_images_from_pdf(pdf_fn: str, start_page: int = 1, end_page: int = 0, pdf_password: str = None,
                                  dpi: int = 300) -> Generator[Dict[int, str], None, None]:
@@ -335,10 +361,7 @@ def merge_pdf_pages(original_pdf_fn: str,
     try:
         dst_pdf_fn = os.path.join(temp_dir, os.path.basename(original_pdf_fn))
 
-        java_modules_path = get_settings().java_modules_path
-        args = ['java', '-cp', f'{java_modules_path}/*',
-                'com.lexpredict.textextraction.mergepdf.MergeInPageLayers',
-                '--original-pdf', original_pdf_fn,
+        args = ['--original-pdf', original_pdf_fn,
                 '--dst-pdf', dst_pdf_fn]
         if page_pdf_dir:
             args += ['--page-dir', page_pdf_dir]
@@ -352,10 +375,8 @@ def merge_pdf_pages(original_pdf_fn: str,
         if original_pdf_password:
             args += ['--password', original_pdf_password]
 
-        completed_process: CompletedProcess = subprocess.run(args,
-                                                             check=False,
-                                                             timeout=timeout_sec,
-                                                             universal_newlines=True, stderr=PIPE, stdout=PIPE)
+        completed_process: CompletedProcess = run_java_class(
+            'com.lexpredict.textextraction.mergepdf.MergeInPageLayers', args, timeout_sec)
         raise_from_process(log, completed_process,
                            process_title=lambda: f'Extract page images for OCR needs '
                                                  f'(with text removed) from {original_pdf_fn}')
@@ -372,17 +393,12 @@ def rotate_pdf_pages(original_pdf_fn: str,
                      resulted_pdf_fn: str,
                      rotation_angle: float,
                      timeout_sec: int = 3000):
-    java_modules_path = get_settings().java_modules_path
-    args = ['java', '-cp', f'{java_modules_path}/*',
-            'com.lexpredict.textextraction.RotatePdf',
-            '--original-pdf', original_pdf_fn,
+    args = ['--original-pdf', original_pdf_fn,
             '--dst-pdf', resulted_pdf_fn,
             '--rot-angle', str(rotation_angle)]
 
-    completed_process: CompletedProcess = subprocess.run(args,
-                                                         check=False,
-                                                         timeout=timeout_sec,
-                                                         universal_newlines=True, stderr=PIPE, stdout=PIPE)
+    completed_process: CompletedProcess = run_java_class('com.lexpredict.textextraction.RotatePdf',
+                                                         args, timeout_sec)
     raise_from_process(log, completed_process,
                        process_title=lambda: f'Rotate PDF pages for {original_pdf_fn}')
 
@@ -0,0 +1,36 @@
+import os
+
+from text_extraction_system.pdf.page_batching import PageCost, estimate_page_costs, plan_page_batches
+from text_extraction_system.pdf.pdf import get_page_nums_with_images
+
+data_dir = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def test_estimate_page_costs():
+    fn = os.path.join(data_dir, 'ocr1.pdf')
+    page_costs = estimate_page_costs(fn)
+    assert [pc.page_num for pc in page_costs] == get_page_nums_with_images(fn)
+    for pc in page_costs:
+        assert pc.images > 0
+        assert pc.megapixels > 1
+
+
+def test_small_pages_grouped():
+    page_costs = [PageCost(page_num=i, images=1, megapixels=0.5) for i in range(1, 101)]
+    batches = plan_page_batches(page_costs, workers=4, min_batch_cost=10, max_batch_cost=50, max_pages_per_batch=20)
+    assert [n for batch in batches for n in batch] == list(range(1, 101))
+    assert len(batches) == 5
+    assert all(len(batch) == 20 for batch in batches)
+
+
+def test_large_pages_spread():
+    page_costs = [PageCost(page_num=i, images=1, megapixels=8.4) for i in range(1, 9)]
+    batches = plan_page_batches(page_costs, workers=8, min_batch_cost=5, max_batch_cost=50, max_pages_per_batch=20)
+    assert batches == [[i] for i in range(1, 9)]
+
+
+def test_cost_capped():
+    page_costs = [PageCost(page_num=i, images=1, megapixels=8.4) for i in range(1, 101)]
+    batches = plan_page_batches(page_costs, workers=2, min_batch_cost=10, max_batch_cost=30, max_pages_per_batch=20)
+    assert all(len(batch) == 3 for batch in batches[:-1])
+    assert not plan_page_batches([], workers=2, min_batch_cost=10, max_batch_cost=30, max_pages_per_batch=20)
@@ -6,7 +6,7 @@ import pikepdf
 from text_extraction_system.commons.tests.commons import with_default_settings
 from text_extraction_system.data_extract.data_extract import extract_text_pdfminer
 from text_extraction_system.pdf.pdf import split_pdf_to_page_blocks, extract_page_images, \
-    iterate_pages, page_requires_ocr
+    iterate_pages, page_requires_ocr, extract_page_ocr_image, get_page_nums_with_images
 
 data_dir = os.path.join(os.path.dirname(__file__), 'data')
 
@@ -37,6 +37,17 @@ def test_extract_images():
         assert not os.path.exists(d)
 
 
+def test_extract_page_ocr_image():
+    fn = os.path.join(data_dir, 'ocr1.pdf')
+    page_nums = get_page_nums_with_images(fn)
+    assert page_nums
+    with split_pdf_to_page_blocks(fn, 1) as page_fns:
+        with extract_page_ocr_image(page_fns[page_nums[0] - 1]) as image_fn:
+            assert os.path.splitext(image_fn)[1] == '.png'
+            assert os.path.getsize(image_fn) > 5
+    assert not os.path.exists(os.path.dirname(image_fn))
+
+
 def test_split_pdf1():
     fn = os.path.join(data_dir, 'pdf_9_pages.pdf')
     with split_pdf_to_page_blocks(fn, 3) as block_files:
@@ -0,0 +1,22 @@
+from typing import Optional
+
+from redis import Redis
+
+from text_extraction_system.config import get_settings
+
+_redis: Optional[Redis] = None
+
+
+def get_redis() -> Redis:
+    """
+    Returns the client of the Redis used as the Celery broker.
+    It keeps the task health registry and delivers the request notifications.
+    """
+    global _redis
+    if not _redis:
+        broker_url = get_settings().celery_broker
+        if not broker_url.startswith('redis:'):
+            raise Exception('Only Redis broker supported for the task health tracking and request notifications.')
+        # the connection pool of the client is re-created automatically in the forked worker processes
+        _redis = Redis.from_url(broker_url)
+    return _redis
@@ -1,12 +1,11 @@
 import logging
 import os
 import shutil
-import subprocess
 from subprocess import CompletedProcess
 from tempfile import mkdtemp
 from typing import Optional
 
-from text_extraction_system.config import get_settings
+from text_extraction_system.java_worker.java_worker import run_java_class
 from text_extraction_system.pdf.pdf import raise_from_pdfbox_error_messages
 from text_extraction_system.processes import raise_from_process
 
@@ -20,20 +19,14 @@ def remove_ocr_layer(pdf_file_name: str,
     try:
         dst_pdf_fn = os.path.join(temp_dir, os.path.basename(pdf_file_name))
 
-        java_modules_path = get_settings().java_modules_path
-        args = ['java', '-cp', f'{java_modules_path}/*',
-                'com.lexpredict.textextraction.RemovePdfText',
-                '-orig', pdf_file_name,
+        args = ['-orig', pdf_file_name,
                 '-dst', dst_pdf_fn]
 
         if pdf_password:
             args += ['--password', pdf_password]
 
-        completed_process: CompletedProcess = subprocess.run(
-            args,
-            check=False,
-            timeout=timeout_sec,
-            universal_newlines=True, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+        completed_process: CompletedProcess = run_java_class('com.lexpredict.textextraction.RemovePdfText',
+                                                             args, timeout_sec)
         raise_from_process(log, completed_process,
                            process_title=lambda: f"Couldn't remove OCR layers from {pdf_file_name}")
 
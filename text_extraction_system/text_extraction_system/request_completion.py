@@ -0,0 +1,115 @@
+import asyncio
+import threading
+import time
+from logging import getLogger
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from text_extraction_system.redis_client import get_redis
+
+log = getLogger(__name__)
+
+# Redis pub/sub channel receiving the ids of the requests finished successfully or with errors
+channel_request_finished = 'text_extraction_system:request_finished'
+
+
+def notify_request_finished(request_id: str):
+    try:
+        get_redis().publish(channel_request_finished, request_id)
+    except Exception as e:
+        # the waiting web api processes re-check the request status periodically anyway
+        log.warning(f'Unable to publish the request finish notification (#{request_id}): {e}')
+
+
+class RequestCompletionListener:
+    """
+    Lets the coroutines of the web api await the finish of the requests without blocking the event loop.
+    A single background thread per process listens for the finish notifications and wakes up the waiting coroutines.
+    """
+
+    def __init__(self):
+        self._waiters: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]]] = dict()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='request-completion-listener', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(channel_request_finished)
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self._notify(message['data'].decode('utf-8'))
+            except Exception as e:
+                log.warning(f'Request finish notifications listener failed, reconnecting: {e}')
+                time.sleep(1)
+
+    def _notify(self, request_id: str):
+        with self._lock:
+            waiters = self._waiters.pop(request_id, None)
+        for loop, future in waiters or []:
+            loop.call_soon_threadsafe(_set_done, future)
+
+    def _register(self, request_id: str, loop: asyncio.AbstractEventLoop, future: asyncio.Future):
+        with self._lock:
+            self._waiters.setdefault(request_id, list()).append((loop, future))
+
+    def _unregister(self, request_id: str, future: asyncio.Future):
+        with self._lock:
+            waiters = self._waiters.get(request_id)
+            if not waiters:
+                return
+            waiters[:] = [w for w in waiters if w[1] is not future]
+            if not waiters:
+                del self._waiters[request_id]
+
+    async def wait_for_finish(self,
+                              request_id: str,
+                              timeout_sec: float,
+                              is_finished: Callable[[], Awaitable[bool]],
+                              recheck_interval_sec: float = 30) -> bool:
+        """
+        Waits until the request is finished or the timeout expires. Returns False on timeout.
+        :param is_finished: check of the request status; executed before waiting
+                            and then once per recheck_interval_sec in case a notification is lost.
+        """
+        self._ensure_started()
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        # registered before the first status check to not miss a notification sent in between
+        self._register(request_id, loop, future)
+        try:
+            deadline = loop.time() + timeout_sec
+            while True:
+                if await is_finished():
+                    return True
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return False
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), min(remaining, recheck_interval_sec))
+                    return True
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._unregister(request_id, future)
+
+
+def _set_done(future: asyncio.Future):
+    if not future.done():
+        future.set_result(True)
+
+
+_listener: Optional[RequestCompletionListener] = None
+
+
+def get_request_completion_listener() -> RequestCompletionListener:
+    global _listener
+    if not _listener:
+        _listener = RequestCompletionListener()
+    return _listener
@@ -1,16 +1,20 @@
+import asyncio
+import threading
+import time
 from dataclasses import dataclass, field
 from datetime import datetime
-from io import BytesIO
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Tuple
 import dateutil.parser
 
-from dataclasses_json import dataclass_json, config
+from dataclasses_json import dataclass_json, config, Exclude
 from marshmallow import fields
 from text_extraction_system_api.dto import OutputFormat, TableParser
 from webdav3.exceptions import RemoteResourceNotFound, RemoteParentNotFound
 
+from text_extraction_system.config import get_settings
 from text_extraction_system.constants import metadata_fn
-from text_extraction_system.file_storage import get_webdav_client
+from text_extraction_system.file_storage import get_file_storage, StoragePreconditionFailed
+from text_extraction_system.request_status_index import index_request_statuses, get_indexed_request_statuses
 from text_extraction_system_api.dto import RequestStatus, STATUS_PENDING
 
 
@@ -64,6 +68,7 @@ class RequestMetadata:
     plain_text_file: Optional[str] = None
     text_structure_file: Optional[str] = None
     pdf_coordinates_file: Optional[str] = None
+    pdf_coordinates_pages_file: Optional[str] = None
     tables_file: Optional[str] = None
     doc_language: Optional[str] = None
     pdf_pages_ocred: Optional[List[int]] = None
@@ -77,6 +82,14 @@ class RequestMetadata:
     page_ocr_timeout_sec: int = 60
     remove_ocr_layer: bool = False
     detect_orientation_tesseract: bool = False
+    original_document_sha256: Optional[str] = None
+
+    # incremented on every save - orders the statuses in the status index (see request_status_index.py)
+    metadata_version: int = 0
+
+    # version (ETag) of the metadata file the object is loaded from or saved to - for the compare-and-swap saves;
+    # not stored in the file
+    storage_etag: Optional[str] = field(default=None, compare=False, metadata=config(exclude=Exclude.ALWAYS))
 
     def append_error(self, problem: str, exc: Exception):
         error_message: List[str] = list()
@@ -110,16 +123,194 @@ class RequestMetadata:
         )
 
 
-def load_request_metadata(request_id) -> Optional[RequestMetadata]:
+class RequestMetadataVersionConflict(Exception):
+    """
+    The request metadata has been changed by another task or web api call since it was loaded.
+    """
+    pass
+
+
+class RequestMetadataCache:
+    """
+    In-process cache of the request metadata files: request_id -> (time loaded, ETag, metadata.json content).
+    Entries younger than the TTL are used without any storage round trips.
+    Older ones are re-validated with a conditional request which transfers the file only if it has changed.
+    """
+
+    def __init__(self, ttl_sec: float, max_entries: int = 10000):
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        self._entries: Dict[str, Tuple[float, Optional[str], bytes]] = dict()
+        self._lock = threading.Lock()
+
+    def get(self, request_id: str) -> Optional[Tuple[float, Optional[str], bytes]]:
+        with self._lock:
+            return self._entries.get(request_id)
+
+    def put(self, request_id: str, etag: Optional[str], content: bytes):
+        with self._lock:
+            if len(self._entries) >= self.max_entries and request_id not in self._entries:
+                # drop the oldest half - the cache is just an optimization
+                for key, _entry in sorted(self._entries.items(), key=lambda kv: kv[1][0])[:self.max_entries // 2]:
+                    del self._entries[key]
+            self._entries[request_id] = (time.time(), etag, content)
+
+    def invalidate(self, request_id: str):
+        with self._lock:
+            self._entries.pop(request_id, None)
+
+
+_metadata_cache: Optional[RequestMetadataCache] = None
+
+
+def get_metadata_cache() -> RequestMetadataCache:
+    global _metadata_cache
+    if not _metadata_cache:
+        _metadata_cache = RequestMetadataCache(get_settings().request_metadata_cache_ttl_sec)
+    return _metadata_cache
+
+
+def _parse_metadata(content: bytes, etag: Optional[str]) -> RequestMetadata:
+    req = RequestMetadata.from_json(content)
+    req.storage_etag = etag
+    return req
+
+
+def _get_cached(request_id: str, max_age_sec: Optional[float]) \
+        -> Tuple[Optional[Tuple[float, Optional[str], bytes]], Optional[RequestMetadata]]:
+    """
+    Returns the cache entry and the metadata parsed from it if it is fresh enough to be used without re-validation.
+    """
+    cache = get_metadata_cache()
+    max_age_sec = cache.ttl_sec if max_age_sec is None else max_age_sec
+    cached = cache.get(request_id)
+    if cached and time.time() - cached[0] < max_age_sec:
+        return cached, _parse_metadata(cached[2], cached[1])
+    return cached, None
+
+
+def _put_loaded(request_id: str,
+                cached: Optional[Tuple[float, Optional[str], bytes]],
+                content: Optional[bytes],
+                etag: Optional[str]) -> RequestMetadata:
+    if content is None:
+        content = cached[2]
+    get_metadata_cache().put(request_id, etag, content)
+    return _parse_metadata(content, etag)
+
+
+def load_request_metadata(request_id, max_age_sec: Optional[float] = None) -> Optional[RequestMetadata]:
+    """
+    Loads the request metadata using the in-process cache.
+    :param max_age_sec: max age of the cached version which can be returned without re-validating it
+                        in the storage. Default: request_metadata_cache_ttl_sec from the settings.
+                        Use 0 to always check (with a conditional request) that the cached version is actual.
+    """
+    cached, req = _get_cached(request_id, max_age_sec)
+    if req:
+        return req
+    try:
+        content, etag = get_file_storage().download_if_modified(f'{request_id}/{metadata_fn}',
+                                                                cached[1] if cached else None)
+    except (RemoteParentNotFound, RemoteResourceNotFound):
+        get_metadata_cache().invalidate(request_id)
+        return None
+    return _put_loaded(request_id, cached, content, etag)
+
+
+async def load_request_metadata_async(request_id, max_age_sec: Optional[float] = None) \
+        -> Optional[RequestMetadata]:
+    """
+    The same as load_request_metadata() but using the asyncio storage client - for the web api.
+    """
+    # not imported at the module level to not load the asyncio http client in the Celery workers
+    from text_extraction_system.async_file_storage import get_async_file_storage
+    cached, req = _get_cached(request_id, max_age_sec)
+    if req:
+        return req
     try:
-        webdav_client = get_webdav_client()
-        buf = BytesIO()
-        webdav_client.download_from(buf, f'{request_id}/{metadata_fn}')
-        return RequestMetadata.from_json(buf.getvalue())
+        content, etag = await get_async_file_storage().download_if_modified(f'{request_id}/{metadata_fn}',
+                                                                            cached[1] if cached else None)
     except (RemoteParentNotFound, RemoteResourceNotFound):
+        get_metadata_cache().invalidate(request_id)
         return None
+    return _put_loaded(request_id, cached, content, etag)
+
+
+def _version_conflict(req: RequestMetadata) -> RequestMetadataVersionConflict:
+    get_metadata_cache().invalidate(req.request_id)
+    return RequestMetadataVersionConflict(f'Metadata of request #{req.request_id} has been changed '
+                                          f'since it was loaded')
+
+
+def _put_saved(req: RequestMetadata, content: bytes, etag: Optional[str]):
+    req.storage_etag = etag
+    cache = get_metadata_cache()
+    if etag:
+        cache.put(req.request_id, etag, content)
+    else:
+        # the storage did not report the new version - it will be re-read on the next load
+        cache.invalidate(req.request_id)
+
+
+def save_request_metadata(req: RequestMetadata, check_version: bool = False):
+    """
+    Stores the request metadata.
+    :param check_version: compare-and-swap save - store the metadata only if the stored version is still the one
+                          this object has been loaded from. Raises RequestMetadataVersionConflict otherwise.
+    """
+    req.metadata_version += 1
+    content = req.to_json(indent=2).encode('utf-8')
+    expected_etag = req.storage_etag if check_version else None
+    try:
+        etag = get_file_storage().upload_if_match(content, f'{req.request_id}/{metadata_fn}', expected_etag)
+    except StoragePreconditionFailed as e:
+        req.metadata_version -= 1
+        raise _version_conflict(req) from e
+    _put_saved(req, content, etag)
+    index_request_statuses([(req.to_request_status(), req.metadata_version)])
+
+
+async def save_request_metadata_async(req: RequestMetadata, check_version: bool = False):
+    """
+    The same as save_request_metadata() but using the asyncio storage client - for the web api.
+    """
+    from starlette.concurrency import run_in_threadpool
+    from text_extraction_system.async_file_storage import get_async_file_storage
+    req.metadata_version += 1
+    content = req.to_json(indent=2).encode('utf-8')
+    expected_etag = req.storage_etag if check_version else None
+    try:
+        etag = await get_async_file_storage().upload_if_match(content, f'{req.request_id}/{metadata_fn}',
+                                                              expected_etag)
+    except StoragePreconditionFailed as e:
+        req.metadata_version -= 1
+        raise _version_conflict(req) from e
+    _put_saved(req, content, etag)
+    await run_in_threadpool(index_request_statuses, [(req.to_request_status(), req.metadata_version)])
+
+
+async def load_request_statuses_async(request_ids: List[str]) -> Dict[str, RequestStatus]:
+    """
+    Returns the statuses of the existing requests: request id -> status - for the web api.
+    The statuses are read from the status index in a single round trip. The requests missing in the index
+    (e.g. created before it was introduced) are loaded from the storage concurrently and added to the index.
+    """
+    from starlette.concurrency import run_in_threadpool
+    statuses = await run_in_threadpool(get_indexed_request_statuses, request_ids)
+    missing = [request_id for request_id in dict.fromkeys(request_ids) if request_id not in statuses]
+    if not missing:
+        return statuses
+
+    semaphore = asyncio.Semaphore(get_settings().request_status_load_concurrency)
 
+    async def load(request_id: str) -> Optional[RequestMetadata]:
+        async with semaphore:
+            return await load_request_metadata_async(request_id)
 
-def save_request_metadata(req: RequestMetadata):
-    webdav_client = get_webdav_client()
-    webdav_client.upload_to(req.to_json(indent=2).encode('utf-8'), f'{req.request_id}/{metadata_fn}')
+    loaded = [(req.to_request_status(), req.metadata_version)
+              for req in await asyncio.gather(*[load(i) for i in missing]) if req]
+    # the loaded metadata can be a bit older than the status indexed by a worker meanwhile - not overwritten then
+    await run_in_threadpool(index_request_statuses, loaded)
+    statuses.update({status.request_id: status for status, _version in loaded})
+    return statuses
@@ -0,0 +1,84 @@
+from logging import getLogger
+from typing import Dict, List, Iterable, Tuple
+
+from text_extraction_system.config import get_settings
+from text_extraction_system.redis_client import get_redis
+from text_extraction_system_api.dto import RequestStatus
+
+log = getLogger(__name__)
+
+# Redis keys of the request statuses: <prefix><request id> -> <metadata version>\n<RequestStatus json>.
+# Updated on every save of the request metadata and expiring after request_status_index_ttl_sec
+# so the index never outlives the requests for long.
+# The status is never replaced by the one of an older metadata version: the workers and the web api
+# saving the metadata concurrently (or the backfill of the statuses loaded from the storage)
+# can not put an outdated status over a newer one.
+request_status_key_prefix = 'text_extraction_system:request_status:'
+
+# KEYS: status key; ARGV: metadata version, value, ttl
+# the values stored before the versions were introduced have no version and are always replaced
+_set_if_newer_script = """
+local current = redis.call('get', KEYS[1])
+if current then
+    local version = tonumber(string.match(current, '^(%d+)\\n'))
+    if version and version > tonumber(ARGV[1]) then
+        return 0
+    end
+end
+redis.call('set', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+
+def _key(request_id: str) -> str:
+    return request_status_key_prefix + request_id
+
+
+def _parse_value(value: bytes) -> RequestStatus:
+    version, sep, status_json = value.partition(b'\n')
+    return RequestStatus.from_json(status_json if sep and version.isdigit() else value)
+
+
+def index_request_statuses(statuses: Iterable[Tuple[RequestStatus, int]]):
+    """
+    Stores the statuses in the index in a single round trip.
+    Each status is stored unless the index holds the status of a newer metadata version.
+    The index is an optimization only - the failures are logged and the statuses are removed from the index
+    (best effort) so that they are re-loaded from the storage instead of being served outdated.
+    :param statuses: (request status, version of the request metadata it is taken from)
+    """
+    statuses = list(statuses)
+    try:
+        ttl_sec = get_settings().request_status_index_ttl_sec
+        pipe = get_redis().pipeline(transaction=False)
+        for status, version in statuses:
+            pipe.eval(_set_if_newer_script, 1, _key(status.request_id),
+                      version, f'{version}\n{status.to_json()}', ttl_sec)
+        pipe.execute()
+    except Exception as e:
+        log.warning(f'Unable to update the request status index: {e}')
+        remove_request_statuses([status.request_id for status, _version in statuses])
+
+
+def remove_request_statuses(request_ids: List[str]):
+    try:
+        if request_ids:
+            get_redis().delete(*[_key(request_id) for request_id in request_ids])
+    except Exception as e:
+        log.warning(f'Unable to remove requests from the status index: {e}')
+
+
+def get_indexed_request_statuses(request_ids: List[str]) -> Dict[str, RequestStatus]:
+    """
+    Returns the statuses of the requests found in the index in a single round trip: request id -> status.
+    The requests missing in the index are not included.
+    """
+    if not request_ids:
+        return dict()
+    try:
+        values = get_redis().mget([_key(request_id) for request_id in request_ids])
+    except Exception as e:
+        log.warning(f'Unable to read the request status index: {e}')
+        return dict()
+    return {request_id: _parse_value(value)
+            for request_id, value in zip(request_ids, values) if value is not None}
@@ -0,0 +1,356 @@
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Tuple, Dict, Any, Optional
+
+from webdav3.exceptions import RemoteResourceNotFound
+
+from text_extraction_system.config import get_settings
+from text_extraction_system.file_storage import FileStorage, get_file_storage
+from text_extraction_system.redis_client import get_redis
+from text_extraction_system.request_metadata import RequestMetadata
+from text_extraction_system.version import VERSION_NUMBER, GIT_COMMIT
+
+log = getLogger(__name__)
+
+# Content-addressed cache of the processing results of the documents submitted more than once.
+# An entry is a folder in the shared file storage: <result_cache_root>/<level>/<key>/
+# with the cached files and manifest.json written last - the entries without the manifest are incomplete.
+# The key is the SHA-256 of the uploaded document bytes, the options affecting the cached files
+# and the version of the system.
+#
+# LRU index in Redis: sorted set "<level>/<key>" -> last access time, hash "<level>/<key>" -> entry size,
+# total size of the entries. The least recently used entries are evicted when the total exceeds the limit.
+# The index is changed by the Lua scripts below only - the three keys are always updated together.
+#
+# The entries are not removed with the requests they are stored from or restored into: the same documents
+# are submitted again after the earlier requests are deleted. The size-bounded LRU is the only removal policy.
+redis_result_cache_lru = 'text_extraction_system:result_cache:lru'
+redis_result_cache_sizes = 'text_extraction_system:result_cache:sizes'
+redis_result_cache_total_size = 'text_extraction_system:result_cache:total_size'
+# hit/miss counters: hash "<level>:hits" / "<level>:misses" -> number of lookups
+redis_result_cache_stats = 'text_extraction_system:result_cache:stats'
+# Single-flight locks: <prefix><level>/<key> -> id of the request computing the entry.
+redis_result_cache_flight_prefix = 'text_extraction_system:result_cache:flight:'
+
+manifest_fn = 'manifest.json'
+
+# the cached files are named <prefix><suffix> where the suffix is the part of the request file name
+# following the base name of the original document, e.g. ".plain.txt"
+_cached_fn_prefix = 'document'
+
+_release_flight_script = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# KEYS: lru, sizes, total size; ARGV: entry id, access time, entry size
+# the entry stored concurrently by another request is counted once
+_add_entry_script = """
+redis.call('zadd', KEYS[1], ARGV[2], ARGV[1])
+if redis.call('hsetnx', KEYS[2], ARGV[1], ARGV[3]) == 1 then
+    redis.call('incrby', KEYS[3], ARGV[3])
+end
+return 1
+"""
+
+# KEYS: lru, sizes, total size; ARGV: max total size
+# removes the least recently used entry from the index if the total size exceeds the limit,
+# returns [entry id, size] of the removed entry or nil if nothing is to be evicted
+_pop_lru_entry_script = """
+if tonumber(redis.call('get', KEYS[3]) or '0') <= tonumber(ARGV[1]) then
+    return nil
+end
+local oldest = redis.call('zrange', KEYS[1], 0, 0)
+if #oldest == 0 then
+    return nil
+end
+local size = tonumber(redis.call('hget', KEYS[2], oldest[1]) or '0')
+redis.call('zrem', KEYS[1], oldest[1])
+redis.call('hdel', KEYS[2], oldest[1])
+redis.call('decrby', KEYS[3], size)
+return {oldest[1], size}
+"""
+
+_index_keys = (redis_result_cache_lru, redis_result_cache_sizes, redis_result_cache_total_size)
+
+
+@dataclass(frozen=True)
+class CacheLevel:
+    name: str
+    # fields of RequestMetadata affecting the cached files - included into the key,
+    # None if the keys are not built from the requests
+    key_fields: Optional[Tuple[str, ...]]
+    # fields of RequestMetadata naming the cached files - all named <base name of the original document><suffix>
+    file_fields: Tuple[str, ...]
+    # other fields of RequestMetadata restored from the cache
+    value_fields: Tuple[str, ...]
+
+
+_ocr_key_fields = ('ocr_enable', 'doc_language', 'detect_orientation_tesseract')
+
+# 1: the PDF made by convert_to_pdf() from a non-PDF document
+CONVERTED = CacheLevel(name='converted',
+                       key_fields=(),
+                       file_fields=('converted_to_pdf',),
+                       value_fields=())
+
+# 2: the PDF with the OCR-ed pages merged in by finish_pdf_processing()
+OCRED = CacheLevel(name='ocred',
+                   key_fields=_ocr_key_fields,
+                   file_fields=('ocred_pdf',),
+                   value_fields=('pdf_pages_ocred',))
+
+# 3: the final artifacts of extract_data_and_finish()
+RESULTS = CacheLevel(name='results',
+                     key_fields=_ocr_key_fields + ('output_format', 'read_sections_from_toc', 'table_extraction_enable',
+                                                   'table_parser', 'deskew_enable', 'char_coords_debug_enable',
+                                                   'remove_ocr_layer'),
+                     file_fields=('converted_to_pdf', 'ocred_pdf', 'corrected_pdf', 'pdf_file', 'plain_text_file',
+                                  'text_structure_file', 'pdf_coordinates_file', 'pdf_coordinates_pages_file',
+                                  'tables_file'),
+                     value_fields=('pdf_pages_ocred', 'page_rotate_angles'))
+
+# 4: the glyphless text layer PDF of a page OCR-ed by process_pdf_page(),
+# shared by the documents containing the same page - the entries are stored and restored by PageOCRCache,
+# the key is built by build_page_ocr_key() from the page image and its rotation instead of the request fields
+PAGE_OCR = CacheLevel(name='page_ocr',
+                      key_fields=None,
+                      file_fields=(),
+                      value_fields=())
+
+CACHE_LEVELS = (CONVERTED, OCRED, RESULTS, PAGE_OCR)
+
+
+def build_cache_key(level: CacheLevel, req: RequestMetadata) -> str:
+    if level.key_fields is None:
+        raise ValueError(f'Keys of result cache level "{level.name}" are not built from the requests')
+    key_src = {'level': level.name,
+               'version': [VERSION_NUMBER, GIT_COMMIT],
+               'document': req.original_document_sha256,
+               # the converter and the file names depend on the extension
+               'ext': os.path.splitext(req.original_document)[1],
+               'options': {field: getattr(req, field) for field in level.key_fields}}
+    return hashlib.sha256(json.dumps(key_src, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    Multi-level cache of the request results in the shared file storage (see CacheLevel).
+    The files are copied between the request folders and the cache inside the storage.
+    The cache is an optimization only - the failures are logged and handled as misses.
+    """
+
+    def __init__(self, storage: FileStorage, root: str, max_size_mb: int, flight_ttl_sec: int):
+        self.storage = storage
+        self.root = root.strip('/')
+        self.max_size = max_size_mb * 1024 * 1024
+        self.flight_ttl_sec = flight_ttl_sec
+
+    def _entry_path(self, entry_id: str) -> str:
+        return f'{self.root}/{entry_id}'
+
+    def get(self, level: CacheLevel, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the manifest of the complete entry or None if there is no such entry.
+        Marks the entry as recently used.
+        """
+        entry_id = f'{level.name}/{key}'
+        try:
+            content, _etag = self.storage.download_if_modified(f'{self._entry_path(entry_id)}/{manifest_fn}')
+            manifest = json.loads(content)
+        except RemoteResourceNotFound:
+            manifest = None
+        except Exception as e:
+            log.warning(f'Unable to read result cache entry {entry_id}: {e}')
+            return None
+        try:
+            r = get_redis()
+            if manifest is not None:
+                r.zadd(redis_result_cache_lru, {entry_id: time.time()}, xx=True)
+            r.hincrby(redis_result_cache_stats, f'{level.name}:{"hits" if manifest is not None else "misses"}', 1)
+        except Exception as e:
+            log.warning(f'Unable to update the result cache index: {e}')
+        return manifest
+
+    def copy_from_entry(self, level: CacheLevel, key: str, name: str, dst_path: str) -> bool:
+        """
+        Copies the file of the entry (see get()) to the specified path of the storage.
+        Returns False if the file can not be copied - e.g. the entry is evicted meanwhile.
+        """
+        try:
+            self.storage.copy(f'{self._entry_path(f"{level.name}/{key}")}/{name}', dst_path)
+        except Exception as e:
+            log.warning(f'Unable to restore result cache entry {level.name}/{key}: {e}')
+            return False
+        return True
+
+    def put(self, level: CacheLevel, key: str, files: Dict[str, str], meta: Dict[str, Any]):
+        """
+        Stores the entry if it does not exist yet.
+        :param files: name of the file in the entry -> path of the file in the storage
+        :param meta: json-serializable values stored in the manifest
+        """
+        entry_id = f'{level.name}/{key}'
+        entry_path = self._entry_path(entry_id)
+        try:
+            try:
+                self.storage.get_size(f'{entry_path}/{manifest_fn}')
+                return
+            except RemoteResourceNotFound:
+                pass
+            for path in (self.root, f'{self.root}/{level.name}', entry_path):
+                self.storage.mkdir(path)
+            size = 0
+            for name, remote_path in files.items():
+                self.storage.copy(remote_path, f'{entry_path}/{name}')
+                size += self.storage.get_size(f'{entry_path}/{name}')
+            manifest = json.dumps({'files': sorted(files), 'meta': meta}).encode('utf-8')
+            self.storage.upload_to(manifest, f'{entry_path}/{manifest_fn}')
+            size += len(manifest)
+
+            get_redis().eval(_add_entry_script, len(_index_keys), *_index_keys, entry_id, time.time(), size)
+            self.evict()
+        except Exception as e:
+            log.warning(f'Unable to store result cache entry {entry_id}: {e}')
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns the hit rates of the levels and the size of the cache.
+        """
+        r = get_redis()
+        counters = {k.decode('utf-8'): int(v) for k, v in r.hgetall(redis_result_cache_stats).items()}
+        levels = dict()
+        for level in CACHE_LEVELS:
+            hits = counters.get(f'{level.name}:hits', 0)
+            misses = counters.get(f'{level.name}:misses', 0)
+            levels[level.name] = {'hits': hits,
+                                  'misses': misses,
+                                  'hit_rate': hits / (hits + misses) if hits + misses else None}
+        return {'levels': levels,
+                'entries': r.zcard(redis_result_cache_lru),
+                'total_size': int(r.get(redis_result_cache_total_size) or 0),
+                'max_size': self.max_size}
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the total size fits the limit.
+        """
+        r = get_redis()
+        while True:
+            evicted = r.eval(_pop_lru_entry_script, len(_index_keys), *_index_keys, self.max_size)
+            if not evicted:
+                break
+            entry_id, size = evicted[0].decode('utf-8'), int(evicted[1])
+            # the entry is removed from the index first - the other processes do not evict it twice
+            # and do not restore the files being removed
+            try:
+                self.storage.clean(self._entry_path(entry_id))
+            except RemoteResourceNotFound:
+                pass
+            log.info(f'Evicted result cache entry {entry_id} ({size} bytes)')
+
+    def restore_request_files(self, level: CacheLevel, req: RequestMetadata) -> bool:
+        """
+        Copies the cached files of the level into the request folder under the names the request would give them
+        and sets the corresponding fields of the request metadata.
+        Returns False if there is no such entry.
+        """
+        key = build_cache_key(level, req)
+        manifest = self.get(level, key)
+        if manifest is None:
+            return False
+        base_name = os.path.splitext(req.original_document)[0]
+        entry_path = self._entry_path(f'{level.name}/{key}')
+        try:
+            for name in manifest['files']:
+                self.storage.copy(f'{entry_path}/{name}',
+                                  f'{req.request_id}/{base_name}{name[len(_cached_fn_prefix):]}')
+        except Exception as e:
+            log.warning(f'Unable to restore result cache entry {level.name}/{key}: {e}')
+            return False
+        for field, suffix in manifest['meta']['file_suffixes'].items():
+            setattr(req, field, base_name + suffix if suffix is not None else None)
+        for field in level.value_fields:
+            setattr(req, field, manifest['meta']['values'].get(field))
+        return True
+
+    def store_request_files(self, level: CacheLevel, req: RequestMetadata):
+        """
+        Stores the files of the level produced for the request (the ones still existing in its folder)
+        and the corresponding fields of the request metadata.
+        """
+        base_name = os.path.splitext(req.original_document)[0]
+        file_suffixes: Dict[str, Optional[str]] = dict()
+        files: Dict[str, str] = dict()
+        for field in level.file_fields:
+            fn = getattr(req, field)
+            if not fn:
+                file_suffixes[field] = None
+                continue
+            if not fn.startswith(base_name):
+                log.warning(f'Not caching the results of request #{req.request_id}: unexpected file name {fn}')
+                return
+            suffix = fn[len(base_name):]
+            file_suffixes[field] = suffix
+            if fn == req.original_document:
+                # each request has its own copy of the original document
+                continue
+            try:
+                self.storage.get_size(f'{req.request_id}/{fn}')
+            except RemoteResourceNotFound:
+                # the temp files removed on the request finish
+                continue
+            files[_cached_fn_prefix + suffix] = f'{req.request_id}/{fn}'
+        self.put(level, build_cache_key(level, req), files,
+                 {'file_suffixes': file_suffixes,
+                  'values': {field: getattr(req, field) for field in level.value_fields}})
+
+    def acquire_flight(self, level: CacheLevel, req: RequestMetadata) -> Optional[str]:
+        """
+        Makes the request the one computing the entry of the level.
+        Returns None if the request is the one or the id of the other request computing the same entry.
+        The lock expires after flight_ttl_sec in case the owner is lost.
+        """
+        name = redis_result_cache_flight_prefix + f'{level.name}/{build_cache_key(level, req)}'
+        try:
+            r = get_redis()
+            if r.set(name, req.request_id, nx=True, ex=self.flight_ttl_sec):
+                return None
+            owner = r.get(name)
+        except Exception as e:
+            log.warning(f'Unable to acquire result cache flight lock: {e}')
+            return None
+        owner = owner.decode('utf-8') if owner else None
+        return owner if owner != req.request_id else None
+
+    def release_flight(self, level: CacheLevel, req: RequestMetadata):
+        name = redis_result_cache_flight_prefix + f'{level.name}/{build_cache_key(level, req)}'
+        try:
+            get_redis().eval(_release_flight_script, 1, name, req.request_id)
+        except Exception as e:
+            log.warning(f'Unable to release result cache flight lock: {e}')
+
+
+_result_cache: Optional[ResultCache] = None
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """
+    Returns the result cache or None if it is disabled in the settings.
+    """
+    global _result_cache
+    settings = get_settings()
+    if not settings.result_cache_enabled:
+        return None
+    if not _result_cache:
+        _result_cache = ResultCache(get_file_storage(),
+                                    root=settings.result_cache_root,
+                                    max_size_mb=settings.result_cache_size_mb,
+                                    flight_ttl_sec=settings.result_cache_flight_ttl_sec)
+    return _result_cache
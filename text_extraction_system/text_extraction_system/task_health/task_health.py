@@ -1,55 +1,130 @@
 import json
+import os
+import pickle
+import threading
+import time
 from datetime import datetime
 from logging import Logger, getLogger
 from typing import List, Dict, Any, Set, Optional, Tuple
 
 from kombu import Connection
-from redis import Redis
-from webdav3.exceptions import RemoteResourceNotFound
 from celery.app.control import Inspect
 from text_extraction_system.config import get_settings
 from text_extraction_system.constants import tasks_pending, queue_celery_beat
-from text_extraction_system.file_storage import get_webdav_client
+from text_extraction_system.redis_client import get_redis
 
+log = getLogger(__name__)
 
-def init_task_tracking(*args, **kwargs):
-    get_webdav_client().mkdir(tasks_pending)
+# Pending task registry in the Redis used as the Celery broker:
+# hash: task id -> pickled task message with its queue position (see below),
+# sorted set: task id -> lease deadline (unix time),
+# set: ids of the tasks started by a worker,
+# hash: queue -> number of the tasks started from the queue.
+# A queued task holds a short lease: the checker finds it lost soon if it disappears from the queue
+# and otherwise just renews the lease. A started task holds a lease extended by the heartbeats
+# of the worker process executing it. The health checker examines only the tasks with the expired leases.
+#
+# The queues are never listed: the position of a task is the number of the tasks started from its queue
+# at which the task itself is expected to start (the started counter + the queue length at the publish time).
+# A queued task not known to any worker is lost only when the counter has reached its position
+# or the queue is empty. The lost messages are not counted: they can delay the detection but never
+# make a task still waiting in the queue look lost.
+redis_tasks_pending = f'text_extraction_system:{tasks_pending}'
+redis_task_leases = f'text_extraction_system:{tasks_pending}:leases'
+redis_tasks_started = f'text_extraction_system:{tasks_pending}:started'
+redis_queue_started_counts = f'text_extraction_system:{tasks_pending}:queue_started_counts'
 
 
-def get_known_task_ids_from_celery_api(app) -> Set[str]:
-    task_ids = set()
-    i = Inspect(app=app)
+class TaskLeaseHeartbeat:
+    """
+    Extends the leases of the tasks executed by the current worker process
+    from a background thread while the tasks are running.
+    """
 
-    def collect_task_ids(worker_tasks: Dict[str, List[Dict[str, Any]]]):
-        if worker_tasks:
-            for worker_name, worker_tasks in worker_tasks.items():
-                if not worker_tasks:
-                    continue
-                for t in worker_tasks:
-                    if not t:
-                        continue
-                    task_ids.add(t.get('id'))
+    def __init__(self, lease_sec: float, heartbeat_sec: float):
+        self.lease_sec = lease_sec
+        self.heartbeat_sec = heartbeat_sec
+        self._task_ids: Set[str] = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._owner_pid = os.getpid()
 
-    collect_task_ids(i.active())
-    collect_task_ids(i.scheduled())
-    collect_task_ids(i.reserved())
-    return task_ids
+    def _ensure_started(self):
+        # the thread started in the parent process before fork() does not exist in the children
+        if self._owner_pid != os.getpid():
+            self._task_ids = set()
+            self._lock = threading.Lock()
+            self._thread = None
+            self._owner_pid = os.getpid()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='task-lease-heartbeat', daemon=True)
+            self._thread.start()
 
+    def add(self, task_id: str):
+        with self._lock:
+            self._ensure_started()
+            self._task_ids.add(task_id)
 
-def store_pending_task_info_in_webdav(body,
-                                      exchange,
-                                      routing_key,
-                                      headers,
-                                      properties,
-                                      declare,
-                                      retry_policy):
+    def discard(self, task_id: str):
+        with self._lock:
+            self._task_ids.discard(task_id)
+
+    def beat(self):
+        with self._lock:
+            task_ids = list(self._task_ids)
+        if not task_ids:
+            return
+        deadline = time.time() + self.lease_sec
+        try:
+            # xx: don't resurrect the leases of the tasks removed from the registry in between
+            get_redis().zadd(redis_task_leases, {task_id: deadline for task_id in task_ids}, xx=True)
+        except Exception as e:
+            log.warning(f'Unable to extend the leases of the running tasks: {e}')
+
+    def _run(self):
+        while True:
+            time.sleep(self.heartbeat_sec)
+            self.beat()
+
+
+_heartbeat: Optional[TaskLeaseHeartbeat] = None
+
+
+def get_task_lease_heartbeat() -> TaskLeaseHeartbeat:
+    global _heartbeat
+    if not _heartbeat:
+        conf = get_settings()
+        _heartbeat = TaskLeaseHeartbeat(lease_sec=conf.task_health_lease_sec,
+                                        heartbeat_sec=conf.task_health_heartbeat_sec)
+    return _heartbeat
+
+
+def get_alive_task_ids_from_celery_api(app, task_ids: List[str]) -> Set[str]:
+    """
+    Returns the ids of the specified tasks which are active, reserved or scheduled at any worker.
+    """
+    alive = set()
+    replies: Optional[Dict[str, Dict[str, Any]]] = Inspect(app=app).query_task(*task_ids)
+    if replies:
+        for worker_name, worker_tasks in replies.items():
+            if worker_tasks:
+                alive.update(worker_tasks.keys())
+    return alive
+
+
+def store_pending_task_info(body,
+                            exchange,
+                            routing_key,
+                            headers,
+                            properties,
+                            declare,
+                            retry_policy):
     if routing_key == queue_celery_beat:
         # don't track Celery Beat tasks as they are not going through the default queue in Redis
         return
 
     # structures are described here:
     # https://docs.celeryproject.org/en/stable/internals/protocol.html#message-protocol-task-v2
-    webdav_client = get_webdav_client()
     task_info = dict(exchange=exchange,
                      routing_key=routing_key,
                      headers=headers,
@@ -57,51 +132,155 @@ def store_pending_task_info_in_webdav(body,
                      retry_policy=retry_policy,
                      properties=properties)
     task_id = headers['id']
-    webdav_client.pickle(obj=task_info, remote_path=f'{tasks_pending}/{task_id}')
+    r = get_redis()
+    # the message is not in the queue yet
+    task_info['queue_position'] = get_queue_end_position(r, routing_key) + 1
+    # the structures are updated in a single round trip
+    pipe = r.pipeline(transaction=False)
+    pipe.hset(redis_tasks_pending, task_id, pickle.dumps(task_info))
+    pipe.zadd(redis_task_leases, {task_id: time.time() + get_settings().task_health_queued_lease_sec})
+    pipe.srem(redis_tasks_started, task_id)
+    pipe.execute()
 
 
-def remove_pending_task_info_from_webdav(task_id: str, task_name: str = ''):
-    try:
-        get_webdav_client().clean(f'{tasks_pending}/{task_id}')
-    except RemoteResourceNotFound:
-        pass
+def get_queue_end_position(r, queue: str) -> int:
+    """
+    Returns the position of the last task in the queue: the number of the tasks started from the queue
+    by the time the last one starts.
+    """
+    pipe = r.pipeline(transaction=False)
+    # the length is read first: the tasks started in between can make the position larger only
+    pipe.llen(queue)
+    pipe.hget(redis_queue_started_counts, queue)
+    queue_len, started_count = pipe.execute()
+    return int(started_count or 0) + queue_len
 
 
-def get_scheduled_tasks_from_redis() -> Set[str]:
-    conf = get_settings()
-    broker_url = conf.celery_broker
-    r = Redis.from_url(broker_url)
-    return {json.loads(item)['headers']['id'] for item in r.lrange('celery', 0, -1)}
+def start_task_lease(task_id: str, queue: Optional[str]):
+    """
+    Should be called when a worker starts executing the task taken from the queue.
+    Switches the task to the short lease kept alive by the heartbeats of the current process.
+    """
+    heartbeat = get_task_lease_heartbeat()
+    pipe = get_redis().pipeline(transaction=False)
+    pipe.zadd(redis_task_leases, {task_id: time.time() + heartbeat.lease_sec}, xx=True)
+    pipe.sadd(redis_tasks_started, task_id)
+    if queue:
+        pipe.hincrby(redis_queue_started_counts, queue, 1)
+    pipe.execute()
+    heartbeat.add(task_id)
 
 
-def get_pending_tasks_from_webdav() -> Set[str]:
-    webdav = get_webdav_client()
-    return set(webdav.list(remote_path=tasks_pending, get_info=False))
+def stop_task_lease(task_id: str):
+    """
+    Should be called when the worker stops executing the task in any way - also on Task.retry()
+    which publishes the task again without the success / failure signals (see store_pending_task_info()).
+    Stops the heartbeats of the task in the current process.
+    """
+    get_task_lease_heartbeat().discard(task_id)
 
 
-def get_unknown_pending_tasks(app) -> Set[str]:
-    pending_from_webdav = get_pending_tasks_from_webdav()
-    scheduled_from_redis = get_scheduled_tasks_from_redis()
-    known_from_celery_api = get_known_task_ids_from_celery_api(app)
-    pending_from_webdav.difference_update(scheduled_from_redis)
-    pending_from_webdav.difference_update(known_from_celery_api)
-    return pending_from_webdav
+def remove_pending_task_info(task_id: str, task_name: str = ''):
+    get_task_lease_heartbeat().discard(task_id)
+    pipe = get_redis().pipeline(transaction=False)
+    pipe.hdel(redis_tasks_pending, task_id)
+    pipe.zrem(redis_task_leases, task_id)
+    pipe.srem(redis_tasks_started, task_id)
+    pipe.execute()
+
+
+def load_pending_task_infos(task_ids: List[str]) -> Dict[str, Optional[Dict]]:
+    """
+    Returns the registered task messages by their ids in a single request.
+    None is returned for the tasks completed in between.
+    """
+    if not task_ids:
+        return dict()
+    return {task_id: pickle.loads(data) if data is not None else None
+            for task_id, data in zip(task_ids, get_redis().hmget(redis_tasks_pending, task_ids))}
+
+
+def get_queued_task_ids(task_infos: Dict[str, Dict]) -> Set[str]:
+    """
+    Returns the ids of the specified not started tasks which are still waiting in their queues:
+    fewer tasks than the task position have been started from the queue and the queue is not empty.
+    The queues are not listed - the cost is proportional to the amount of the tasks.
+    """
+    r = get_redis()
+    queues = sorted({task_info['routing_key'] for task_info in task_infos.values()})
+    pipe = r.pipeline(transaction=False)
+    for queue in queues:
+        pipe.llen(queue)
+        pipe.hget(redis_queue_started_counts, queue)
+    res = pipe.execute()
+    queue_states = {queue: (res[2 * i], int(res[2 * i + 1] or 0)) for i, queue in enumerate(queues)}
+    queued = set()
+    for task_id, task_info in task_infos.items():
+        queue_len, started_count = queue_states[task_info['routing_key']]
+        # the tasks registered before the positions were introduced are considered queued until the queue drains
+        if queue_len and started_count < task_info.get('queue_position', started_count + 1):
+            queued.add(task_id)
+    return queued
+
+
+def get_expired_task_leases(limit: int) -> List[str]:
+    return [task_id.decode('utf-8')
+            for task_id in get_redis().zrangebyscore(redis_task_leases, '-inf', time.time(), start=0, num=limit)]
+
+
+def extend_task_leases(task_ids: List[str], lease_sec: float):
+    if task_ids:
+        get_redis().zadd(redis_task_leases, {task_id: time.time() + lease_sec for task_id in task_ids}, xx=True)
 
 
 def re_schedule_unknown_pending_tasks(log: Logger, app) -> List[Tuple[str, str]]:
+    """
+    Re-publishes the tasks with the expired leases which are not known to any worker:
+    the started tasks which stopped sending heartbeats (worker lost) and the queued tasks missing in the queue.
+    The cost of a check is proportional to the amount of the expired leases - the queues are never listed
+    (see get_queued_task_ids()).
+    """
     conf = get_settings()
-    webdav_client = get_webdav_client()
     broker_url = conf.celery_broker
     if not broker_url.startswith('redis:'):
         raise Exception('Only Redis broker supported for the task health tracking.')
     restarted_tasks: List[Tuple[str, str]] = list()
     failed_to_restart_tasks: List[Tuple[str, str]] = list()
     start_time = datetime.now()
-    unknown_pending_tasks = get_unknown_pending_tasks(app)
-    for task_id in unknown_pending_tasks:
+    expired_task_ids = get_expired_task_leases(conf.task_health_check_batch_size)
+    if not expired_task_ids:
+        return restarted_tasks
+
+    r = get_redis()
+    pipe = r.pipeline(transaction=False)
+    for task_id in expired_task_ids:
+        pipe.sismember(redis_tasks_started, task_id)
+    started = {task_id for task_id, is_started in zip(expired_task_ids, pipe.execute()) if is_started}
+    task_infos = load_pending_task_infos(expired_task_ids)
+
+    completed = [task_id for task_id, task_info in task_infos.items() if task_info is None]
+    if completed:
+        r.zrem(redis_task_leases, *completed)
+
+    candidates = [task_id for task_id, task_info in task_infos.items() if task_info is not None]
+    alive = get_alive_task_ids_from_celery_api(app, candidates) if candidates else set()
+    # the running task has missed its heartbeats but the worker still reports it
+    extend_task_leases([task_id for task_id in candidates if task_id in alive and task_id in started],
+                       conf.task_health_lease_sec)
+    lost = [task_id for task_id in candidates if task_id not in alive]
+
+    # The queued and reserved tasks get the short lease again - only the running ones have the long lease.
+    never_started = [task_id for task_id in lost if task_id not in started]
+    still_queued = get_queued_task_ids({task_id: task_infos[task_id] for task_id in never_started}) \
+        if never_started else set()
+    extend_task_leases([task_id for task_id in candidates if task_id in alive and task_id not in started]
+                       + list(still_queued), conf.task_health_queued_lease_sec)
+    lost = [task_id for task_id in lost if task_id not in still_queued]
+
+    for task_id in lost:
+        task_info = task_infos[task_id]
         task_name: Optional[str] = 'unknown'
         try:
-            task_info: Dict = webdav_client.unpickle(remote_path=f'{tasks_pending}/{task_id}')
             task_name = task_info['headers']['task'] or 'unknown'
 
             with Connection(broker_url) as conn:
@@ -115,16 +294,20 @@ def re_schedule_unknown_pending_tasks(log: Logger, app) -> List[Tuple[str, str]]
                                  retry=task_info['retry_policy'] is not None,
                                  retry_policy=task_info['retry_policy'])
                 restarted_tasks.append((task_id, task_name))
-        except RemoteResourceNotFound:
-            log.warning(f'Unable to restart lost pending task '
-                        f'because it has been completed already: #{task_id} - {task_name}')
+            # the task is queued again - publishing by the producer does not go through before_task_publish
+            task_info['queue_position'] = get_queue_end_position(r, task_info['routing_key'])
+            pipe = r.pipeline(transaction=False)
+            pipe.hset(redis_tasks_pending, task_id, pickle.dumps(task_info))
+            pipe.zadd(redis_task_leases, {task_id: time.time() + conf.task_health_queued_lease_sec}, xx=True)
+            pipe.srem(redis_tasks_started, task_id)
+            pipe.execute()
         except Exception as ex:
             failed_to_restart_tasks.append((task_id, task_name))
             log.error(f'Unable to restart lost pending task: #{task_id} - {task_name}', exc_info=ex)
-    if unknown_pending_tasks:
+    if lost:
         time_spent = datetime.now() - start_time
-        msg = f'Found {len(unknown_pending_tasks)} and restarted {len(restarted_tasks)} unknown/lost tasks ' \
-              f'registered at Webdav but not found in Redis queue.\n' \
+        msg = f'Found {len(lost)} and restarted {len(restarted_tasks)} unknown/lost tasks ' \
+              f'with expired leases among {len(expired_task_ids)} checked.\n' \
               f'Time spent: {time_spent}\n'
         if restarted_tasks:
             msg += f'Restarted tasks:\n' + '\n'.join([' - '.join(item) for item in restarted_tasks])
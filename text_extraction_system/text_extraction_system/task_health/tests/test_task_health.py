@@ -0,0 +1,186 @@
+import pickle
+import time
+from logging import getLogger
+from unittest.mock import patch, MagicMock
+
+from text_extraction_system import config
+from text_extraction_system.commons.tests.commons import with_default_settings
+from text_extraction_system.task_health import task_health
+from text_extraction_system.task_health.task_health import TaskLeaseHeartbeat, store_pending_task_info, \
+    start_task_lease, stop_task_lease, remove_pending_task_info, load_pending_task_infos, redis_tasks_pending, \
+    redis_task_leases, redis_tasks_started, redis_queue_started_counts, re_schedule_unknown_pending_tasks
+from text_extraction_system.tests.fake_redis import FakeRedis
+
+
+def publish(task_id: str, task_name: str = 'text_extraction_system.tasks.process_document'):
+    # arguments of the before_task_publish signal
+    store_pending_task_info(body=[['req1'], {}, {}],
+                            exchange='',
+                            routing_key='celery',
+                            headers={'id': task_id, 'task': task_name},
+                            properties={},
+                            declare=[],
+                            retry_policy=None)
+
+
+@with_default_settings
+def test_task_lifecycle():
+    redis = FakeRedis()
+    heartbeat = TaskLeaseHeartbeat(lease_sec=300, heartbeat_sec=60)
+    with patch.object(task_health, 'get_redis', return_value=redis), \
+            patch.object(task_health, '_heartbeat', heartbeat):
+        publish('task1')
+        assert load_pending_task_infos(['task1'])['task1']['headers']['task'].endswith('process_document')
+        assert time.time() < redis.zscore(redis_task_leases, 'task1') <= time.time() + 120
+        assert not redis.sismember(redis_tasks_started, 'task1')
+
+        start_task_lease('task1', 'celery')
+        assert redis.sismember(redis_tasks_started, 'task1')
+        assert redis.zscore(redis_task_leases, 'task1') > time.time() + 120
+        assert 'task1' in heartbeat._task_ids
+
+        remove_pending_task_info('task1')
+        assert load_pending_task_infos(['task1']) == {'task1': None}
+        assert redis.zscore(redis_task_leases, 'task1') is None
+        assert not redis.sismember(redis_tasks_started, 'task1')
+        assert 'task1' not in heartbeat._task_ids
+
+
+@with_default_settings
+def test_retried_task_heartbeats_stopped():
+    redis = FakeRedis()
+    heartbeat = TaskLeaseHeartbeat(lease_sec=300, heartbeat_sec=60)
+    with patch.object(task_health, 'get_redis', return_value=redis), \
+            patch.object(task_health, '_heartbeat', heartbeat):
+        publish('task1')
+        start_task_lease('task1', 'celery')
+        # Task.retry() publishes the task again and the worker stops executing it (task_postrun)
+        publish('task1')
+        stop_task_lease('task1')
+        assert not redis.sismember(redis_tasks_started, 'task1')
+        queued_lease = redis.zscore(redis_task_leases, 'task1')
+        assert queued_lease <= time.time() + 120
+
+        heartbeat.beat()
+        assert redis.zscore(redis_task_leases, 'task1') == queued_lease
+        assert pickle.loads(redis.hget(redis_tasks_pending, 'task1'))['headers']['id'] == 'task1'
+
+
+def test_heartbeat_extends_running_leases():
+    redis = FakeRedis()
+    heartbeat = TaskLeaseHeartbeat(lease_sec=300, heartbeat_sec=60)
+    redis.zadd(redis_task_leases, {'task1': 0, 'task2': 0})
+    with patch.object(task_health, 'get_redis', return_value=redis):
+        heartbeat._task_ids.update({'task1', 'task3'})
+        heartbeat.beat()
+        assert redis.zscore(redis_task_leases, 'task1') > time.time() + 200
+        assert redis.zscore(redis_task_leases, 'task2') == 0
+        # removed from the registry meanwhile - the lease is not resurrected
+        assert redis.zscore(redis_task_leases, 'task3') is None
+
+
+def test_beat_tasks_not_tracked():
+    redis = FakeRedis()
+    with patch.object(task_health, 'get_redis', return_value=redis):
+        store_pending_task_info(body=None, exchange='', routing_key='beat', headers={'id': 'task1'},
+                                properties={}, declare=[], retry_policy=None)
+        assert redis.zcard(redis_task_leases) == 0
+
+
+def with_redis_broker_settings(func):
+    def wrapper(*args, **kwargs):
+        config._settings = config.Settings.construct(webdav_url='',
+                                                     webdav_username='',
+                                                     webdav_password='',
+                                                     celery_broker='redis://localhost:6379/0',
+                                                     celery_backend='')
+        func(*args, **kwargs)
+    return wrapper
+
+
+def expire_lease(redis: FakeRedis, task_id: str):
+    redis.zadd(redis_task_leases, {task_id: time.time() - 1}, xx=True)
+
+
+def re_schedule(redis: FakeRedis, alive=()) -> list:
+    with patch.object(task_health, 'get_alive_task_ids_from_celery_api', return_value=set(alive)), \
+            patch.object(task_health, 'Connection') as connection_mock:
+        publish_mock = connection_mock.return_value.__enter__.return_value.Producer.return_value.publish
+        publish_mock.side_effect = lambda body, routing_key, headers, **kwargs: \
+            redis.lpush(routing_key, f'message of {headers["id"]}')
+        restarted = re_schedule_unknown_pending_tasks(getLogger(__name__), MagicMock())
+    published = [call.kwargs['headers']['id'] for call in publish_mock.call_args_list]
+    assert sorted(published) == sorted(task_id for task_id, _task_name in restarted)
+    return published
+
+
+@with_redis_broker_settings
+def test_re_schedule_lost_started_task():
+    redis = FakeRedis()
+    heartbeat = TaskLeaseHeartbeat(lease_sec=300, heartbeat_sec=60)
+    with patch.object(task_health, 'get_redis', return_value=redis), \
+            patch.object(task_health, '_heartbeat', heartbeat):
+        publish('task1')
+        publish('task2')
+        start_task_lease('task1', 'celery')
+        start_task_lease('task2', 'celery')
+        expire_lease(redis, 'task1')
+        expire_lease(redis, 'task2')
+
+        # the worker of task1 is lost, task2 missed the heartbeats but is still running
+        assert re_schedule(redis, alive=['task2']) == ['task1']
+        assert not redis.sismember(redis_tasks_started, 'task1')
+        assert time.time() < redis.zscore(redis_task_leases, 'task1') <= time.time() + 120
+        assert redis.zscore(redis_task_leases, 'task2') > time.time() + 120
+        # not checked again until the leases expire
+        assert re_schedule(redis) == []
+
+
+@with_redis_broker_settings
+def test_re_schedule_queued_tasks():
+    redis = FakeRedis()
+    heartbeat = TaskLeaseHeartbeat(lease_sec=300, heartbeat_sec=60)
+    with patch.object(task_health, 'get_redis', return_value=redis), \
+            patch.object(task_health, '_heartbeat', heartbeat):
+        for task_id in ('task1', 'task2', 'task3'):
+            publish(task_id)
+            redis.lpush('celery', f'message of {task_id}')
+            expire_lease(redis, task_id)
+
+        # none of them is known to the workers but the queue is not drained up to any of them
+        assert re_schedule(redis) == []
+        assert redis.zscore(redis_task_leases, 'task1') > time.time()
+
+        # task1 is done, task2 is taken from the queue but lost before starting, task3 is running
+        redis.data[b'celery'] = list()
+        start_task_lease('task1', 'celery')
+        remove_pending_task_info('task1')
+        start_task_lease('task3', 'celery')
+        publish('task4')
+        redis.lpush('celery', 'message of task4')
+        for task_id in ('task2', 'task3', 'task4'):
+            expire_lease(redis, task_id)
+        assert re_schedule(redis, alive=['task3']) == ['task2']
+        # the restarted task is queued behind task4
+        assert pickle.loads(redis.hget(redis_tasks_pending, 'task4'))['queue_position'] == 3
+        assert pickle.loads(redis.hget(redis_tasks_pending, 'task2'))['queue_position'] == 4
+        assert redis.lrange('celery', 0, -1) == [b'message of task2', b'message of task4']
+        # the lost message is not counted as started
+        assert redis.hget(redis_queue_started_counts, 'celery') == b'2'
+
+        # the queue is drained - the remaining task is lost too
+        redis.data[b'celery'] = list()
+        expire_lease(redis, 'task4')
+        assert re_schedule(redis, alive=['task3']) == ['task4']
+
+
+@with_redis_broker_settings
+def test_re_schedule_completed_task():
+    redis = FakeRedis()
+    with patch.object(task_health, 'get_redis', return_value=redis):
+        publish('task1')
+        expire_lease(redis, 'task1')
+        # completed between reading the leases and the task messages
+        redis.hdel(redis_tasks_pending, 'task1')
+        assert re_schedule(redis) == []
+        assert redis.zscore(redis_task_leases, 'task1') is None
@@ -6,38 +6,49 @@ import shutil
 import tempfile
 import time
 from contextlib import contextmanager
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple, Generator, TYPE_CHECKING
 
 import msgpack
 import requests
 from camelot.core import Table as CamelotTable
 from celery import Celery, chord
+from celery.exceptions import Retry
 from celery.signals import after_setup_logger, worker_process_init, before_task_publish, task_success, task_failure, \
-    task_revoked
+    task_revoked, task_prerun, task_postrun
 from webdav3.exceptions import RemoteResourceNotFound
 
 from text_extraction_system.celery_log import JSONFormatter, set_log_extra
 from text_extraction_system.config import get_settings
 from text_extraction_system.constants import pages_ocred, task_ids, pages_for_processing, pages_tables, \
-    queue_celery_beat
+    queue_celery_beat, pages_images
 from text_extraction_system.data_extract.camelot.camelot import extract_tables_from_pdf_file
 from text_extraction_system.data_extract.data_extract import extract_text_and_structure, process_pdf_page, \
-    PDFPageProcessingResults
+    PDFPageProcessingResults, DPI
 from text_extraction_system.data_extract.tables import get_table_dtos_from_camelot_output
-from text_extraction_system.file_storage import get_webdav_client, WebDavClient
+from text_extraction_system.file_storage import get_file_storage, FileStorage
+from text_extraction_system.ocr.page_ocr_cache import PageOCRCache
+from text_extraction_system.page_artifacts import get_page_artifact_store, file_sha256
 from text_extraction_system.pdf.convert_to_pdf import convert_to_pdf
-from text_extraction_system.pdf.pdf import merge_pdf_pages, split_pdf_to_page_blocks, extract_page_ocr_images, \
-    get_page_images_amount
+from text_extraction_system.pdf.page_batching import estimate_page_costs, plan_page_batches
+from text_extraction_system.pdf.pdf import merge_pdf_pages, split_pdf_to_page_blocks, extract_page_ocr_image, \
+    get_page_nums_with_images
 from text_extraction_system.remove_ocr_layer import remove_ocr_layer
+from text_extraction_system.request_completion import notify_request_finished
 from text_extraction_system.request_metadata import RequestCallbackInfo, RequestMetadata, \
-    save_request_metadata, load_request_metadata
+    save_request_metadata, load_request_metadata, RequestMetadataVersionConflict
+from text_extraction_system.result_cache import get_result_cache, ResultCache, CacheLevel, CONVERTED, OCRED, \
+    RESULTS
 from text_extraction_system.result_delivery.celery_client import send_task
-from text_extraction_system.task_health.task_health import store_pending_task_info_in_webdav, \
-    remove_pending_task_info_from_webdav, re_schedule_unknown_pending_tasks, init_task_tracking
-from text_extraction_system.utils import LanguageConverter, page_num_to_fn
+from text_extraction_system.task_health.task_health import store_pending_task_info, remove_pending_task_info, \
+    re_schedule_unknown_pending_tasks, start_task_lease, stop_task_lease
+from text_extraction_system.utils import LanguageConverter, page_num_to_fn, page_ocred_fn
 from text_extraction_system_api.dto import OutputFormat, RequestEstimate, RequestProgress
 from text_extraction_system_api.dto import RequestStatus, STATUS_FAILURE, STATUS_PENDING, STATUS_DONE
 
+if TYPE_CHECKING:
+    # the asyncio storage client is used by the web api only - not loaded in the Celery workers
+    from text_extraction_system.async_file_storage import AsyncFileStorage
+
 log = logging.getLogger(__name__)
 settings = get_settings()
 
@@ -66,8 +77,6 @@ celery_app = Celery(
     config_source=CeleryConfig(),
 )
 
-init_task_tracking()
-
 
 @worker_process_init.connect
 def setup_recursion_limit(*args, **kwargs):
@@ -125,40 +134,72 @@ def on_before_task_publish(sender,
                            declare,
                            retry_policy, *args, **kwargs):
     # log.info(f'Registering task: #{headers["id"]} - {headers["task"]}')
-    store_pending_task_info_in_webdav(body=body,
-                                      exchange=exchange,
-                                      routing_key=routing_key,
-                                      headers=headers,
-                                      properties=properties,
-                                      declare=declare,
-                                      retry_policy=retry_policy)
+    store_pending_task_info(body=body,
+                            exchange=exchange,
+                            routing_key=routing_key,
+                            headers=headers,
+                            properties=properties,
+                            declare=declare,
+                            retry_policy=retry_policy)
+
+
+@task_prerun.connect
+def on_task_prerun(sender, task_id, task, *args, **kwargs):
+    if getattr(sender, 'queue', None) == queue_celery_beat:
+        return
+    start_task_lease(task_id, (task.request.delivery_info or dict()).get('routing_key'))
+
+
+@task_postrun.connect
+def on_task_postrun(sender, task_id, *args, **kwargs):
+    # the retried tasks are neither succeeded nor failed - they wait in the queue again
+    stop_task_lease(task_id)
 
 
 @task_success.connect
 def on_task_success(sender, *args, **kwargs):
     # log.info(f'Unregistering on task_success: #{sender.request.id} - {sender.request.task}')
-    remove_pending_task_info_from_webdav(sender.request.id, sender.request.task)
+    remove_pending_task_info(sender.request.id, sender.request.task)
 
 
 @task_failure.connect
 def on_task_failure(sender, *args, **kwargs):
     # log.info(f'Unregistering on task_failure: #{sender.request.id} - {sender.request.task}')
-    remove_pending_task_info_from_webdav(sender.request.id, sender.request.task)
+    remove_pending_task_info(sender.request.id, sender.request.task)
 
 
 @task_revoked.connect
 def on_task_revoked(sender, request, *args, **kwargs):
     # log.info(f'Unregistering on task_revoked: #{task_id} - {task}')
-    remove_pending_task_info_from_webdav(request.id, request.task)
+    remove_pending_task_info(request.id, request.task)
+
+
+def register_task_id(storage: FileStorage, request_id: str, task_id: str):
+    storage.mkdir(f'{request_id}/{task_ids}/{task_id}')
+
 
+def get_request_task_ids(storage: FileStorage, request_id: str) -> List[str]:
+    try:
+        return [s.strip('/') for s in storage.list(f'{request_id}/{task_ids}')]
+    except RemoteResourceNotFound:
+        return []
 
-def register_task_id(webdav_client: WebDavClient, request_id: str, task_id: str):
-    webdav_client.mkdir(f'{request_id}/{task_ids}/{task_id}')
 
+async def register_first_task_id_async(storage: 'AsyncFileStorage', request_id: str, task_id: str):
+    """
+    The same as register_task_id() but using the asyncio storage client - for the web api.
+    Creates the folder of the task ids as the web api registers the first task of the request.
+    """
+    await storage.mkdir(f'{request_id}/{task_ids}')
+    await storage.mkdir(f'{request_id}/{task_ids}/{task_id}')
 
-def get_request_task_ids(webdav_client: WebDavClient, request_id: str) -> List[str]:
+
+async def get_request_task_ids_async(storage: 'AsyncFileStorage', request_id: str) -> List[str]:
+    """
+    The same as get_request_task_ids() but using the asyncio storage client - for the web api.
+    """
     try:
-        return [s.strip('/') for s in webdav_client.list(f'{request_id}/{task_ids}')]
+        return [s.strip('/') for s in await storage.list(f'{request_id}/{task_ids}')]
     except RemoteResourceNotFound:
         return []
 
@@ -182,6 +223,7 @@ def deliver_error(request_id: str,
             req.append_error(problem, exc)
 
         save_request_metadata(req)
+        release_result_cache_flight(req)
     except Exception as req_upd_err:
         log.error(f'{request_callback_info.original_file_name} | Unable to store failed status into '
                   f'metadata of request #{request_id}', exc_info=req_upd_err)
@@ -198,6 +240,8 @@ def handle_errors(request_id: str, request_callback_info: RequestCallbackInfo):
     try:
         set_log_extra(request_callback_info.log_extra)
         yield
+    except Retry:
+        raise
     except Exception as e:
         log.error(f'{request_callback_info.original_file_name} | Exception caught while processing the document',
                   exc_info=e)
@@ -211,7 +255,7 @@ def process_document(task,
                      remove_ocr: bool) -> bool:
     request_callback_info = RequestCallbackInfo(**request_callback_info)
     with handle_errors(request_id, request_callback_info):
-        webdav_client: WebDavClient = get_webdav_client()
+        storage: FileStorage = get_file_storage()
         req: RequestMetadata = load_request_metadata(request_id)
         if not req:
             log.warning(f'{request_callback_info.original_file_name} | Canceling document processing (#{request_id}):\n'
@@ -219,28 +263,87 @@ def process_document(task,
             return False
         log.info(f'{request_callback_info.original_file_name} | Starting text/data extraction '
                  f'for request #{request_id}\n')
-        with webdav_client.get_as_local_fn(f'{request_id}/{req.original_document}') as (fn, _remote_path):
+        with storage.get_as_local_fn(f'{request_id}/{req.original_document}') as (fn, _remote_path):
+            result_cache = get_result_cache()
+            if result_cache:
+                req.original_document_sha256 = file_sha256(fn)
+                if result_cache.restore_request_files(RESULTS, req):
+                    log.info(f'{req.original_file_name} | Results are restored from the result cache (#{request_id})')
+                    req.status = STATUS_DONE
+                    save_results_and_deliver(req)
+                    return True
+                # the identical documents submitted concurrently are processed once
+                flight_owner = result_cache.acquire_flight(RESULTS, req)
+                if flight_owner and task.request.retries < settings.result_cache_flight_max_waits:
+                    log.info(f'{req.original_file_name} | The same document is being processed by request '
+                             f'#{flight_owner}. Waiting for its results (#{request_id})')
+                    raise task.retry(countdown=settings.result_cache_flight_wait_sec, max_retries=None)
+                save_request_metadata(req)
             ext = os.path.splitext(fn)[1]
             if ext and ext.lower() == '.pdf':
-                process_pdf(fn, req, webdav_client)
+                process_pdf(fn, req, storage)
                 # remove OCR-created text layers if any
                 if remove_ocr:
                     remove_ocr_layer(fn)
             else:
-                log.info(f'{req.original_file_name} | Converting to PDF...')
-                with convert_to_pdf(fn, timeout_sec=req.convert_to_pdf_timeout_sec) \
-                        as local_converted_pdf_fn:
-                    req.converted_to_pdf = os.path.splitext(req.original_document)[0] + '.converted.pdf'
-                    webdav_client.upload_file(remote_path=f'{request_id}/{req.converted_to_pdf}',
-                                              local_path=local_converted_pdf_fn)
+                with get_converted_pdf(fn, req, storage, result_cache) as local_converted_pdf_fn:
                     save_request_metadata(req)
-                    process_pdf(local_converted_pdf_fn, req, webdav_client)
+                    process_pdf(local_converted_pdf_fn, req, storage)
         return True
 
 
+@contextmanager
+def get_converted_pdf(fn: str,
+                      req: RequestMetadata,
+                      storage: FileStorage,
+                      result_cache: Optional[ResultCache]) -> Generator[str, None, None]:
+    """
+    Converts the non-PDF document to PDF and uploads it to the request folder
+    or takes the PDF converted from the same document earlier from the result cache.
+    """
+    req.converted_to_pdf = os.path.splitext(req.original_document)[0] + '.converted.pdf'
+    if result_cache and result_cache.restore_request_files(CONVERTED, req):
+        log.info(f'{req.original_file_name} | Converted PDF is restored from the result cache')
+        with storage.get_as_local_fn(f'{req.request_id}/{req.converted_to_pdf}') as (local_converted_pdf_fn, _):
+            yield local_converted_pdf_fn
+        return
+    log.info(f'{req.original_file_name} | Converting to PDF...')
+    with convert_to_pdf(fn, timeout_sec=req.convert_to_pdf_timeout_sec) as local_converted_pdf_fn:
+        storage.upload_file(remote_path=f'{req.request_id}/{req.converted_to_pdf}',
+                            local_path=local_converted_pdf_fn)
+        if result_cache:
+            result_cache.store_request_files(CONVERTED, req)
+        yield local_converted_pdf_fn
+
+
+def store_in_result_cache(level: CacheLevel, req: RequestMetadata):
+    result_cache = get_result_cache()
+    if result_cache and req.original_document_sha256:
+        result_cache.store_request_files(level, req)
+
+
+def release_result_cache_flight(req: RequestMetadata):
+    result_cache = get_result_cache()
+    if result_cache and req.original_document_sha256:
+        result_cache.release_flight(RESULTS, req)
+
+
 def process_pdf(pdf_fn: str,
                 req: RequestMetadata,
-                webdav_client: WebDavClient):
+                storage: FileStorage):
+    result_cache = get_result_cache()
+    # the page images needed for the table detection are rendered by the page processing tasks only
+    if result_cache and req.original_document_sha256 and not req.table_extraction_enable \
+            and result_cache.restore_request_files(OCRED, req):
+        log.info(f'{req.original_file_name} | OCR results are restored from the result cache, '
+                 f'skipping the page processing')
+        if req.ocred_pdf:
+            with storage.get_as_local_fn(f'{req.request_id}/{req.ocred_pdf}') as (local_ocred_pdf_fn, _):
+                extract_data_and_finish(req, storage, local_ocred_pdf_fn, dict())
+        else:
+            extract_data_and_finish(req, storage, pdf_fn, dict())
+        return
+
     log.info(f'{req.original_file_name} | Pre-processing PDF document')
     log.info(f'{req.original_file_name} | Splitting to pages to parallelize processing...')
 
@@ -248,111 +351,220 @@ def process_pdf(pdf_fn: str,
     language, locale_code = lang_converter.get_language_and_locale_code(req.doc_language)
     ocr_language = lang_converter.convert_language_to_tesseract_view(language)
 
-    images_amount = get_page_images_amount(pdf_fn)
-    deliver_progress(req.request_callback_info, RequestProgress(pages=images_amount,
-                                                                current_page=0,
-                                                                progress=25))
-    image_fns, temp_images_dir = extract_page_ocr_images(pdf_fn)
+    # the pages are rasterized for OCR in process_pdf_page_task(..) - in parallel on the workers processing them
+    if settings.page_batching_adaptive:
+        # small pages are grouped to amortize the per-task overhead while large scans are spread across the cluster
+        page_costs = estimate_page_costs(pdf_fn)
+        page_nums_with_images = [pc.page_num for pc in page_costs]
+        page_batches = plan_page_batches(page_costs,
+                                         workers=settings.page_batch_workers or os.cpu_count() or 1,
+                                         min_batch_cost=settings.page_batch_min_cost,
+                                         max_batch_cost=settings.page_batch_max_cost,
+                                         max_pages_per_batch=settings.page_batch_max_pages)
+    else:
+        page_nums_with_images = get_page_nums_with_images(pdf_fn)
+        page_batches = [[page_num] for page_num in page_nums_with_images]
+    images_amount = len(page_nums_with_images)
     deliver_progress(req.request_callback_info, RequestProgress(pages=images_amount,
                                                                 current_page=0,
                                                                 progress=30))
+    page_artifact_store = get_page_artifact_store()
     with split_pdf_to_page_blocks(pdf_fn, pages_per_block=1) as pdf_page_fns:
-        webdav_client.mkdir(f'{req.request_id}/{pages_for_processing}')
-        webdav_client.mkdir(f'{req.request_id}/{pages_ocred}')
-        webdav_client.mkdir(f'{req.request_id}/{pages_tables}')
+        storage.mkdir(f'{req.request_id}/{pages_for_processing}')
+        storage.mkdir(f'{req.request_id}/{pages_ocred}')
+        storage.mkdir(f'{req.request_id}/{pages_tables}')
+        if req.table_extraction_enable:
+            storage.mkdir(f'{req.request_id}/{pages_images}')
+
+        # the page tasks can run on any host - they receive the path of the page in the shared storage
+        pdf_page_remote_paths: Dict[int, str] = dict()
+        for page_num in page_nums_with_images:
+            pdf_page_remote_paths[page_num] = page_artifact_store.put(f'{req.request_id}/{pages_for_processing}',
+                                                                      pdf_page_fns[page_num - 1])
+
         task_signatures = list()
-        i = 0
         ordered_page_number = 1
-        for pdf_page_fn in pdf_page_fns:
-            i += 1
-            if i not in image_fns:
-                continue
-            pdf_page_base_fn = os.path.basename(pdf_page_fn)
-            webdav_client.upload_file(f'{req.request_id}/{pages_for_processing}/{pdf_page_base_fn}',
-                                      pdf_page_fn)
-            task_signatures.append(process_pdf_page_task.s(req.request_id,
-                                                           req.original_file_name,
-                                                           image_fns[i],
-                                                           pdf_page_base_fn,
-                                                           i,
-                                                           ordered_page_number,
-                                                           ocr_language,
-                                                           req.request_callback_info.log_extra,
-                                                           req.detect_orientation_tesseract,
-                                                           images_amount))
-            ordered_page_number += 1
-
-        log.info(f'{req.original_file_name} | Scheduling {len(task_signatures)} sub-tasks...')
+        for page_batch in page_batches:
+            if len(page_batch) == 1:
+                page_num = page_batch[0]
+                task_signatures.append(process_pdf_page_task.s(req.request_id,
+                                                               req.original_file_name,
+                                                               pdf_page_remote_paths[page_num],
+                                                               page_num,
+                                                               ordered_page_number,
+                                                               ocr_language,
+                                                               req.request_callback_info.log_extra,
+                                                               req.detect_orientation_tesseract,
+                                                               images_amount))
+            else:
+                pages = [(pdf_page_remote_paths[page_num], page_num, ordered_page_number + k)
+                         for k, page_num in enumerate(page_batch)]
+                task_signatures.append(process_pdf_page_batch_task.s(req.request_id,
+                                                                     req.original_file_name,
+                                                                     pages,
+                                                                     ocr_language,
+                                                                     req.request_callback_info.log_extra,
+                                                                     req.detect_orientation_tesseract,
+                                                                     images_amount))
+            ordered_page_number += len(page_batch)
+
+        log.info(f'{req.original_file_name} | Scheduling {len(task_signatures)} sub-tasks '
+                 f'for {images_amount} pages...')
         request_callback_info_dict = req.request_callback_info.to_dict()
         c = chord(task_signatures)(
-            finish_pdf_processing.s(req.request_id, req.original_file_name, image_fns, temp_images_dir,
-                                    request_callback_info_dict)
+            finish_pdf_processing.s(req.request_id, req.original_file_name, request_callback_info_dict)
                                  .set(link_error=[ocr_error_callback.s(req.request_id, request_callback_info_dict)]))
-        register_task_id(webdav_client, req.request_id, c.id)
+        register_task_id(storage, req.request_id, c.id)
         for ar in c.parent.children:
-            register_task_id(webdav_client, req.request_id, ar.id)
+            register_task_id(storage, req.request_id, ar.id)
 
 
-@celery_app.task(acks_late=True, bind=True)
-def process_pdf_page_task(_task,
-                          request_id: str,
-                          original_file_name: str,
-                          image_file_name: str,
-                          pdf_page_base_fn: str,
-                          page_number: int,
-                          estimation_page_number: int,
-                          ocr_language: str,
-                          log_extra: Dict[str, str] = None,
-                          detect_orientation_tesseract=False,
-                          pages_amount: int = 0):
-    start_processing_time = time.time()
-    set_log_extra(log_extra)
-    webdav_client = get_webdav_client()
+def load_request_for_page_processing(request_id: str,
+                                     original_file_name: str,
+                                     pages_title: str) -> Optional[RequestMetadata]:
     req = load_request_metadata(request_id)
     if not req:
         log.warning(
-            f'{original_file_name} | Could not process pdf page {page_number}: {pdf_page_base_fn}.\n'
-            f'Request files do not exist at webdav storage.\n'
+            f'{original_file_name} | Could not process pdf {pages_title}.\n'
+            f'Request files do not exist at the file storage.\n'
             f'Probably the request was already canceled.\n'
             f'(#{request_id})')
         return None
     if req.status != STATUS_PENDING:
         log.info(
-            f'{original_file_name} | Canceling pdf page processing sub-task for page {page_number}:'
-            f' {pdf_page_base_fn} (request #{request_id})\n'
+            f'{original_file_name} | Canceling pdf page processing sub-task for {pages_title}'
+            f' (request #{request_id})\n'
             f'because the request is already in status {req.status}.')
         return None
+    return req
+
+
+def process_pdf_page_from_storage(req: RequestMetadata,
+                                  original_file_name: str,
+                                  pdf_page_remote_path: str,
+                                  page_number: int,
+                                  ocr_language: str,
+                                  detect_orientation_tesseract: bool) -> Optional[str]:
+    """
+    Processes the page PDF stored in the shared storage and uploads the OCR-ed text layer of the page.
+    The OCR results of the pages seen before (in any document) are taken from the result cache.
+    Returns the path of the page image in the shared storage (if the image is needed for the table detection).
+    """
     log.info(f'{original_file_name} | Processing PDF page {page_number}...')
+    storage = get_file_storage()
+    page_artifact_store = get_page_artifact_store()
+    result_cache = get_result_cache() if req.ocr_enable else None
+    page_image_remote_path: Optional[str] = None
     try:
-        with webdav_client.get_as_local_fn(f'{req.request_id}/{pages_for_processing}/{pdf_page_base_fn}') \
-                as (local_pdf_page_fn, _remote_path):
+        with page_artifact_store.get_as_local_fn(pdf_page_remote_path) as (local_pdf_page_fn, _remote_path), \
+                extract_page_ocr_image(local_pdf_page_fn, dpi=DPI) as page_image_fn:
+            page_ocr_cache = PageOCRCache(result_cache, req.request_id, page_number, page_image_fn, ocr_language,
+                                          DPI, detect_orientation_tesseract) if result_cache else None
             with process_pdf_page(local_pdf_page_fn,
-                                  page_image_without_text_fn=image_file_name,
+                                  page_image_without_text_fn=page_image_fn,
                                   ocr_enabled=req.ocr_enable,
                                   ocr_language=ocr_language,
                                   ocr_timeout_sec=req.page_ocr_timeout_sec,
-                                  detect_orientation_tesseract=detect_orientation_tesseract) as page_proc_res:
-                file_name = page_num_to_fn(page_number)
-                if page_proc_res.rotation_angle:
-                    file_name = f'{file_name}.{page_proc_res.rotation_angle}'
-                remote_path = f'{req.request_id}/{pages_ocred}/{file_name}.pdf'
-
-                if page_proc_res.page_requires_ocr:
-                    webdav_client.upload_file(remote_path=remote_path, local_path=page_proc_res.ocred_page_fn)
+                                  detect_orientation_tesseract=detect_orientation_tesseract,
+                                  restore_text_layer=page_ocr_cache.restore if page_ocr_cache else None) \
+                    as page_proc_res:
+                if page_proc_res.text_layer_restored:
+                    log.info(f'{original_file_name} | OCR results of PDF page {page_number} '
+                             f'are taken from the cache')
+                elif page_proc_res.page_requires_ocr:
+                    remote_path = f'{req.request_id}/{pages_ocred}/' \
+                                  f'{page_ocred_fn(page_number, page_proc_res.rotation_angle)}'
+                    storage.upload_file(remote_path=remote_path, local_path=page_proc_res.ocred_page_fn)
+                    if page_ocr_cache:
+                        page_ocr_cache.store(page_proc_res.orientation_angle, page_proc_res.rotation_angle)
+
+            if req.table_extraction_enable:
+                # the page image (de-rotated by process_pdf_page(..)) is needed for the table detection
+                # in finish_pdf_processing(..) which can run on another worker
+                page_image_remote_path = page_artifact_store.put(f'{req.request_id}/{pages_images}', page_image_fn)
+        # the page PDF is kept in the shared storage in case the task is restarted by the task health monitor
+        page_artifact_store.remove_from_cache(pdf_page_remote_path)
     except Exception as e:
         raise Exception(f'{original_file_name} |  Exception caught while processing '
-                        f'PDF page {page_number}: {pdf_page_base_fn}') from e
-    if estimation_page_number == 1:
+                        f'PDF page {page_number}: {pdf_page_remote_path}') from e
+    return page_image_remote_path
+
+
+def deliver_pages_processing_progress(req: RequestMetadata,
+                                      first_estimation_page_number: int,
+                                      last_estimation_page_number: int,
+                                      pages_amount: int,
+                                      start_processing_time: float):
+    if first_estimation_page_number == 1:
         # Time to process all pages + time to preprocess document + predicted time to postprocess document
-        estimate_time = int((time.time() - start_processing_time) * pages_amount
+        page_processing_time = (time.time() - start_processing_time) / last_estimation_page_number
+        estimate_time = int(page_processing_time * pages_amount
                             + (start_processing_time - req.request_date.timestamp()) * 2)
         deliver_estimate(req.request_callback_info, RequestEstimate(pages=pages_amount, estimate=estimate_time))
 
     deliver_progress(req.request_callback_info, RequestProgress(
-        pages=pages_amount, current_page=estimation_page_number,
-        progress=int((100 - 30 - 10) * estimation_page_number / pages_amount + 30)
+        pages=pages_amount, current_page=last_estimation_page_number,
+        progress=int((100 - 30 - 10) * last_estimation_page_number / pages_amount + 30)
     ))
-    return page_number
+
+
+@celery_app.task(acks_late=True, bind=True)
+def process_pdf_page_task(_task,
+                          request_id: str,
+                          original_file_name: str,
+                          pdf_page_remote_path: str,
+                          page_number: int,
+                          estimation_page_number: int,
+                          ocr_language: str,
+                          log_extra: Dict[str, str] = None,
+                          detect_orientation_tesseract=False,
+                          pages_amount: int = 0) -> Optional[Tuple[int, Optional[str]]]:
+    """
+    Returns the page number and the path of the page image in the shared storage
+    (if the image is needed for the table detection).
+    """
+    start_processing_time = time.time()
+    set_log_extra(log_extra)
+    req = load_request_for_page_processing(request_id, original_file_name,
+                                           f'page {page_number}: {pdf_page_remote_path}')
+    if not req:
+        return None
+    page_image_remote_path = process_pdf_page_from_storage(req, original_file_name, pdf_page_remote_path,
+                                                           page_number, ocr_language, detect_orientation_tesseract)
+    deliver_pages_processing_progress(req, estimation_page_number, estimation_page_number, pages_amount,
+                                      start_processing_time)
+    return page_number, page_image_remote_path
+
+
+@celery_app.task(acks_late=True, bind=True)
+def process_pdf_page_batch_task(_task,
+                                request_id: str,
+                                original_file_name: str,
+                                pages: List[Tuple[str, int, int]],
+                                ocr_language: str,
+                                log_extra: Dict[str, str] = None,
+                                detect_orientation_tesseract=False,
+                                pages_amount: int = 0) -> Optional[List[Tuple[int, Optional[str]]]]:
+    """
+    Processes a batch of pages planned by plan_page_batches(..) one by one.
+    The request metadata is loaded and the progress is delivered once per batch.
+    :param pages: list of (pdf_page_remote_path, page_number, estimation_page_number)
+    :return: list of (page_number, page_image_remote_path) - the same as returned by process_pdf_page_task(..)
+    """
+    start_processing_time = time.time()
+    set_log_extra(log_extra)
+    page_numbers = [page_number for _path, page_number, _estimation_page_number in pages]
+    req = load_request_for_page_processing(request_id, original_file_name, f'pages {page_numbers}')
+    if not req:
+        return None
+    res: List[Tuple[int, Optional[str]]] = list()
+    for pdf_page_remote_path, page_number, _estimation_page_number in pages:
+        page_image_remote_path = process_pdf_page_from_storage(req, original_file_name, pdf_page_remote_path,
+                                                               page_number, ocr_language,
+                                                               detect_orientation_tesseract)
+        res.append((page_number, page_image_remote_path))
+    deliver_pages_processing_progress(req, pages[0][2], pages[-1][2], pages_amount, start_processing_time)
+    return res
 
 
 @celery_app.task(bind=True)
@@ -364,24 +576,26 @@ def ocr_error_callback(task, some_id: str, request_id: str, req_callback_info: D
 
 @celery_app.task(acks_late=True, bind=True)
 def finish_pdf_processing(task,
-                          ocred_page_nums: List[int],
+                          page_results: List[Any],
                           request_id: str,
                           original_file_name: str,
-                          image_fns: Dict[int, str],
-                          temp_images_dir: str,
                           req_callback_info: Dict[str, Any]):
     req_callback_info = RequestCallbackInfo(**req_callback_info)
     with handle_errors(request_id, req_callback_info):
-        req: RequestMetadata = load_request_metadata(request_id)
+        req: RequestMetadata = load_request_metadata(request_id, max_age_sec=0)
         if not req:
             log.info(f'{original_file_name} | Not re-combining pdf blocks and not '
                      f'processing the data extraction for request {request_id}.\n'
                      f'Request files do not exist. Probably the request was already canceled.')
             return False
+        # process_pdf_page_batch_task(..) returns a list of the page results
+        page_results = [r for batch_res in page_results if batch_res
+                        for r in (batch_res if isinstance(batch_res, list) else [batch_res])]
+        ocred_page_nums = [page_num for page_num, _image_path in page_results]
         log.info(f'{req.original_file_name} | Re-combining pdf blocks ({ocred_page_nums}) and '
                  f'processing the data extraction for request #{request_id}')
-        webdav_client: WebDavClient = get_webdav_client()
-        if req.status != STATUS_PENDING or not webdav_client.is_dir(f'{req.request_id}/{pages_for_processing}'):
+        storage: FileStorage = get_file_storage()
+        if req.status != STATUS_PENDING or not storage.is_dir(f'{req.request_id}/{pages_for_processing}'):
             log.info(f'{req.original_file_name} | Request is already processed/failed/canceled (#{request_id})')
             return
         temp_dir = tempfile.mkdtemp()
@@ -391,16 +605,28 @@ def finish_pdf_processing(task,
 
             requires_page_merge: bool = False
 
+            # get the page images rendered in process_pdf_page_task(..) for the table detection
+            page_artifact_store = get_page_artifact_store()
+            image_fns: Dict[int, str] = dict()
+            images_dir = os.path.join(temp_dir, 'images')
+            os.mkdir(images_dir)
+            for page_num, image_remote_path in page_results:
+                if not image_remote_path:
+                    continue
+                local_image_fn = os.path.join(images_dir, f'{page_num_to_fn(page_num)}.png')
+                page_artifact_store.download_file(image_remote_path, local_image_fn)
+                image_fns[page_num] = local_image_fn
+
             # download PDFs of the OCRed pages
             # each page contains a transparent layer (glyphless font) with the recognized text
-            # file names of the pages at webdav are generated in process_pdf_page_task(..) as:
+            # file names of the pages in the storage are generated in process_pdf_page_task(..) as:
             # <page_num>.pdf
             pdf_pages_ocred: List[int] = list()
 
-            for remote_base_fn in webdav_client.list(f'{request_id}/{pages_ocred}'):
+            for remote_base_fn in storage.list(f'{request_id}/{pages_ocred}'):
                 remote_page_pdf_fn = f'{req.request_id}/{pages_ocred}/{remote_base_fn}'
                 local_page_pdf_fn = os.path.join(pages_dir, remote_base_fn)
-                webdav_client.download_file(remote_page_pdf_fn, local_page_pdf_fn)
+                storage.download_file(remote_page_pdf_fn, local_page_pdf_fn)
                 page_name = os.path.splitext(remote_base_fn)[0]
                 # page_name is either '00004' or '00004.-0.75' where the part after the first dot
                 # is the detected page rotation angle
@@ -417,7 +643,7 @@ def finish_pdf_processing(task,
                 original_pdf_in_storage = req.converted_to_pdf or req.original_document
                 local_orig_pdf_fn = os.path.join(temp_dir, original_pdf_in_storage)
 
-                webdav_client.download_file(f'{req.request_id}/{original_pdf_in_storage}', local_orig_pdf_fn)
+                storage.download_file(f'{req.request_id}/{original_pdf_in_storage}', local_orig_pdf_fn)
 
                 # merge-in the OCRed pages into the original PDF by adding them as layers on the original pages
                 # merge_pdf_pages() expects the page PDF in pages_dir to be named as
@@ -425,20 +651,24 @@ def finish_pdf_processing(task,
                 # or <page_num>.pdf
                 with merge_pdf_pages(local_orig_pdf_fn, pages_dir) as local_merged_pdf_fn:
                     req.ocred_pdf = os.path.splitext(original_pdf_in_storage)[0] + '.ocred.pdf'
-                    webdav_client.upload_file(f'{req.request_id}/{req.ocred_pdf}', local_merged_pdf_fn)
-                    extract_data_and_finish(req, webdav_client, local_merged_pdf_fn, image_fns)
+                    storage.upload_file(f'{req.request_id}/{req.ocred_pdf}', local_merged_pdf_fn)
+                    store_in_result_cache(OCRED, req)
+                    extract_data_and_finish(req, storage, local_merged_pdf_fn, image_fns)
             else:
+                store_in_result_cache(OCRED, req)
                 remote_fn = req.converted_to_pdf or req.original_document
-                with webdav_client.get_as_local_fn(f'{req.request_id}/{remote_fn}') as (local_pdf_fn, _remote_path):
-                    extract_data_and_finish(req, webdav_client, local_pdf_fn, image_fns)
+                with storage.get_as_local_fn(f'{req.request_id}/{remote_fn}') as (local_pdf_fn, _remote_path):
+                    extract_data_and_finish(req, storage, local_pdf_fn, image_fns)
 
+            for _page_num, image_remote_path in page_results:
+                if image_remote_path:
+                    page_artifact_store.delete(image_remote_path)
         finally:
             shutil.rmtree(temp_dir)
-            shutil.rmtree(temp_images_dir)
 
 
 def extract_data_and_finish(req: RequestMetadata,
-                            webdav_client: WebDavClient,
+                            storage: FileStorage,
                             local_pdf_fn: str,
                             image_fns: Dict[int, str]):
     req.pdf_file = req.ocred_pdf or req.converted_to_pdf or req.original_document
@@ -458,18 +688,18 @@ def extract_data_and_finish(req: RequestMetadata,
         req.plain_text_file = pdf_fn_in_storage_base + '.plain.txt'
         content = text.encode('utf-8')
         log.info(f'Start plain-text uploading to {req.request_id}/{req.plain_text_file}, size={len(content)}')
-        webdav_client.upload_to(content, f'{req.request_id}/{req.plain_text_file}')
+        storage.upload_to(content, f'{req.request_id}/{req.plain_text_file}')
         log.info(f'Plain text is uploaded to {req.request_id}/{req.plain_text_file}')
 
         if req.output_format == OutputFormat.json:
             req.pdf_coordinates_file = pdf_fn_in_storage_base + '.pdf_coordinates.json'
             req.text_structure_file = pdf_fn_in_storage_base + '.document_structure.json'
 
-            json_pdf_coords = json.dumps(text_structure.pdf_coordinates.to_dict(), indent=2)
+            json_pdf_coords = text_structure.pdf_coordinates.to_json()
             json_text_struct = json.dumps(text_structure.text_structure.to_dict(), indent=2)
 
-            webdav_client.upload_to(json_pdf_coords.encode('utf-8'), f'{req.request_id}/{req.pdf_coordinates_file}')
-            webdav_client.upload_to(json_text_struct.encode('utf-8'), f'{req.request_id}/{req.text_structure_file}')
+            storage.upload_to(json_pdf_coords.encode('utf-8'), f'{req.request_id}/{req.pdf_coordinates_file}')
+            storage.upload_to(json_text_struct.encode('utf-8'), f'{req.request_id}/{req.text_structure_file}')
 
         if req.output_format == OutputFormat.msgpack:
             req.pdf_coordinates_file = pdf_fn_in_storage_base + '.pdf_coordinates.msgpack'
@@ -477,41 +707,40 @@ def extract_data_and_finish(req: RequestMetadata,
 
             try:
                 gc.disable()
-                packed_pdf_coords = msgpack.packb(text_structure.pdf_coordinates.to_dict(),
-                                                  use_bin_type=True,
-                                                  use_single_float=True)
+                packed_pdf_coords = text_structure.pdf_coordinates.to_msgpack()
                 packed_text_struct = msgpack.packb(text_structure.text_structure.to_dict(),
                                                    use_bin_type=True,
                                                    use_single_float=True)
             finally:
-                webdav_client.upload_to(packed_pdf_coords, f'{req.request_id}/{req.pdf_coordinates_file}')
-                webdav_client.upload_to(packed_text_struct, f'{req.request_id}/{req.text_structure_file}')
+                storage.upload_to(packed_pdf_coords, f'{req.request_id}/{req.pdf_coordinates_file}')
+                storage.upload_to(packed_text_struct, f'{req.request_id}/{req.text_structure_file}')
                 gc.enable()
 
         if req.output_format == OutputFormat.protobuf:
             req.pdf_coordinates_file = pdf_fn_in_storage_base + '.pdf_coordinates.bin'
             req.text_structure_file = pdf_fn_in_storage_base + '.document_structure.bin'
 
-            from google.protobuf.json_format import Parse
-            import text_extraction_system_api.python_pb2_files.contract_char_bboxes_pb2 as char_bboxes_pb2
-            import text_extraction_system_api.python_pb2_files.contract_pages_pb2 as pages_pb2
+            from text_extraction_system.data_extract.protobuf_results import text_structure_to_protobuf
+
+            proto_pdf_coords = text_structure.pdf_coordinates.to_protobuf()
+            proto_text_struct = text_structure_to_protobuf(text_structure.text_structure)
 
-            pdf_coords = text_structure.pdf_coordinates.to_dict()
-            pdf_coords["char_bboxes"] = [{'coords': item} for item in pdf_coords["char_bboxes"]]
-            proto_pdf_coords = Parse(json.dumps(pdf_coords), char_bboxes_pb2.CharBboxes()).SerializeToString()
-            proto_text_struct = Parse(json.dumps(text_structure.text_structure.to_dict()),
-                                      pages_pb2.Pages()).SerializeToString()
+            storage.upload_to(proto_pdf_coords,
+                              f'{req.request_id}/{req.pdf_coordinates_file}')
+            storage.upload_to(proto_text_struct,
+                              f'{req.request_id}/{req.text_structure_file}')
 
-            webdav_client.upload_to(proto_pdf_coords,
-                                    f'{req.request_id}/{req.pdf_coordinates_file}')
-            webdav_client.upload_to(proto_text_struct,
-                                    f'{req.request_id}/{req.text_structure_file}')
+        # the boxes with the page offset table are stored for any output format
+        # to serve the coordinates of a single page without loading the whole file
+        req.pdf_coordinates_pages_file = pdf_fn_in_storage_base + '.pdf_coordinates.pages'
+        packed_pages = text_structure.pdf_coordinates.char_boxes.to_paged_binary(text_structure.text_structure.pages)
+        storage.upload_to(packed_pages, f'{req.request_id}/{req.pdf_coordinates_pages_file}')
 
         if req.char_coords_debug_enable or req.deskew_enable:
             req.page_rotate_angles = page_rotate_angles
             req.corrected_pdf = os.path.splitext(os.path.basename(req.pdf_file))[0] + '_corr.pdf'
             req.pdf_file = req.corrected_pdf
-            webdav_client.upload(f'{req.request_id}/{req.corrected_pdf}', orig_or_corrected_pdf_fn)
+            storage.upload_file(f'{req.request_id}/{req.corrected_pdf}', orig_or_corrected_pdf_fn)
 
         if req.table_extraction_enable:
             log.info(f'Extracting tables from {req.pdf_file}...')
@@ -525,35 +754,39 @@ def extract_data_and_finish(req: RequestMetadata,
         if tables and tables.tables:
             if req.output_format == OutputFormat.json:
                 req.tables_file = pdf_fn_in_storage_base + '.tables.json'
-                webdav_client.upload_to(json.dumps(tables.to_dict(), indent=2).encode('utf-8'),
-                                        f'{req.request_id}/{req.tables_file}')
+                storage.upload_to(json.dumps(tables.to_dict(), indent=2).encode('utf-8'),
+                                  f'{req.request_id}/{req.tables_file}')
 
             if req.output_format == OutputFormat.msgpack:
                 req.tables_file = pdf_fn_in_storage_base + '.tables.msgpack'
                 packed = msgpack.packb(tables.to_dict(), use_bin_type=True, use_single_float=True)
-                webdav_client.upload_to(packed, f'{req.request_id}/{req.tables_file}')
+                storage.upload_to(packed, f'{req.request_id}/{req.tables_file}')
 
             if req.output_format == OutputFormat.protobuf:
                 req.tables_file = pdf_fn_in_storage_base + '.tables.bin'
-                # ToDo: replace with protobuf pack
-                # packed = msgpack.packb(tables.to_dict(), use_bin_type=True, use_single_float=True)
-                packed = ""
-                webdav_client.upload_to(packed, f'{req.request_id}/{req.tables_file}')
+                from text_extraction_system.data_extract.protobuf_results import tables_to_protobuf
+                storage.upload_to(tables_to_protobuf(tables), f'{req.request_id}/{req.tables_file}')
 
     if settings.delete_temp_files_on_request_finish:
         if req.converted_to_pdf and req.converted_to_pdf != req.pdf_file:
-            webdav_client.clean(f'{req.request_id}/{req.converted_to_pdf}')
+            storage.clean(f'{req.request_id}/{req.converted_to_pdf}')
         if req.ocred_pdf and req.ocred_pdf != req.pdf_file:
-            webdav_client.clean(f'{req.request_id}/{req.ocred_pdf}')
+            storage.clean(f'{req.request_id}/{req.ocred_pdf}')
 
     req.status = STATUS_DONE
+    store_in_result_cache(RESULTS, req)
+    save_results_and_deliver(req)
+
+
+def save_results_and_deliver(req: RequestMetadata):
+    release_result_cache_flight(req)
 
     # This final check is a workaround when exactly this task was restarted by
     # the task health monitor. In case it delivers the results twice the process can crash.
-    # Actually it is not thread/process/parallel safe because another copy of the task
-    # can store DONE status after this check is done but the case is quite rare and
-    # we don't have a better way to check it.
-    final_check_req = load_request_metadata(req.request_id)
+    # The metadata is saved with compare-and-swap against the version checked here
+    # so another copy of the task storing its status after this check makes this save fail
+    # instead of silently overwriting it.
+    final_check_req = load_request_metadata(req.request_id, max_age_sec=0)
     if not final_check_req:
         log.info(f'{req.original_file_name} | Canceling results delivery '
                  f'because the request files are already removed (#{req.request_id})')
@@ -561,11 +794,19 @@ def extract_data_and_finish(req: RequestMetadata,
         log.info(f'{req.original_file_name} | Canceling results delivery '
                  f'because the request processing is already finished (#{req.request_id})')
     else:
-        save_request_metadata(req)
+        req.storage_etag = final_check_req.storage_etag
+        try:
+            save_request_metadata(req, check_version=True)
+        except RequestMetadataVersionConflict:
+            log.info(f'{req.original_file_name} | Canceling results delivery '
+                     f'because the request metadata was changed concurrently (#{req.request_id})')
+            return
         deliver_results(req.request_callback_info, req.to_request_status())
 
 
 def deliver_results(req: RequestCallbackInfo, req_status: RequestStatus):
+    notify_request_finished(req.request_id)
+
     if req.call_back_url:
         try:
             log.info(f'{req.original_file_name} | POSTing the extraction results to {req.call_back_url}...')
@@ -0,0 +1,245 @@
+import queue
+import time
+from typing import Dict, Any, Callable, Optional, List, Union
+
+
+def _b(value: Union[str, bytes, int, float]) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode('utf-8')
+
+
+class FakeRedis:
+    """
+    In-memory replacement of the redis.Redis client implementing the commands used by the system.
+    Lua scripts are not interpreted: the tests register Python equivalents of the scripts in lua_scripts
+    by their source text.
+    """
+
+    def __init__(self, lua_scripts: Dict[str, Callable[['FakeRedis', List[str], List[Any]], Any]] = None):
+        self.data: Dict[bytes, Any] = dict()
+        self.expires: Dict[bytes, float] = dict()
+        self.lua_scripts = lua_scripts or dict()
+        self.subscribers: Dict[bytes, List['FakePubSub']] = dict()
+
+    def _get(self, name, default=None):
+        name = _b(name)
+        if name in self.expires and self.expires[name] <= time.time():
+            del self.data[name]
+            del self.expires[name]
+        return self.data.get(name, default)
+
+    # strings
+
+    def set(self, name, value, ex: Optional[int] = None, nx: bool = False) -> Optional[bool]:
+        if nx and self._get(name) is not None:
+            return None
+        self.data[_b(name)] = _b(value)
+        if ex:
+            self.expires[_b(name)] = time.time() + ex
+        else:
+            self.expires.pop(_b(name), None)
+        return True
+
+    def get(self, name) -> Optional[bytes]:
+        return self._get(name)
+
+    def mget(self, names) -> List[Optional[bytes]]:
+        return [self._get(name) for name in names]
+
+    def delete(self, *names) -> int:
+        deleted = 0
+        for name in names:
+            if self._get(name) is not None:
+                del self.data[_b(name)]
+                self.expires.pop(_b(name), None)
+                deleted += 1
+        return deleted
+
+    def ttl(self, name) -> int:
+        expires = self.expires.get(_b(name))
+        return int(expires - time.time()) if expires else -1
+
+    def incrby(self, name, amount: int = 1) -> int:
+        value = int(self._get(name, b'0')) + amount
+        self.data[_b(name)] = _b(value)
+        return value
+
+    def decrby(self, name, amount: int = 1) -> int:
+        return self.incrby(name, -amount)
+
+    # hashes
+
+    def _hash(self, name) -> Dict[bytes, bytes]:
+        return self.data.setdefault(_b(name), dict())
+
+    def hset(self, name, key, value) -> int:
+        h = self._hash(name)
+        is_new = _b(key) not in h
+        h[_b(key)] = _b(value)
+        return int(is_new)
+
+    def hsetnx(self, name, key, value) -> bool:
+        h = self._hash(name)
+        if _b(key) in h:
+            return False
+        h[_b(key)] = _b(value)
+        return True
+
+    def hget(self, name, key) -> Optional[bytes]:
+        return self._get(name, dict()).get(_b(key))
+
+    def hdel(self, name, *keys) -> int:
+        h = self._get(name, dict())
+        return sum(1 for key in keys if h.pop(_b(key), None) is not None)
+
+    def hgetall(self, name) -> Dict[bytes, bytes]:
+        return dict(self._get(name, dict()))
+
+    def hmget(self, name, keys) -> List[Optional[bytes]]:
+        h = self._get(name, dict())
+        return [h.get(_b(key)) for key in keys]
+
+    def hincrby(self, name, key, amount: int = 1) -> int:
+        h = self._hash(name)
+        h[_b(key)] = _b(int(h.get(_b(key), b'0')) + amount)
+        return int(h[_b(key)])
+
+    # sets
+
+    def sadd(self, name, *values) -> int:
+        s = self.data.setdefault(_b(name), set())
+        added = sum(1 for value in values if _b(value) not in s)
+        s.update(_b(value) for value in values)
+        return added
+
+    def srem(self, name, *values) -> int:
+        s = self._get(name, set())
+        removed = sum(1 for value in values if _b(value) in s)
+        s.difference_update(_b(value) for value in values)
+        return removed
+
+    def sismember(self, name, value) -> bool:
+        return _b(value) in self._get(name, set())
+
+    # lists
+
+    def rpush(self, name, *values) -> int:
+        items = self.data.setdefault(_b(name), list())
+        items.extend(_b(value) for value in values)
+        return len(items)
+
+    def lpush(self, name, *values) -> int:
+        items = self.data.setdefault(_b(name), list())
+        for value in values:
+            items.insert(0, _b(value))
+        return len(items)
+
+    def lrange(self, name, start: int, end: int) -> List[bytes]:
+        return list(self._get(name, list())[start:end + 1 if end != -1 else None])
+
+    def llen(self, name) -> int:
+        return len(self._get(name, list()))
+
+    # sorted sets
+
+    def _zset(self, name) -> Dict[bytes, float]:
+        return self.data.setdefault(_b(name), dict())
+
+    def zadd(self, name, mapping: Dict[Any, float], nx: bool = False, xx: bool = False) -> int:
+        z = self._zset(name)
+        added = 0
+        for member, score in mapping.items():
+            exists = _b(member) in z
+            if (nx and exists) or (xx and not exists):
+                continue
+            added += int(not exists)
+            z[_b(member)] = float(score)
+        return added
+
+    def zrem(self, name, *members) -> int:
+        z = self._get(name, dict())
+        return sum(1 for member in members if z.pop(_b(member), None) is not None)
+
+    def zrange(self, name, start: int, end: int) -> List[bytes]:
+        members = [member for member, _score in sorted(self._get(name, dict()).items(), key=lambda kv: kv[1])]
+        return members[start:end + 1 if end != -1 else None]
+
+    def zrangebyscore(self, name, min_score, max_score,
+                      start: Optional[int] = None, num: Optional[int] = None) -> List[bytes]:
+        min_score, max_score = (float(score) for score in (min_score, max_score))
+        members = [member for member, score in sorted(self._get(name, dict()).items(), key=lambda kv: kv[1])
+                   if min_score <= score <= max_score]
+        if start is not None:
+            members = members[start:start + num if num is not None else None]
+        return members
+
+    def zcard(self, name) -> int:
+        return len(self._get(name, dict()))
+
+    def zscore(self, name, member) -> Optional[float]:
+        return self._get(name, dict()).get(_b(member))
+
+    # pub/sub
+
+    def publish(self, channel, message) -> int:
+        subscribers = list(self.subscribers.get(_b(channel), []))
+        for pubsub in subscribers:
+            pubsub.messages.put({'type': 'message', 'pattern': None, 'channel': _b(channel), 'data': _b(message)})
+        return len(subscribers)
+
+    def pubsub(self, ignore_subscribe_messages: bool = False) -> 'FakePubSub':
+        return FakePubSub(self, ignore_subscribe_messages)
+
+    # transactions and scripts
+
+    def pipeline(self, transaction: bool = True) -> 'FakePipeline':
+        return FakePipeline(self)
+
+    def eval(self, script: str, numkeys: int, *keys_and_args):
+        return self.lua_scripts[script](self, list(keys_and_args[:numkeys]), list(keys_and_args[numkeys:]))
+
+    def register_script(self, script: str) -> Callable:
+        def call(keys=None, args=None):
+            return self.lua_scripts[script](self, list(keys or []), list(args or []))
+        return call
+
+
+class FakePipeline:
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self.commands: List[Callable[[], Any]] = list()
+
+    def __getattr__(self, command: str):
+        method = getattr(self.redis, command)
+
+        def add(*args, **kwargs):
+            self.commands.append(lambda: method(*args, **kwargs))
+            return self
+        return add
+
+    def execute(self) -> List[Any]:
+        res = [command() for command in self.commands]
+        self.commands = list()
+        return res
+
+
+class FakePubSub:
+    """
+    Subscription receiving the messages published by FakeRedis.publish() from any thread.
+    """
+
+    def __init__(self, redis: FakeRedis, ignore_subscribe_messages: bool = False):
+        self.redis = redis
+        self.ignore_subscribe_messages = ignore_subscribe_messages
+        self.messages: queue.Queue = queue.Queue()
+
+    def subscribe(self, *channels):
+        for channel in channels:
+            self.redis.subscribers.setdefault(_b(channel), list()).append(self)
+            if not self.ignore_subscribe_messages:
+                self.messages.put({'type': 'subscribe', 'pattern': None, 'channel': _b(channel), 'data': 1})
+
+    def listen(self):
+        while True:
+            yield self.messages.get()
@@ -0,0 +1,130 @@
+import asyncio
+from typing import Callable, List
+from unittest.mock import patch
+
+import httpx
+import pytest
+from webdav3.exceptions import RemoteResourceNotFound, NoConnection
+
+from text_extraction_system import async_file_storage, config, request_metadata
+from text_extraction_system.async_file_storage import AsyncWebDavStorage
+from text_extraction_system.file_storage import StoragePreconditionFailed, WebDavClient
+from text_extraction_system.request_metadata import RequestMetadataCache, RequestMetadataVersionConflict, \
+    load_request_metadata_async, save_request_metadata_async
+from text_extraction_system.tests.test_request_metadata import build_request
+
+
+def with_webdav_settings(func):
+    def wrapper(*args, **kwargs):
+        config._settings = config.Settings.construct(webdav_url='http://webdav.local/',
+                                                     webdav_username='',
+                                                     webdav_password='',
+                                                     celery_broker='',
+                                                     celery_backend='')
+        func(*args, **kwargs)
+    return wrapper
+
+
+def build_storage(handler: Callable[[httpx.Request], httpx.Response],
+                  requests: List[httpx.Request]) -> AsyncWebDavStorage:
+    def handle(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return handler(request)
+    return AsyncWebDavStorage(WebDavClient(), transport=httpx.MockTransport(handle))
+
+
+@with_webdav_settings
+def test_download_if_modified():
+    requests = list()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.headers.get('If-None-Match') == '"v1"':
+            return httpx.Response(304, headers={'ETag': '"v1"'})
+        return httpx.Response(200, content=b'data', headers={'ETag': '"v1"'})
+
+    storage = build_storage(handler, requests)
+    assert asyncio.run(storage.download_if_modified('req1/metadata.json')) == (b'data', '"v1"')
+    assert asyncio.run(storage.download_if_modified('req1/metadata.json', '"v1"')) == (None, '"v1"')
+    # no double slash after the host name
+    assert str(requests[0].url) == 'http://webdav.local/req1/metadata.json'
+    assert 'If-None-Match' not in requests[0].headers
+
+
+@with_webdav_settings
+def test_upload_if_match():
+    requests = list()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.headers.get('If-Match', '"v2"') != '"v2"':
+            return httpx.Response(412)
+        return httpx.Response(201, headers={'ETag': '"v3"'})
+
+    storage = build_storage(handler, requests)
+    assert asyncio.run(storage.upload_if_match(b'data', 'req1/metadata.json', '"v2"')) == '"v3"'
+    assert requests[-1].headers['If-Match'] == '"v2"'
+    assert requests[-1].content == b'data'
+
+    with pytest.raises(StoragePreconditionFailed):
+        asyncio.run(storage.upload_if_match(b'data', 'req1/metadata.json', '"v1"'))
+
+    # the weak ETags never match - the file is replaced unconditionally
+    asyncio.run(storage.upload_if_match(b'data', 'req1/metadata.json', 'W/"v1"'))
+    assert 'If-Match' not in requests[-1].headers
+
+
+@with_webdav_settings
+def test_not_found():
+    storage = build_storage(lambda _request: httpx.Response(404), list())
+    with pytest.raises(RemoteResourceNotFound):
+        asyncio.run(storage.download_if_modified('req1/metadata.json'))
+    with pytest.raises(RemoteResourceNotFound):
+        asyncio.run(storage.get_size('req1/doc.pdf'))
+
+
+@with_webdav_settings
+def test_transport_error():
+    def handler(request: httpx.Request) -> httpx.Response:
+        raise httpx.ConnectError('Connection refused', request=request)
+
+    storage = build_storage(handler, list())
+    with pytest.raises(NoConnection):
+        asyncio.run(storage.download_if_modified('req1/metadata.json'))
+
+
+@with_webdav_settings
+def test_request_metadata_version_conflict():
+    files = dict()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if request.method == 'GET':
+            if path not in files:
+                return httpx.Response(404)
+            etag = f'"{files[path][0]}"'
+            if request.headers.get('If-None-Match') == etag:
+                return httpx.Response(304, headers={'ETag': etag})
+            return httpx.Response(200, content=files[path][1], headers={'ETag': etag})
+        if request.method == 'PUT':
+            version = files[path][0] if path in files else 0
+            if 'If-Match' in request.headers and request.headers['If-Match'] != f'"{version}"':
+                return httpx.Response(412)
+            files[path] = (version + 1, request.content)
+            return httpx.Response(201, headers={'ETag': f'"{version + 1}"'})
+        return httpx.Response(405)
+
+    storage = build_storage(handler, list())
+    with patch.object(async_file_storage, '_async_file_storage', storage), \
+            patch.object(request_metadata, 'index_request_statuses'), \
+            patch.object(request_metadata, '_metadata_cache', RequestMetadataCache(ttl_sec=0)):
+        assert asyncio.run(load_request_metadata_async('req1')) is None
+        asyncio.run(save_request_metadata_async(build_request()))
+        req1 = asyncio.run(load_request_metadata_async('req1'))
+        req2 = asyncio.run(load_request_metadata_async('req1'))
+        assert req1.storage_etag == req2.storage_etag == '"1"'
+
+        req1.status = 'DONE'
+        asyncio.run(save_request_metadata_async(req1, check_version=True))
+        assert req1.storage_etag == '"2"'
+        with pytest.raises(RequestMetadataVersionConflict):
+            asyncio.run(save_request_metadata_async(req2, check_version=True))
+        assert asyncio.run(load_request_metadata_async('req1')).status == 'DONE'
@@ -0,0 +1,204 @@
+import os
+import re
+import shutil
+import tempfile
+from io import BytesIO
+from typing import List, Optional
+
+import pytest
+from requests import PreparedRequest, Response
+from requests.adapters import BaseAdapter
+from urllib3 import HTTPResponse
+from webdav3.client import OptionNotValid
+from webdav3.exceptions import RemoteResourceNotFound
+
+from text_extraction_system.file_storage import WebDavClient, LocalFileStorage, StoragePreconditionFailed
+from text_extraction_system.tests.test_async_file_storage import with_webdav_settings
+
+
+class FakeWebDavAdapter(BaseAdapter):
+    """
+    Transport of the requests session serving a single file.
+    :param range_status: status of the responses to the ranged GET requests
+    (e.g. 200 for a proxy ignoring the Range header)
+    """
+
+    def __init__(self, content: bytes, range_status: int = 206, content_range: Optional[str] = None):
+        super().__init__()
+        self.content = content
+        self.range_status = range_status
+        self.content_range = content_range
+        self.requests: List[PreparedRequest] = list()
+
+    def send(self, request: PreparedRequest, **kwargs) -> Response:
+        self.requests.append(request)
+        headers = {'Accept-Ranges': 'bytes'}
+        status, body = 200, self.content
+        if request.method == 'HEAD':
+            headers['Content-Length'] = str(len(self.content))
+            body = b''
+        elif 'Range' in request.headers and self.range_status == 206:
+            start, end = (int(pos) for pos in re.match(r'bytes=(\d+)-(\d+)', request.headers['Range']).groups())
+            status, body = 206, self.content[start:end + 1]
+            headers['Content-Range'] = self.content_range or f'bytes {start}-{end}/{len(self.content)}'
+        elif 'Range' in request.headers:
+            status = self.range_status
+        response = Response()
+        response.status_code = status
+        response.headers.update(headers)
+        response.raw = HTTPResponse(body=BytesIO(body), headers=headers, status=status, preload_content=False)
+        response.request = request
+        response.url = request.url
+        return response
+
+    def close(self):
+        pass
+
+
+def build_client(adapter: FakeWebDavAdapter) -> WebDavClient:
+    client = WebDavClient()
+    client.session.mount('http://', adapter)
+    client.parallel_download_threads = 4
+    client.parallel_download_min_size = 0
+    return client
+
+
+def _download(client: WebDavClient, content: bytes) -> bytes:
+    temp_dir = tempfile.mkdtemp()
+    try:
+        fn = os.path.join(temp_dir, 'doc.pdf')
+        # the local file is longer than the downloaded one - it must be truncated
+        with open(fn, 'wb') as f:
+            f.write(b'x' * (len(content) + 10))
+        client.download_file('req1/doc.pdf', fn)
+        with open(fn, 'rb') as f:
+            return f.read()
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+content = bytes(range(256)) * 41
+
+
+@with_webdav_settings
+def test_parallel_download():
+    adapter = FakeWebDavAdapter(content)
+    assert _download(build_client(adapter), content) == content
+    ranges = sorted(r.headers['Range'] for r in adapter.requests if r.method == 'GET')
+    assert len(ranges) == 4
+    assert ranges[0] == 'bytes=0-2623'
+
+
+@with_webdav_settings
+def test_parallel_download_range_ignored():
+    adapter = FakeWebDavAdapter(content, range_status=200)
+    assert _download(build_client(adapter), content) == content
+    # the whole file is downloaded once more as a single stream
+    assert 'Range' not in adapter.requests[-1].headers
+
+
+@with_webdav_settings
+def test_parallel_download_unexpected_range():
+    adapter = FakeWebDavAdapter(content, content_range=f'bytes 0-{len(content) - 1}/{len(content)}')
+    assert _download(build_client(adapter), content) == content
+    assert 'Range' not in adapter.requests[-1].headers
+
+
+@with_webdav_settings
+def test_small_file_single_stream():
+    adapter = FakeWebDavAdapter(content)
+    client = build_client(adapter)
+    client.parallel_download_min_size = len(content) + 1
+    assert _download(client, content) == content
+    assert [r.method for r in adapter.requests] == ['HEAD', 'GET']
+    assert 'Range' not in adapter.requests[-1].headers
+
+
+def test_local_upload_if_match():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        storage = LocalFileStorage(temp_dir)
+        storage.mkdir('req1')
+        etag1 = storage.upload_if_match(b'v1', 'req1/metadata.json')
+        assert etag1
+
+        etag2 = storage.upload_if_match(b'v2', 'req1/metadata.json', etag1)
+        assert etag2 != etag1
+        # changed by someone else since etag1 was read
+        with pytest.raises(StoragePreconditionFailed):
+            storage.upload_if_match(b'v3', 'req1/metadata.json', etag1)
+        # the file is deleted meanwhile
+        with pytest.raises(StoragePreconditionFailed):
+            storage.upload_if_match(b'v3', 'req1/other.json', etag2)
+        assert storage.download_if_modified('req1/metadata.json') == (b'v2', etag2)
+        # the lock files are not listed
+        assert storage.list('req1') == ['metadata.json']
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_local_download_if_modified():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        storage = LocalFileStorage(temp_dir)
+        storage.mkdir('req1')
+        with pytest.raises(RemoteResourceNotFound):
+            storage.download_if_modified('req1/metadata.json')
+
+        storage.upload_to(b'v1', 'req1/metadata.json')
+        data, etag = storage.download_if_modified('req1/metadata.json')
+        assert data == b'v1'
+        # not modified
+        assert storage.download_if_modified('req1/metadata.json', etag) == (None, etag)
+
+        storage.upload_to(b'v2', 'req1/metadata.json')
+        data, new_etag = storage.download_if_modified('req1/metadata.json', etag)
+        assert data == b'v2' and new_etag != etag
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_local_stream():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        storage = LocalFileStorage(temp_dir)
+        storage.mkdir('req1')
+        storage.upload_to(content, 'req1/doc.pdf')
+        assert b''.join(storage.stream('req1/doc.pdf', chunk_size=1000)) == content
+        assert b''.join(storage.stream('req1/doc.pdf', chunk_size=1000, start=100, end=2599)) == content[100:2600]
+        assert b''.join(storage.stream('req1/doc.pdf', start=len(content) - 10)) == content[-10:]
+        chunks = list(storage.stream('req1/doc.pdf', chunk_size=1000, start=500, end=2999))
+        assert [len(chunk) for chunk in chunks] == [1000, 1000, 500]
+        with pytest.raises(RemoteResourceNotFound):
+            storage.stream('req1/missing.pdf')
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_local_copy_and_clean():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        storage = LocalFileStorage(temp_dir)
+        storage.mkdir('req1/pages')
+        storage.mkdir('req2')
+        storage.upload_to(b'page', 'req1/pages/00001.pdf')
+        storage.copy('req1/pages/00001.pdf', 'req2/00001.pdf')
+        # the files are replaced, never modified in place - the copy keeps the content
+        storage.upload_to(b'new page', 'req1/pages/00001.pdf')
+        assert storage.download_if_modified('req2/00001.pdf')[0] == b'page'
+        with pytest.raises(RemoteResourceNotFound):
+            storage.copy('req1/missing.pdf', 'req2/missing.pdf')
+
+        storage.clean('req2/00001.pdf')
+        assert storage.list('req2') == []
+        storage.clean('req1/')
+        with pytest.raises(RemoteResourceNotFound):
+            storage.list('req1')
+        with pytest.raises(RemoteResourceNotFound):
+            storage.clean('req1')
+        # the paths outside of the root are rejected
+        with pytest.raises(OptionNotValid):
+            storage.clean('../')
+        assert os.path.isdir(temp_dir)
+    finally:
+        shutil.rmtree(temp_dir)
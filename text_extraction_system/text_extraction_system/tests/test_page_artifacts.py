@@ -0,0 +1,96 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+from text_extraction_system.file_storage import LocalFileStorage
+from text_extraction_system.page_artifacts import PageArtifactStore
+
+
+def _write(dir_name: str, fn: str, content: bytes) -> str:
+    path = os.path.join(dir_name, fn)
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path
+
+
+def _read(fn: str) -> bytes:
+    with open(fn, 'rb') as f:
+        return f.read()
+
+
+def test_content_addressed_names():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        storage = LocalFileStorage(os.path.join(temp_dir, 'storage'))
+        storage.mkdir('req1/pages')
+        store = PageArtifactStore(storage, os.path.join(temp_dir, 'cache'))
+
+        remote_path = store.put('req1/pages', _write(temp_dir, 'page1.pdf', b'page'))
+        assert remote_path == f'req1/pages/{hashlib.sha256(b"page").hexdigest()}.pdf'
+        # the same content is stored once
+        assert store.put('req1/pages', _write(temp_dir, 'page2.pdf', b'page')) == remote_path
+        assert store.put('req1/pages', _write(temp_dir, 'page3.pdf', b'other')) != remote_path
+        assert len(storage.list('req1/pages')) == 2
+
+        with store.get_as_local_fn(remote_path) as (local_fn, path):
+            assert path == remote_path
+            assert local_fn.endswith('.pdf')
+            assert _read(local_fn) == b'page'
+        assert not os.path.exists(local_fn)
+
+        store.delete(remote_path)
+        assert len(storage.list('req1/pages')) == 1
+        assert not os.path.exists(os.path.join(temp_dir, 'cache', os.path.basename(remote_path)))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_local_cache_hit():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        storage = LocalFileStorage(os.path.join(temp_dir, 'storage'))
+        storage.mkdir('req1')
+        store = PageArtifactStore(storage, os.path.join(temp_dir, 'cache'))
+        remote_path = store.put('req1', _write(temp_dir, 'page.png', b'image'))
+
+        # served from the local cache without the shared storage
+        storage.clean(remote_path)
+        store.download_file(remote_path, os.path.join(temp_dir, 'downloaded.png'))
+        assert _read(os.path.join(temp_dir, 'downloaded.png')) == b'image'
+
+        # downloaded files are cached too
+        storage.upload_to(b'other image', 'req1/other.png')
+        store.download_file('req1/other.png', os.path.join(temp_dir, 'other.png'))
+        storage.clean('req1/other.png')
+        store.download_file('req1/other.png', os.path.join(temp_dir, 'other_again.png'))
+        assert _read(os.path.join(temp_dir, 'other_again.png')) == b'other image'
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_eviction():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        storage = LocalFileStorage(os.path.join(temp_dir, 'storage'))
+        storage.mkdir('req1')
+        cache_dir = os.path.join(temp_dir, 'cache')
+        store = PageArtifactStore(storage, cache_dir)
+        store.max_cache_size = 250
+
+        path_a = store.put('req1', _write(temp_dir, 'a.png', b'a' * 100))
+        path_b = store.put('req1', _write(temp_dir, 'b.png', b'b' * 100))
+        os.utime(os.path.join(cache_dir, os.path.basename(path_a)), (1000, 1000))
+        os.utime(os.path.join(cache_dir, os.path.basename(path_b)), (2000, 2000))
+        # a is used recently - b is the least recently used one
+        store.download_file(path_a, os.path.join(temp_dir, 'a_downloaded.png'))
+
+        path_c = store.put('req1', _write(temp_dir, 'c.png', b'c' * 100))
+        assert sorted(os.listdir(cache_dir)) == sorted(os.path.basename(p) for p in (path_a, path_c))
+
+        # not cached at all if the cache is disabled
+        store.max_cache_size = 0
+        path_d = store.put('req1', _write(temp_dir, 'd.png', b'd' * 100))
+        assert not os.path.exists(os.path.join(cache_dir, os.path.basename(path_d)))
+    finally:
+        shutil.rmtree(temp_dir)
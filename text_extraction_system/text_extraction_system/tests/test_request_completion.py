@@ -0,0 +1,108 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Generator, List, Tuple
+from unittest.mock import patch
+
+from text_extraction_system import request_completion
+from text_extraction_system.request_completion import RequestCompletionListener, channel_request_finished, \
+    notify_request_finished
+from text_extraction_system.tests.fake_redis import FakeRedis
+
+
+@contextmanager
+def listener_env() -> Generator[Tuple[RequestCompletionListener, FakeRedis], None, None]:
+    redis = FakeRedis()
+    with patch.object(request_completion, 'get_redis', return_value=redis):
+        listener = RequestCompletionListener()
+        listener._ensure_started()
+        # the notifications published before the listener subscribes are lost
+        for _i in range(500):
+            if redis.subscribers.get(channel_request_finished.encode('utf-8')):
+                break
+            time.sleep(0.01)
+        yield listener, redis
+
+
+def status_checks(*statuses: bool) -> Tuple[List[bool], Callable[[], Awaitable[bool]]]:
+    """
+    Returns the list of the performed checks and the check returning the specified statuses one by one
+    (the last one repeatedly).
+    """
+    checks = list()
+
+    async def is_finished() -> bool:
+        checks.append(statuses[min(len(checks), len(statuses) - 1)])
+        return checks[-1]
+
+    return checks, is_finished
+
+
+def test_notification_wakes_up_waiter():
+    with listener_env() as (listener, redis):
+        checks, is_finished = status_checks(False)
+
+        async def wait():
+            loop = asyncio.get_event_loop()
+            # another request finished first - the waiter keeps waiting
+            loop.call_later(0.05, notify_request_finished, 'req2')
+            loop.call_later(0.1, notify_request_finished, 'req1')
+            return await listener.wait_for_finish('req1', timeout_sec=60, is_finished=is_finished,
+                                                  recheck_interval_sec=30)
+
+        assert asyncio.run(wait())
+        # woken up by the notification - not by the periodic re-check
+        assert checks == [False]
+        assert listener._waiters == dict()
+
+
+def test_finished_before_waiting():
+    with listener_env() as (listener, redis):
+        checks, is_finished = status_checks(True)
+        assert asyncio.run(listener.wait_for_finish('req1', timeout_sec=60, is_finished=is_finished))
+        assert checks == [True]
+        assert listener._waiters == dict()
+
+
+def test_recheck_on_lost_notification():
+    with listener_env() as (listener, redis):
+        # finished without a notification
+        checks, is_finished = status_checks(False, False, True)
+        assert asyncio.run(listener.wait_for_finish('req1', timeout_sec=60, is_finished=is_finished,
+                                                    recheck_interval_sec=0.01))
+        assert checks == [False, False, True]
+        assert listener._waiters == dict()
+
+
+def test_timeout():
+    with listener_env() as (listener, redis):
+        checks, is_finished = status_checks(False)
+        assert not asyncio.run(listener.wait_for_finish('req1', timeout_sec=0.1, is_finished=is_finished,
+                                                        recheck_interval_sec=0.03))
+        assert len(checks) > 1
+        assert listener._waiters == dict()
+
+
+def test_waiters_unregistered():
+    with listener_env() as (listener, redis):
+        _checks1, is_finished1 = status_checks(False)
+        _checks2, is_finished2 = status_checks(False)
+
+        async def wait():
+            loop = asyncio.get_event_loop()
+            timed_out = loop.create_task(listener.wait_for_finish('req1', timeout_sec=0.05, is_finished=is_finished1))
+            notified = loop.create_task(listener.wait_for_finish('req1', timeout_sec=60, is_finished=is_finished2))
+            cancelled = loop.create_task(listener.wait_for_finish('req2', timeout_sec=60, is_finished=is_finished2))
+            assert not await timed_out
+            # the remaining waiter of the request is still registered
+            assert [len(waiters) for waiters in listener._waiters.values()] == [1, 1]
+
+            cancelled.cancel()
+            await asyncio.wait([cancelled])
+            assert list(listener._waiters) == ['req1']
+
+            notify_request_finished('req1')
+            return await notified
+
+        assert asyncio.run(wait())
+        assert listener._waiters == dict()
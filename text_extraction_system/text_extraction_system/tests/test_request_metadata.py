@@ -0,0 +1,52 @@
+import datetime
+import json
+import shutil
+import tempfile
+from unittest.mock import patch
+
+import pytest
+
+from text_extraction_system import request_metadata
+from text_extraction_system.commons.tests.commons import with_default_settings
+from text_extraction_system.file_storage import LocalFileStorage
+from text_extraction_system.request_metadata import RequestMetadata, RequestCallbackInfo, RequestMetadataCache, \
+    RequestMetadataVersionConflict, load_request_metadata, save_request_metadata
+
+
+def build_request(request_id: str = 'req1') -> RequestMetadata:
+    return RequestMetadata(request_id=request_id,
+                           request_date=datetime.datetime(2021, 1, 1),
+                           original_file_name='doc.pdf',
+                           original_document='doc.pdf',
+                           request_callback_info=RequestCallbackInfo(request_id=request_id,
+                                                                     original_file_name='doc.pdf'))
+
+
+def test_storage_etag_not_serialized():
+    req = build_request()
+    req.storage_etag = '"abc"'
+    assert 'storage_etag' not in json.loads(req.to_json())
+    assert RequestMetadata.from_json(req.to_json()).storage_etag is None
+
+
+@with_default_settings
+def test_save_checks_version():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        storage = LocalFileStorage(temp_dir)
+        storage.mkdir('req1')
+        with patch.object(request_metadata, 'get_file_storage', return_value=storage), \
+                patch.object(request_metadata, 'index_request_statuses'), \
+                patch.object(request_metadata, '_metadata_cache', RequestMetadataCache(ttl_sec=0)):
+            save_request_metadata(build_request())
+            req1 = load_request_metadata('req1')
+            req2 = load_request_metadata('req1')
+            assert req1.storage_etag and req1.storage_etag == req2.storage_etag
+
+            req1.status = 'DONE'
+            save_request_metadata(req1, check_version=True)
+            with pytest.raises(RequestMetadataVersionConflict):
+                save_request_metadata(req2, check_version=True)
+            assert load_request_metadata('req1').status == 'DONE'
+    finally:
+        shutil.rmtree(temp_dir)
@@ -0,0 +1,133 @@
+import asyncio
+import re
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from text_extraction_system import async_file_storage, request_metadata, request_status_index
+from text_extraction_system.async_file_storage import AsyncFileStorage
+from text_extraction_system.commons.tests.commons import with_default_settings
+from text_extraction_system.file_storage import LocalFileStorage
+from text_extraction_system.request_metadata import RequestMetadataCache, load_request_statuses_async, \
+    save_request_metadata
+from text_extraction_system.request_status_index import index_request_statuses, get_indexed_request_statuses, \
+    remove_request_statuses, request_status_key_prefix
+from text_extraction_system.tests.fake_redis import FakeRedis, FakePipeline
+from text_extraction_system.tests.test_request_metadata import build_request
+from text_extraction_system_api.dto import STATUS_DONE
+
+
+# Python equivalent of the Lua script of request_status_index
+
+def _set_if_newer(r: FakeRedis, keys, args):
+    version, value, ttl_sec = args
+    current = r.get(keys[0])
+    current_version = re.match(rb'^(\d+)\n', current) if current else None
+    if current_version and int(current_version.group(1)) > int(version):
+        return 0
+    r.set(keys[0], value, ex=int(ttl_sec))
+    return 1
+
+
+def build_fake_redis() -> FakeRedis:
+    return FakeRedis({request_status_index._set_if_newer_script: _set_if_newer})
+
+
+@with_default_settings
+def test_index_and_remove():
+    redis = build_fake_redis()
+    with patch.object(request_status_index, 'get_redis', return_value=redis):
+        index_request_statuses([(build_request('req1').to_request_status(), 1),
+                                (build_request('req2').to_request_status(), 1)])
+        statuses = get_indexed_request_statuses(['req1', 'req2', 'req3'])
+        assert sorted(statuses) == ['req1', 'req2']
+        assert statuses['req1'].original_file_name == 'doc.pdf'
+        assert redis.ttl(request_status_key_prefix + 'req1') > 0
+
+        remove_request_statuses(['req1'])
+        assert sorted(get_indexed_request_statuses(['req1', 'req2'])) == ['req2']
+
+
+@with_default_settings
+def test_index_older_version_not_stored():
+    redis = build_fake_redis()
+    done = build_request('req1')
+    done.status = STATUS_DONE
+    with patch.object(request_status_index, 'get_redis', return_value=redis):
+        index_request_statuses([(done.to_request_status(), 3)])
+        # e.g. saved by a slower process or loaded by the backfill before the last save
+        index_request_statuses([(build_request('req1').to_request_status(), 2),
+                                (build_request('req2').to_request_status(), 1)])
+        statuses = get_indexed_request_statuses(['req1', 'req2'])
+        assert statuses['req1'].status == STATUS_DONE
+        assert 'req2' in statuses
+
+        # the same version is saved without the version check - the last write wins
+        index_request_statuses([(build_request('req1').to_request_status(), 3)])
+        assert get_indexed_request_statuses(['req1'])['req1'].status != STATUS_DONE
+
+
+@with_default_settings
+def test_index_unversioned_value():
+    redis = build_fake_redis()
+    with patch.object(request_status_index, 'get_redis', return_value=redis):
+        # stored before the versions were introduced
+        redis.set(request_status_key_prefix + 'req1', build_request('req1').to_request_status().to_json())
+        assert get_indexed_request_statuses(['req1'])['req1'].request_id == 'req1'
+
+        done = build_request('req1')
+        done.status = STATUS_DONE
+        index_request_statuses([(done.to_request_status(), 1)])
+        assert get_indexed_request_statuses(['req1'])['req1'].status == STATUS_DONE
+
+
+@with_default_settings
+def test_index_failed_write_removes_status():
+    redis = build_fake_redis()
+    with patch.object(request_status_index, 'get_redis', return_value=redis):
+        index_request_statuses([(build_request('req1').to_request_status(), 1)])
+        done = build_request('req1')
+        done.status = STATUS_DONE
+        with patch.object(FakePipeline, 'execute', side_effect=ConnectionError('Connection reset')):
+            index_request_statuses([(done.to_request_status(), 2)])
+        # not served outdated - re-loaded from the storage
+        assert get_indexed_request_statuses(['req1']) == dict()
+
+
+def test_index_failures_ignored():
+    with patch.object(request_status_index, 'get_redis', side_effect=Exception('Redis is down')):
+        index_request_statuses([(build_request().to_request_status(), 1)])
+        remove_request_statuses(['req1'])
+        assert get_indexed_request_statuses(['req1']) == dict()
+
+
+@with_default_settings
+def test_load_statuses_backfill():
+    temp_dir = tempfile.mkdtemp()
+    redis = build_fake_redis()
+    try:
+        storage = LocalFileStorage(temp_dir)
+        with patch.object(request_metadata, 'get_file_storage', return_value=storage), \
+                patch.object(async_file_storage, '_async_file_storage', AsyncFileStorage(storage)), \
+                patch.object(request_metadata, '_metadata_cache', RequestMetadataCache(ttl_sec=0)), \
+                patch.object(request_status_index, 'get_redis', return_value=redis):
+            for request_id in ('req1', 'req2'):
+                storage.mkdir(request_id)
+                save_request_metadata(build_request(request_id))
+            # req2 is created before the index was introduced
+            remove_request_statuses(['req2'])
+
+            statuses = asyncio.run(load_request_statuses_async(['req1', 'req2', 'req3']))
+            assert sorted(statuses) == ['req1', 'req2']
+            assert sorted(get_indexed_request_statuses(['req1', 'req2', 'req3'])) == ['req1', 'req2']
+            assert redis.get(request_status_key_prefix + 'req2').startswith(b'1\n')
+
+            # saved by a worker after the backfill has loaded the metadata
+            req2 = request_metadata.load_request_metadata('req2')
+            req2.status = STATUS_DONE
+            save_request_metadata(req2)
+            assert req2.metadata_version == 2
+            index_request_statuses([(build_request('req2').to_request_status(), 1)])
+            assert get_indexed_request_statuses(['req2'])['req2'].status == STATUS_DONE
+    finally:
+        shutil.rmtree(temp_dir)
@@ -0,0 +1,255 @@
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import Generator, Tuple
+from unittest.mock import patch
+
+import pytest
+
+from text_extraction_system import result_cache
+from text_extraction_system.file_storage import LocalFileStorage
+from text_extraction_system.request_metadata import RequestMetadata
+from text_extraction_system.result_cache import ResultCache, CONVERTED, OCRED, RESULTS, PAGE_OCR, build_cache_key, \
+    redis_result_cache_lru, redis_result_cache_sizes, redis_result_cache_total_size, \
+    redis_result_cache_flight_prefix
+from text_extraction_system.tests.fake_redis import FakeRedis
+from text_extraction_system.tests.test_request_metadata import build_request
+
+
+# Python equivalents of the Lua scripts of result_cache
+
+def _add_entry(r: FakeRedis, keys, args):
+    lru, sizes, total_size = keys
+    entry_id, access_time, size = args
+    r.zadd(lru, {entry_id: access_time})
+    if r.hsetnx(sizes, entry_id, size):
+        r.incrby(total_size, int(size))
+    return 1
+
+
+def _pop_lru_entry(r: FakeRedis, keys, args):
+    lru, sizes, total_size = keys
+    if int(r.get(total_size) or 0) <= int(args[0]):
+        return None
+    oldest = r.zrange(lru, 0, 0)
+    if not oldest:
+        return None
+    size = int(r.hget(sizes, oldest[0]) or 0)
+    r.zrem(lru, oldest[0])
+    r.hdel(sizes, oldest[0])
+    r.decrby(total_size, size)
+    return [oldest[0], size]
+
+
+def _release_flight(r: FakeRedis, keys, args):
+    if r.get(keys[0]) == args[0].encode('utf-8'):
+        return r.delete(keys[0])
+    return 0
+
+
+def build_fake_redis() -> FakeRedis:
+    return FakeRedis({result_cache._add_entry_script: _add_entry,
+                      result_cache._pop_lru_entry_script: _pop_lru_entry,
+                      result_cache._release_flight_script: _release_flight})
+
+
+@contextmanager
+def result_cache_env(max_size_mb: int = 100) -> Generator[Tuple[LocalFileStorage, ResultCache, FakeRedis], None, None]:
+    temp_dir = tempfile.mkdtemp()
+    redis = build_fake_redis()
+    try:
+        storage = LocalFileStorage(temp_dir)
+        with patch.object(result_cache, 'get_redis', return_value=redis):
+            yield storage, ResultCache(storage, 'result_cache', max_size_mb, flight_ttl_sec=60), redis
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def build_document_request(storage: LocalFileStorage,
+                           request_id: str,
+                           original_document: str = 'doc.docx',
+                           sha256: str = 'sha1') -> RequestMetadata:
+    req = build_request(request_id)
+    req.original_document = original_document
+    req.original_document_sha256 = sha256
+    storage.mkdir(request_id)
+    return req
+
+
+def put_request_file(storage: LocalFileStorage, req: RequestMetadata, field: str, suffix: str, content: bytes):
+    fn = os.path.splitext(req.original_document)[0] + suffix
+    storage.upload_to(content, f'{req.request_id}/{fn}')
+    setattr(req, field, fn)
+
+
+def read_request_file(storage: LocalFileStorage, req: RequestMetadata, fn: str) -> bytes:
+    with open(storage.local_path(f'{req.request_id}/{fn}'), 'rb') as f:
+        return f.read()
+
+
+def test_converted_hit_and_miss():
+    with result_cache_env() as (storage, cache, redis):
+        req1 = build_document_request(storage, 'req1')
+        put_request_file(storage, req1, 'converted_to_pdf', '.converted.pdf', b'converted')
+        cache.store_request_files(CONVERTED, req1)
+
+        # the same document under another name
+        req2 = build_document_request(storage, 'req2', original_document='other.docx')
+        assert cache.restore_request_files(CONVERTED, req2)
+        assert req2.converted_to_pdf == 'other.converted.pdf'
+        assert read_request_file(storage, req2, 'other.converted.pdf') == b'converted'
+
+        # another document
+        req3 = build_document_request(storage, 'req3', sha256='sha2')
+        assert not cache.restore_request_files(CONVERTED, req3)
+        assert req3.converted_to_pdf is None
+
+        stats = cache.get_stats()
+        assert stats['levels']['converted'] == {'hits': 1, 'misses': 1, 'hit_rate': 0.5}
+        assert stats['entries'] == 1
+
+
+def test_ocred_hit_and_miss():
+    with result_cache_env() as (storage, cache, redis):
+        req1 = build_document_request(storage, 'req1', original_document='doc.pdf')
+        put_request_file(storage, req1, 'ocred_pdf', '.ocred.pdf', b'ocred')
+        req1.pdf_pages_ocred = [1, 3]
+        cache.store_request_files(OCRED, req1)
+
+        req2 = build_document_request(storage, 'req2', original_document='scan.pdf')
+        assert cache.restore_request_files(OCRED, req2)
+        assert req2.ocred_pdf == 'scan.ocred.pdf'
+        assert req2.pdf_pages_ocred == [1, 3]
+        assert read_request_file(storage, req2, 'scan.ocred.pdf') == b'ocred'
+
+        # the OCR options are a part of the key
+        req3 = build_document_request(storage, 'req3', original_document='doc.pdf')
+        req3.doc_language = 'de'
+        assert not cache.restore_request_files(OCRED, req3)
+        assert req3.ocred_pdf is None and req3.pdf_pages_ocred is None
+
+
+def test_results_hit_and_miss():
+    with result_cache_env() as (storage, cache, redis):
+        req1 = build_document_request(storage, 'req1')
+        put_request_file(storage, req1, 'converted_to_pdf', '.converted.pdf', b'converted')
+        put_request_file(storage, req1, 'plain_text_file', '.plain.txt', b'text')
+        put_request_file(storage, req1, 'text_structure_file', '.document.msgpack', b'structure')
+        # removed on the request finish - not cached but restored as the field value
+        req1.ocred_pdf = 'doc.ocred.pdf'
+        req1.page_rotate_angles = [0, 90]
+        cache.store_request_files(RESULTS, req1)
+
+        req2 = build_document_request(storage, 'req2', original_document='renamed.docx')
+        assert cache.restore_request_files(RESULTS, req2)
+        assert req2.converted_to_pdf == 'renamed.converted.pdf'
+        assert req2.plain_text_file == 'renamed.plain.txt'
+        assert req2.text_structure_file == 'renamed.document.msgpack'
+        assert req2.ocred_pdf == 'renamed.ocred.pdf'
+        assert req2.tables_file is None
+        assert req2.page_rotate_angles == [0, 90]
+        assert read_request_file(storage, req2, 'renamed.plain.txt') == b'text'
+        assert read_request_file(storage, req2, 'renamed.document.msgpack') == b'structure'
+        assert not os.path.exists(storage.local_path('req2/renamed.ocred.pdf'))
+
+        req3 = build_document_request(storage, 'req3')
+        req3.table_extraction_enable = False
+        assert not cache.restore_request_files(RESULTS, req3)
+        assert req3.plain_text_file is None
+
+        # the entry without the manifest is incomplete
+        storage.clean(f'result_cache/results/{build_cache_key(RESULTS, req1)}/manifest.json')
+        assert not cache.restore_request_files(RESULTS, build_document_request(storage, 'req4'))
+
+
+def test_put_existing_entry_counted_once():
+    with result_cache_env() as (storage, cache, redis):
+        for request_id in ('req1', 'req2'):
+            req = build_document_request(storage, request_id)
+            put_request_file(storage, req, 'converted_to_pdf', '.converted.pdf', b'converted')
+            cache.store_request_files(CONVERTED, req)
+        assert redis.zcard(redis_result_cache_lru) == 1
+        sizes = [int(size) for size in redis.hgetall(redis_result_cache_sizes).values()]
+        assert int(redis.get(redis_result_cache_total_size)) == sum(sizes) > 0
+
+
+def test_flight_follower_retries_after_owner_fails():
+    with result_cache_env() as (storage, cache, redis):
+        owner = build_document_request(storage, 'req1')
+        follower = build_document_request(storage, 'req2')
+
+        assert cache.acquire_flight(RESULTS, owner) is None
+        # repeated by the owner - e.g. the task is restarted
+        assert cache.acquire_flight(RESULTS, owner) is None
+        # the follower waits (retries the task) while the owner computes the results
+        assert not cache.restore_request_files(RESULTS, follower)
+        assert cache.acquire_flight(RESULTS, follower) == 'req1'
+
+        # only the owner releases the lock
+        cache.release_flight(RESULTS, follower)
+        assert cache.acquire_flight(RESULTS, follower) == 'req1'
+
+        # the owner fails and releases the lock without storing the results
+        cache.release_flight(RESULTS, owner)
+        assert not cache.restore_request_files(RESULTS, follower)
+        assert cache.acquire_flight(RESULTS, follower) is None
+
+        put_request_file(storage, follower, 'plain_text_file', '.plain.txt', b'text')
+        cache.store_request_files(RESULTS, follower)
+        cache.release_flight(RESULTS, follower)
+        assert cache.restore_request_files(RESULTS, build_document_request(storage, 'req3'))
+
+
+def test_flight_owner_lost():
+    with result_cache_env() as (storage, cache, redis):
+        owner = build_document_request(storage, 'req1')
+        follower = build_document_request(storage, 'req2')
+        assert cache.acquire_flight(RESULTS, owner) is None
+        assert cache.acquire_flight(RESULTS, follower) == 'req1'
+        # the lock expires
+        redis.expires[(redis_result_cache_flight_prefix
+                       + f'results/{build_cache_key(RESULTS, owner)}').encode('utf-8')] = 0
+        assert cache.acquire_flight(RESULTS, follower) is None
+
+
+def test_evict():
+    with result_cache_env(max_size_mb=1) as (storage, cache, redis):
+        content = b'0' * 400 * 1024
+        for i in range(3):
+            req = build_document_request(storage, f'req{i}', sha256=f'sha{i}')
+            put_request_file(storage, req, 'converted_to_pdf', '.converted.pdf', content)
+            cache.store_request_files(CONVERTED, req)
+            if i == 1:
+                # req0 is used recently - req1 is evicted instead
+                assert cache.restore_request_files(CONVERTED, build_document_request(storage, 'req3', sha256='sha0'))
+
+        sizes = {k.decode('utf-8'): int(v) for k, v in redis.hgetall(redis_result_cache_sizes).items()}
+        assert int(redis.get(redis_result_cache_total_size)) == sum(sizes.values()) <= cache.max_size
+        assert sorted(sizes) == sorted(m.decode('utf-8') for m in redis.zrange(redis_result_cache_lru, 0, -1))
+        for i in range(3):
+            key = build_cache_key(CONVERTED, build_document_request(storage, f'req{i}', sha256=f'sha{i}'))
+            assert (f'converted/{key}' in sizes) == (i != 1)
+            assert os.path.isdir(storage.local_path(f'result_cache/converted/{key}')) == (i != 1)
+
+
+def test_entries_outlive_requests():
+    with result_cache_env() as (storage, cache, redis):
+        req1 = build_document_request(storage, 'req1')
+        put_request_file(storage, req1, 'converted_to_pdf', '.converted.pdf', b'converted')
+        cache.store_request_files(CONVERTED, req1)
+        req2 = build_document_request(storage, 'req2')
+        assert cache.restore_request_files(CONVERTED, req2)
+
+        # the requests are deleted - the document is submitted again later
+        storage.clean('req1/')
+        storage.clean('req2/')
+        req3 = build_document_request(storage, 'req3')
+        assert cache.restore_request_files(CONVERTED, req3)
+        assert read_request_file(storage, req3, 'doc.converted.pdf') == b'converted'
+        assert storage.list('req3') == ['doc.converted.pdf']
+
+
+def test_page_ocr_key_not_built_from_request():
+    with pytest.raises(ValueError):
+        build_cache_key(PAGE_OCR, build_request())
@@ -0,0 +1,139 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from contextlib import contextmanager
+from typing import Generator, Tuple
+from unittest.mock import patch
+
+import pytest
+from fastapi.exceptions import HTTPException
+from fastapi.testclient import TestClient
+
+from text_extraction_system import web_api
+from text_extraction_system.async_file_storage import AsyncFileStorage
+from text_extraction_system.file_storage import LocalFileStorage
+from text_extraction_system.request_metadata import RequestMetadata
+from text_extraction_system.result_cache import CONVERTED
+from text_extraction_system.tests.test_request_metadata import build_request
+from text_extraction_system.tests.test_result_cache import result_cache_env, build_document_request, \
+    put_request_file
+
+
+def test_result_cache_stats():
+    client = TestClient(web_api.app)
+    with patch.object(web_api, 'get_result_cache', return_value=None):
+        assert client.get('/api/v1/result_cache_stats.json').status_code == 404
+
+    with result_cache_env() as (storage, cache, redis), \
+            patch.object(web_api, 'get_result_cache', return_value=cache):
+        req = build_document_request(storage, 'req1')
+        put_request_file(storage, req, 'converted_to_pdf', '.converted.pdf', b'converted')
+        cache.store_request_files(CONVERTED, req)
+        assert cache.restore_request_files(CONVERTED, build_document_request(storage, 'req2'))
+
+        resp = client.get('/api/v1/result_cache_stats.json')
+        assert resp.status_code == 200
+        stats = resp.json()
+        assert stats['levels']['converted'] == {'hits': 1, 'misses': 0, 'hit_rate': 1.0}
+        assert stats['levels']['page_ocr'] == {'hits': 0, 'misses': 0, 'hit_rate': None}
+        assert stats['entries'] == 1
+        assert stats['total_size'] > len(b'converted')
+        assert stats['max_size'] == cache.max_size
+
+
+@contextmanager
+def request_results_env() -> Generator[Tuple[LocalFileStorage, RequestMetadata], None, None]:
+    temp_dir = tempfile.mkdtemp()
+    try:
+        storage = LocalFileStorage(temp_dir)
+        req = build_request('req1')
+        storage.mkdir('req1')
+        put_request_file(storage, req, 'plain_text_file', '.plain.txt', b'text')
+        put_request_file(storage, req, 'tables_file', '.tables.json', b'0123456789')
+        # the file is removed by someone - skipped in the archive
+        req.text_structure_file = 'doc.document.msgpack'
+
+        async def load_request_metadata_async(request_id: str, max_age_sec=None):
+            return req if request_id == 'req1' else None
+
+        with patch.object(web_api, 'get_file_storage', return_value=storage), \
+                patch.object(web_api, 'get_async_file_storage', return_value=AsyncFileStorage(storage)), \
+                patch.object(web_api, 'load_request_metadata_async', load_request_metadata_async):
+            yield storage, req
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_results_zip():
+    client = TestClient(web_api.app)
+    with request_results_env() as (storage, req):
+        # larger than a chunk of the storage stream
+        pdf = os.urandom(3 * 1024 * 1024)
+        put_request_file(storage, req, 'pdf_file', '.pdf', pdf)
+        # the archive is sent while the files are being read
+        chunks = list(web_api.stream_request_results_zip(storage, req))
+        assert len(chunks) > 1
+
+        resp = client.get('/api/v1/data_extraction_tasks/req1/results/packed_data.zip')
+        assert resp.status_code == 200
+        assert resp.headers['Content-Disposition'] == 'attachment; filename=packed_data.zip'
+        for content in (b''.join(chunks), resp.content):
+            with zipfile.ZipFile(io.BytesIO(content)) as zip_file:
+                assert zip_file.namelist() == ['doc.plain.txt', 'doc.tables.json', 'doc.pdf', 'status.json']
+                assert zip_file.read('doc.plain.txt') == b'text'
+                assert zip_file.read('doc.tables.json') == b'0123456789'
+                assert zip_file.read('doc.pdf') == pdf
+                assert json.loads(zip_file.read('status.json'))['request_id'] == 'req1'
+
+        assert client.get('/api/v1/data_extraction_tasks/req2/results/packed_data.zip').status_code == 404
+
+
+def test_results_range():
+    client = TestClient(web_api.app)
+    url = '/api/v1/data_extraction_tasks/req1/results/extracted_tables.json'
+    with request_results_env():
+        resp = client.get(url)
+        assert resp.status_code == 200
+        assert resp.content == b'0123456789'
+        assert resp.headers['Accept-Ranges'] == 'bytes'
+
+        resp = client.get(url, headers={'Range': 'bytes=2-5'})
+        assert resp.status_code == 206
+        assert resp.content == b'2345'
+        assert resp.headers['Content-Range'] == 'bytes 2-5/10'
+        assert resp.headers['Content-Length'] == '4'
+
+        # suffix range
+        resp = client.get(url, headers={'Range': 'bytes=-3'})
+        assert resp.status_code == 206
+        assert resp.content == b'789'
+        assert resp.headers['Content-Range'] == 'bytes 7-9/10'
+
+        # open range, the end is beyond the file end
+        for range_header in ('bytes=8-', 'bytes=8-100'):
+            resp = client.get(url, headers={'Range': range_header})
+            assert resp.status_code == 206
+            assert resp.content == b'89'
+            assert resp.headers['Content-Range'] == 'bytes 8-9/10'
+
+        resp = client.get(url, headers={'Range': 'bytes=10-20'})
+        assert resp.status_code == 416
+        assert resp.headers['Content-Range'] == 'bytes */10'
+
+
+def test_parse_range():
+    assert web_api._parse_range(None, 10) is None
+    # not supported - the whole file is sent
+    assert web_api._parse_range('bytes=0-1,5-6', 10) is None
+    assert web_api._parse_range('lines=0-1', 10) is None
+    assert web_api._parse_range('bytes=a-b', 10) is None
+
+    assert web_api._parse_range('bytes=0-0', 10) == (0, 0)
+    assert web_api._parse_range('bytes=3-', 10) == (3, 9)
+    assert web_api._parse_range('bytes=-20', 10) == (0, 9)
+    with pytest.raises(HTTPException) as e:
+        web_api._parse_range('bytes=5-4', 10)
+    assert e.value.status_code == 416
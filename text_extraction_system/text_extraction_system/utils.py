@@ -1,3 +1,5 @@
+from typing import Optional
+
 from text_extraction_system.constants import TESSERACT_LANGUAGES, TESSERACT_DEFAULT_LANGUAGE
 
 
@@ -23,4 +25,15 @@ class LanguageConverter:
 
 
 def page_num_to_fn(page_num: int) -> str:
-    return f'{page_num:05}'
\ No newline at end of file
+    return f'{page_num:05}'
+
+
+def page_ocred_fn(page_number: int, rotation_angle: Optional[float]) -> str:
+    """
+    Returns the name of the OCR-ed text layer PDF of the page: <page_num>.pdf or <page_num>.<rotation angle>.pdf.
+    The names are parsed back in finish_pdf_processing(..).
+    """
+    file_name = page_num_to_fn(page_number)
+    if rotation_angle:
+        file_name = f'{file_name}.{rotation_angle}'
+    return f'{file_name}.pdf'
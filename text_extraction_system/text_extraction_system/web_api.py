@@ -1,14 +1,13 @@
+import asyncio
 import io
 import json
 import os
 import sys
-import time
 import zipfile
 from datetime import datetime
+from logging import getLogger
 from io import BytesIO
-from shutil import rmtree
-from tempfile import mkdtemp
-from typing import AnyStr, List, Dict, Any, Callable, Optional
+from typing import AnyStr, List, Dict, Any, Callable, Optional, Iterator, Tuple
 from uuid import uuid4
 from zipfile import ZipFile
 
@@ -16,27 +15,45 @@ import pandas
 from fastapi import FastAPI, File, UploadFile, Form, Response, APIRouter
 from fastapi.exceptions import HTTPException
 from starlette.requests import Request
-from starlette.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse, FileResponse
 from starlette.staticfiles import StaticFiles
-from starlette.status import HTTP_404_NOT_FOUND, HTTP_400_BAD_REQUEST
+from starlette.status import HTTP_404_NOT_FOUND, HTTP_400_BAD_REQUEST, HTTP_206_PARTIAL_CONTENT, \
+    HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, HTTP_500_INTERNAL_SERVER_ERROR
 from starlette.templating import Jinja2Templates
 from webdav3.exceptions import RemoteResourceNotFound
 
 from text_extraction_system import version
+from text_extraction_system.async_file_storage import AsyncFileStorage, get_async_file_storage, \
+    close_async_file_storage
 from text_extraction_system.celery_log import HumanReadableTraceBackException
 from text_extraction_system.commons.escape_utils import get_valid_fn
-from text_extraction_system.constants import task_ids
-from text_extraction_system.file_storage import get_webdav_client, WebDavClient
-from text_extraction_system.request_metadata import RequestMetadata, RequestCallbackInfo, save_request_metadata, \
-    load_request_metadata
-from text_extraction_system.tasks import process_document, celery_app, register_task_id, get_request_task_ids
+from text_extraction_system.config import get_settings
+from text_extraction_system.file_storage import get_file_storage, FileStorage
+from text_extraction_system.request_completion import get_request_completion_listener
+from text_extraction_system.request_metadata import RequestMetadata, RequestCallbackInfo, \
+    save_request_metadata_async, load_request_metadata_async, load_request_statuses_async
+from text_extraction_system.request_status_index import remove_request_statuses
+from text_extraction_system.result_cache import get_result_cache
+from text_extraction_system.tasks import process_document, celery_app, register_first_task_id_async, \
+    get_request_task_ids_async
 from text_extraction_system_api import dto
 from text_extraction_system_api.dto import OutputFormat, TableList, PlainTextStructure, RequestStatus, \
     RequestStatuses, SystemInfo, TaskCancelResult, PDFCoordinates, STATUS_DONE, STATUS_FAILURE, UserRequestsSummary, \
     STATUS_PENDING, UserRequestsQuery, TableParser, RequestEstimate, RequestProgress
+from text_extraction_system_api.pdf_coordinates.paged_char_boxes import PagedCharBoxesHeader, parse_page_entry, \
+    PagedCharBoxesFormatError, HEADER as CHAR_BOXES_HEADER, PAGE_ENTRY as CHAR_BOXES_PAGE_ENTRY
+
+log = getLogger(__name__)
 
 app = FastAPI()
 
+
+@app.on_event('shutdown')
+async def close_storage_connections():
+    await close_async_file_storage()
+
 apiRouter = APIRouter()
 
 app.mount("/static", StaticFiles(directory="text_extraction_system/templates"), name="static")
@@ -92,7 +109,7 @@ async def post_data_extraction_task(file: UploadFile = File(...),
                                     page_ocr_timeout_sec: int = Form(default=60),
                                     remove_ocr_layer: bool = Form(default=False),
                                     detect_orientation_tesseract: bool = Form(default=False),):
-    webdav_client = get_webdav_client()
+    storage = get_async_file_storage()
     request_id = get_valid_fn(request_id) if request_id else str(uuid4())
     log_extra = json.loads(log_extra_json_key_value) if log_extra_json_key_value else None
     req = RequestMetadata(original_file_name=file.filename,
@@ -127,21 +144,27 @@ async def post_data_extraction_task(file: UploadFile = File(...),
                               call_back_estimate_url=estimation_call_back_url,
                               call_back_progress_url=progress_call_back_url,
                               log_extra=log_extra))
-    webdav_client.mkdir(f'/{req.request_id}')
+    await storage.mkdir(f'/{req.request_id}')
 
-    save_request_metadata(req)
-    webdav_client.upload_to(file.file, f'{req.request_id}/{req.original_document}')
-    async_task = process_document.apply_async(
-        (req.request_id, req.request_callback_info.to_dict(), remove_ocr_layer))
+    await asyncio.gather(save_request_metadata_async(req),
+                         storage.upload_to(file.file, f'{req.request_id}/{req.original_document}'))
+    async_task = await run_in_threadpool(
+        process_document.apply_async, (req.request_id, req.request_callback_info.to_dict(), remove_ocr_layer))
 
-    webdav_client.mkdir(f'{req.request_id}/{task_ids}')
-    register_task_id(webdav_client, req.request_id, async_task.id)
+    await register_first_task_id_async(storage, req.request_id, async_task.id)
 
     return req.request_id
 
 
-def load_request_metadata_or_raise(request_id: str) -> RequestMetadata:
-    req = load_request_metadata(request_id)
+async def _delete_request_files(storage: AsyncFileStorage, request_id: str):
+    try:
+        await storage.clean(f'{request_id}/')
+    finally:
+        await run_in_threadpool(remove_request_statuses, [request_id])
+
+
+async def load_request_metadata_or_raise(request_id: str, max_age_sec: Optional[float] = None) -> RequestMetadata:
+    req = await load_request_metadata_async(request_id, max_age_sec)
     if not req:
         raise HTTPException(HTTP_404_NOT_FOUND, 'No such data extraction request.')
     return req
@@ -152,7 +175,8 @@ def load_request_metadata_or_raise(request_id: str) -> RequestMetadata:
 async def purge_data_extraction_task(request_id: str):
     problems: dict = {}
     success: list = []
-    celery_task_ids: List[str] = get_request_task_ids(get_webdav_client(), request_id)
+    storage = get_async_file_storage()
+    celery_task_ids: List[str] = await get_request_task_ids_async(storage, request_id)
     for task_id in celery_task_ids:
         try:
             celery_app.control.revoke(task_id, terminate=True)
@@ -162,7 +186,7 @@ async def purge_data_extraction_task(request_id: str):
                 .from_exception(ex) \
                 .human_readable_format()
     try:
-        get_webdav_client().clean(f'{request_id}/')
+        await _delete_request_files(storage, request_id)
     except RemoteResourceNotFound:
         problems[''] = f'Request "{request_id}" is not instantiated on WebDAV'
 
@@ -175,7 +199,7 @@ async def purge_data_extraction_task(request_id: str):
 @app.get('/api/v1/data_extraction_tasks/{request_id}/status.json', response_model=RequestStatus,
          tags=["Asynchronous Data Extraction"])
 async def get_request_status(request_id: str):
-    return load_request_metadata_or_raise(request_id).to_request_status().to_dict()
+    return (await load_request_metadata_or_raise(request_id)).to_request_status().to_dict()
 
 
 @app.post('/api/v1/data_extraction_tasks/query_request_statuses',
@@ -184,11 +208,8 @@ async def get_request_status(request_id: str):
 async def query_multiple_request_statuses(request_ids: List[str]) -> RequestStatuses:
     if not request_ids:
         raise HTTPException(HTTP_400_BAD_REQUEST, 'Request ids must be specified.')
-    statuses = []
-    for request_id in request_ids:
-        req = load_request_metadata(request_id)
-        if req:
-            statuses.append(req.to_request_status())
+    statuses_by_id = await load_request_statuses_async(request_ids)
+    statuses = [statuses_by_id[request_id] for request_id in request_ids if request_id in statuses_by_id]
     return RequestStatuses(request_statuses=statuses).to_dict()
 
 
@@ -199,11 +220,11 @@ async def query_user_requests(
         request: UserRequestsQuery) -> UserRequestsSummary:
     if not request.request_ids:
         raise HTTPException(HTTP_400_BAD_REQUEST, 'Request ids must be specified.')
+    statuses_by_id = await load_request_statuses_async(request.request_ids)
     statuses = []
     for request_id, request_time in zip(request.request_ids, request.request_times):
-        req = load_request_metadata(request_id)
-        if req:
-            req_status = req.to_request_status()
+        req_status = statuses_by_id.get(request_id)
+        if req_status:
             setattr(req_status, 'started', request_time)
             statuses.append(req_status)
 
@@ -221,18 +242,20 @@ async def query_user_requests(
 
 @app.get('/api/v1/data_extraction_tasks/{request_id}/results/packed_data.zip', tags=["Asynchronous Data Extraction"])
 async def get_all_extracted_data_in_zip_archive(request_id: str):
-    req: RequestMetadata = load_request_metadata_or_raise(request_id)
-    mem_stream = pack_request_results(req)
-    mem_stream.seek(0)
-    response = StreamingResponse(mem_stream, media_type='application/x-zip-compressed')
+    req: RequestMetadata = await load_request_metadata_or_raise(request_id)
+    response = StreamingResponse(stream_request_results_zip(get_file_storage(), req),
+                                 media_type='application/x-zip-compressed')
     response.headers['Content-Disposition'] = 'attachment; filename=packed_data.zip'
     return response
 
 
 @app.get('/api/v1/data_extraction_tasks/{request_id}/results/extracted_tables.json',
          response_model=TableList, tags=["Asynchronous Data Extraction"])
-async def get_extracted_tables_as_json(request_id: str):
-    return _proxy_request(get_webdav_client(), request_id, load_request_metadata_or_raise(request_id).tables_file)
+async def get_extracted_tables_as_json(request_id: str, request: Request):
+    return await _proxy_request(get_async_file_storage(),
+                                request_id,
+                                (await load_request_metadata_or_raise(request_id)).tables_file,
+                                range_header=request.headers.get('range'))
 
 
 @app.get('/api/v1/data_extraction_tasks/{request_id}/results/extracted_tables.msgpack',
@@ -242,8 +265,11 @@ async def get_extracted_tables_as_json(request_id: str):
                  'content': {'application/octet-stream': {}},
              }
          }, tags=["Asynchronous Data Extraction"])
-async def get_extracted_tables_as_msgpack(request_id: str):
-    return _proxy_request(get_webdav_client(), request_id, load_request_metadata_or_raise(request_id).tables_file)
+async def get_extracted_tables_as_msgpack(request_id: str, request: Request):
+    return await _proxy_request(get_async_file_storage(),
+                                request_id,
+                                (await load_request_metadata_or_raise(request_id)).tables_file,
+                                range_header=request.headers.get('range'))
 
 
 @app.get('/api/v1/data_extraction_tasks/{request_id}/results/extracted_tables.bin',
@@ -253,25 +279,30 @@ async def get_extracted_tables_as_msgpack(request_id: str):
                  'content': {'application/octet-stream': {}},
              }
          }, tags=["Asynchronous Data Extraction"])
-async def get_extracted_tables_as_protobuf(request_id: str):
-    return _proxy_request(get_webdav_client(), request_id, load_request_metadata_or_raise(request_id).tables_file)
+async def get_extracted_tables_as_protobuf(request_id: str, request: Request):
+    return await _proxy_request(get_async_file_storage(),
+                                request_id,
+                                (await load_request_metadata_or_raise(request_id)).tables_file,
+                                range_header=request.headers.get('range'))
 
 
 @app.get('/api/v1/data_extraction_tasks/{request_id}/results/extracted_plain_text.txt', response_model=AnyStr,
          tags=["Asynchronous Data Extraction"])
-async def get_extracted_plain_text(request_id: str):
-    return _proxy_request(get_webdav_client(),
-                          request_id,
-                          load_request_metadata_or_raise(request_id).plain_text_file,
-                          headers={'Content-Type': 'text/plain; charset=utf-8'})
+async def get_extracted_plain_text(request_id: str, request: Request):
+    return await _proxy_request(get_async_file_storage(),
+                                request_id,
+                                (await load_request_metadata_or_raise(request_id)).plain_text_file,
+                                headers={'Content-Type': 'text/plain; charset=utf-8'},
+                                range_header=request.headers.get('range'))
 
 
 @app.get('/api/v1/data_extraction_tasks/{request_id}/results/document_structure.json',
          response_model=PlainTextStructure, tags=["Asynchronous Data Extraction"])
-async def get_extracted_text_structure_as_json(request_id: str):
-    return _proxy_request(get_webdav_client(),
-                          request_id,
-                          load_request_metadata_or_raise(request_id).text_structure_file)
+async def get_extracted_text_structure_as_json(request_id: str, request: Request):
+    return await _proxy_request(get_async_file_storage(),
+                                request_id,
+                                (await load_request_metadata_or_raise(request_id)).text_structure_file,
+                                range_header=request.headers.get('range'))
 
 
 @app.get('/api/v1/data_extraction_tasks/{request_id}/results/document_structure.msgpack',
@@ -281,10 +312,11 @@ async def get_extracted_text_structure_as_json(request_id: str):
                  'content': {'application/octet-stream': {}},
              }
          }, tags=["Asynchronous Data Extraction"])
-async def get_extracted_text_structure_as_msgpack(request_id: str):
-    return _proxy_request(get_webdav_client(),
-                          request_id,
-                          load_request_metadata_or_raise(request_id).text_structure_file)
+async def get_extracted_text_structure_as_msgpack(request_id: str, request: Request):
+    return await _proxy_request(get_async_file_storage(),
+                                request_id,
+                                (await load_request_metadata_or_raise(request_id)).text_structure_file,
+                                range_header=request.headers.get('range'))
 
 
 @app.get('/api/v1/data_extraction_tasks/{request_id}/results/document_structure.bin',
@@ -294,18 +326,20 @@ async def get_extracted_text_structure_as_msgpack(request_id: str):
                  'content': {'application/octet-stream': {}},
              }
          }, tags=["Asynchronous Data Extraction"])
-async def get_extracted_text_structure_as_protobuf(request_id: str):
-    return _proxy_request(get_webdav_client(),
-                          request_id,
-                          load_request_metadata_or_raise(request_id).text_structure_file)
+async def get_extracted_text_structure_as_protobuf(request_id: str, request: Request):
+    return await _proxy_request(get_async_file_storage(),
+                                request_id,
+                                (await load_request_metadata_or_raise(request_id)).text_structure_file,
+                                range_header=request.headers.get('range'))
 
 
 @app.get('/api/v1/data_extraction_tasks/{request_id}/results/pdf_coordinates.json',
          response_model=PDFCoordinates, tags=["Asynchronous Data Extraction"])
-async def get_pdf_coordinates_of_each_character_in_extracted_plain_text_as_json(request_id: str):
-    return _proxy_request(get_webdav_client(),
-                          request_id,
-                          load_request_metadata_or_raise(request_id).pdf_coordinates_file)
+async def get_pdf_coordinates_of_each_character_in_extracted_plain_text_as_json(request_id: str, request: Request):
+    return await _proxy_request(get_async_file_storage(),
+                                request_id,
+                                (await load_request_metadata_or_raise(request_id)).pdf_coordinates_file,
+                                range_header=request.headers.get('range'))
 
 
 @app.get('/api/v1/data_extraction_tasks/{request_id}/results/pdf_coordinates.msgpack',
@@ -315,10 +349,11 @@ async def get_pdf_coordinates_of_each_character_in_extracted_plain_text_as_json(
                  'content': {'application/octet-stream': {}},
              }
          }, tags=["Asynchronous Data Extraction"])
-async def get_pdf_coordinates_of_each_character_in_extracted_plain_text_as_msgpack(request_id: str):
-    return _proxy_request(get_webdav_client(),
-                          request_id,
-                          load_request_metadata_or_raise(request_id).pdf_coordinates_file)
+async def get_pdf_coordinates_of_each_character_in_extracted_plain_text_as_msgpack(request_id: str, request: Request):
+    return await _proxy_request(get_async_file_storage(),
+                                request_id,
+                                (await load_request_metadata_or_raise(request_id)).pdf_coordinates_file,
+                                range_header=request.headers.get('range'))
 
 
 @app.get('/api/v1/data_extraction_tasks/{request_id}/results/pdf_coordinates.bin',
@@ -328,45 +363,138 @@ async def get_pdf_coordinates_of_each_character_in_extracted_plain_text_as_msgpa
                  'content': {'application/octet-stream': {}},
              }
          }, tags=["Asynchronous Data Extraction"])
-async def get_pdf_coordinates_of_each_character_in_extracted_plain_text_as_protobuf(request_id: str):
-    return _proxy_request(get_webdav_client(),
-                          request_id,
-                          load_request_metadata_or_raise(request_id).pdf_coordinates_file)
+async def get_pdf_coordinates_of_each_character_in_extracted_plain_text_as_protobuf(request_id: str, request: Request):
+    return await _proxy_request(get_async_file_storage(),
+                                request_id,
+                                (await load_request_metadata_or_raise(request_id)).pdf_coordinates_file,
+                                range_header=request.headers.get('range'))
+
+
+@app.get('/api/v1/data_extraction_tasks/{request_id}/results/pdf_coordinates.pages',
+         responses={
+             200: {
+                 'description': 'Character boxes as little-endian float32 array with the page offset table. '
+                                'See text_extraction_system_api.pdf_coordinates.paged_char_boxes for the layout.',
+                 'content': {'application/octet-stream': {}},
+             }
+         }, tags=["Asynchronous Data Extraction"])
+async def get_pdf_coordinates_with_page_offsets(request_id: str, request: Request):
+    return await _proxy_request(get_async_file_storage(),
+                                request_id,
+                                (await load_request_metadata_or_raise(request_id)).pdf_coordinates_pages_file,
+                                range_header=request.headers.get('range'))
+
+
+async def _read_range(storage: AsyncFileStorage, remote_path: str, start: int, end: int) -> bytes:
+    # end is inclusive - the same as in FileStorage.stream()
+    return b''.join([chunk async for chunk in await storage.stream(remote_path, start=start, end=end)])
+
+
+@app.get('/api/v1/data_extraction_tasks/{request_id}/results/pdf_coordinates/page/{page_num}',
+         responses={
+             200: {
+                 'description': 'Character boxes of the page (0-based): 4 little-endian float32 '
+                                '(left, top, width, height) per character, NaN for the characters having no box. '
+                                'X-Char-Start / X-Char-End headers contain the character index range of the page.',
+                 'content': {'application/octet-stream': {}},
+             }
+         }, tags=["Asynchronous Data Extraction"])
+async def get_pdf_coordinates_of_page(request_id: str, page_num: int):
+    req = await load_request_metadata_or_raise(request_id)
+    if not req.pdf_coordinates_pages_file:
+        raise HTTPException(HTTP_404_NOT_FOUND, 'Page coordinates are not available for this request.')
+    storage = get_async_file_storage()
+    remote_path = f'{request_id}/{req.pdf_coordinates_pages_file}'
+    try:
+        # only the header, the page table entry and the boxes of the page are read from the storage
+        header = PagedCharBoxesHeader.parse(await _read_range(storage, remote_path, 0, CHAR_BOXES_HEADER.size - 1))
+        try:
+            entry_offset = header.page_entry_offset(page_num)
+        except IndexError as e:
+            raise HTTPException(HTTP_404_NOT_FOUND, str(e))
+        start, end = parse_page_entry(
+            await _read_range(storage, remote_path, entry_offset, entry_offset + CHAR_BOXES_PAGE_ENTRY.size - 1))
+        first_byte, end_byte = header.boxes_byte_range(start, end)
+        headers = {'X-Char-Start': str(start),
+                   'X-Char-End': str(end),
+                   'Content-Length': str(end_byte - first_byte)}
+        if end_byte == first_byte:
+            return Response(content=b'', media_type='application/octet-stream', headers=headers)
+        return StreamingResponse(await storage.stream(remote_path, start=first_byte, end=end_byte - 1),
+                                 media_type='application/octet-stream',
+                                 headers=headers)
+    except RemoteResourceNotFound:
+        raise HTTPException(HTTP_404_NOT_FOUND, 'Page coordinates are not available for this request.')
+    except PagedCharBoxesFormatError as e:
+        log.error(f'Corrupted page coordinates file {remote_path}: {e}')
+        raise HTTPException(HTTP_500_INTERNAL_SERVER_ERROR,
+                            f'Page coordinates file of this request is corrupted: {e}')
 
 
 @app.get('/api/v1/data_extraction_tasks/{request_id}/results/searchable_pdf.pdf', tags=["Asynchronous Data Extraction"])
-async def get_searchable_pdf(request_id: str):
-    return _proxy_request(get_webdav_client(),
-                          request_id,
-                          load_request_metadata_or_raise(request_id).pdf_file)
+async def get_searchable_pdf(request_id: str, request: Request):
+    return await _proxy_request(get_async_file_storage(),
+                                request_id,
+                                (await load_request_metadata_or_raise(request_id)).pdf_file,
+                                range_header=request.headers.get('range'))
 
 
 @app.delete('/api/v1/data_extraction_tasks/{request_id}/results/', tags=["Asynchronous Data Extraction"])
 async def delete_request_files(request_id: str):
     try:
-        get_webdav_client().clean(f'{request_id}/')
+        await _delete_request_files(get_async_file_storage(), request_id)
     except RemoteResourceNotFound:
         raise HTTPException(HTTP_404_NOT_FOUND, 'No such data extraction request')
 
 
-def pack_request_results(req: RequestMetadata) -> io.BytesIO:
-    temp_dir = mkdtemp()
-    try:
-        files = [f'/{req.request_id}/{f}' for f in [req.plain_text_file, req.text_structure_file,
-                                                    req.tables_file, req.pdf_coordinates_file,
-                                                    req.pdf_file] if f]
-        get_webdav_client().download_files(files, temp_dir)
-        mem_stream = io.BytesIO()
-        with zipfile.ZipFile(mem_stream, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for name_only in os.listdir(temp_dir):
-                fn = os.path.join(temp_dir, name_only)
-                if not os.path.isfile(fn):
-                    continue
-                zip_file.write(fn, arcname=name_only)
-            zip_file.writestr(zinfo_or_arcname='status.json', data=req.to_request_status().to_json())
-        return mem_stream
-    finally:
-        rmtree(temp_dir)
+class _ZipStreamBuffer(io.RawIOBase):
+    """
+    Unseekable output of the ZIP writer. The written bytes are taken out by the response generator
+    as soon as they are written.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = list()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = list()
+        return data
+
+
+def stream_request_results_zip(storage: FileStorage, req: RequestMetadata) -> Iterator[bytes]:
+    """
+    Generates the ZIP archive of the request results on the fly.
+    Each file is pulled from the storage chunk by chunk while it is being written to the client.
+    """
+    files = [f'/{req.request_id}/{f}' for f in [req.plain_text_file, req.text_structure_file,
+                                                req.tables_file, req.pdf_coordinates_file,
+                                                req.pdf_coordinates_pages_file, req.pdf_file] if f]
+    buff = _ZipStreamBuffer()
+    with zipfile.ZipFile(buff, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for remote_path in files:
+            try:
+                chunks = storage.stream(remote_path)
+            except RemoteResourceNotFound:
+                log.warning(f'Result file {remote_path} not found while packing results of request '
+                            f'#{req.request_id}')
+                continue
+            with zip_file.open(os.path.basename(remote_path), 'w', force_zip64=True) as dst:
+                for chunk in chunks:
+                    dst.write(chunk)
+                    data = buff.drain()
+                    if data:
+                        yield data
+        zip_file.writestr(zinfo_or_arcname='status.json', data=req.to_request_status().to_json())
+    yield buff.drain()
 
 
 @app.post('/api/v1/extract/text_and_structure/', tags=["Synchronous Data Extraction"])
@@ -380,27 +508,27 @@ async def extract_all_data_from_document(
         output_format: OutputFormat = Form(default=OutputFormat.json),
         remove_ocr_layer: bool = Form(default=False),
 ):
-    webdav_client = get_webdav_client()
+    storage = get_async_file_storage()
     request_id = str(uuid4())
-    _run_sync_pdf_processing(webdav_client, request_id, file, doc_language, convert_to_pdf_timeout_sec,
-                             pdf_to_images_timeout_sec, char_coords_debug_enable, output_format, remove_ocr_layer)
+    await _run_sync_pdf_processing(storage, request_id, file, doc_language, convert_to_pdf_timeout_sec,
+                                   pdf_to_images_timeout_sec, char_coords_debug_enable, output_format, remove_ocr_layer)
 
     # Wait until celery finishes extracting else return TimeoutError
-    if not _wait_for_pdf_extraction_finish(request_id, full_extract_timeout_sec):
+    if not await _wait_for_pdf_extraction_finish(request_id, full_extract_timeout_sec):
         await purge_data_extraction_task(request_id)
         raise HTTPException(status_code=504, detail="Input file is too big")
 
     # Get all extracted data in .zip file and clean temp data
-    req: RequestMetadata = load_request_metadata_or_raise(request_id)
+    req: RequestMetadata = await load_request_metadata_or_raise(request_id, max_age_sec=0)
     if req.status != dto.STATUS_DONE:
         raise HTTPException(status_code=500, detail=f'Request is not finished successfully.\n'
                                                     f'Status: {req.status}.\n'
                                                     f'Detail:\n{req.error_message}')
-    mem_stream = pack_request_results(req)
-    mem_stream.seek(0)
-    response = StreamingResponse(mem_stream, media_type='application/x-zip-compressed')
+    # the archive is written by a sync generator iterated in the thread pool
+    response = StreamingResponse(stream_request_results_zip(get_file_storage(), req),
+                                 media_type='application/x-zip-compressed')
     response.headers['Content-Disposition'] = 'attachment; filename=packed_data.zip'
-    webdav_client.clean(f'{req.request_id}/')
+    response.background = BackgroundTask(_delete_request_files, storage, req.request_id)
     return response
 
 
@@ -415,22 +543,24 @@ async def extract_plain_text_from_document(
         output_format: OutputFormat = Form(default=OutputFormat.json),
         remove_ocr_layer: bool = Form(default=False),
 ):
-    webdav_client = get_webdav_client()
+    storage = get_async_file_storage()
     request_id = str(uuid4())
-    _run_sync_pdf_processing(webdav_client, request_id, file, doc_language, convert_to_pdf_timeout_sec,
-                             pdf_to_images_timeout_sec, char_coords_debug_enable, output_format, remove_ocr_layer)
+    await _run_sync_pdf_processing(storage, request_id, file, doc_language, convert_to_pdf_timeout_sec,
+                                   pdf_to_images_timeout_sec, char_coords_debug_enable, output_format, remove_ocr_layer)
 
     # Wait until celery finishes extracting else return TimeoutError
-    if not _wait_for_pdf_extraction_finish(request_id, full_extract_timeout_sec):
+    if not await _wait_for_pdf_extraction_finish(request_id, full_extract_timeout_sec):
         await purge_data_extraction_task(request_id)
         raise HTTPException(status_code=504, detail="Input file is too big")
 
     # Get extracted plain text and clean temp data
-    plain_text = _proxy_request(webdav_client,
-                                request_id,
-                                load_request_metadata(request_id).plain_text_file,
-                                headers={'Content-Type': 'text/plain; charset=utf-8'})
-    webdav_client.clean(f'{request_id}/')
+    req = await load_request_metadata_or_raise(request_id, max_age_sec=0)
+    plain_text = await _proxy_request(storage,
+                                      request_id,
+                                      req.plain_text_file,
+                                      headers={'Content-Type': 'text/plain; charset=utf-8'})
+    # the request files are removed after the response is sent as it can be served from the storage directly
+    plain_text.background = BackgroundTask(_delete_request_files, storage, request_id)
     return plain_text
 
 
@@ -445,20 +575,20 @@ async def extract_text_from_document_and_generate_searchable_pdf(
         output_format: OutputFormat = Form(default=OutputFormat.json),
         remove_ocr_layer: bool = Form(default=False),
 ):
-    webdav_client = get_webdav_client()
+    storage = get_async_file_storage()
     request_id = str(uuid4())
-    _run_sync_pdf_processing(webdav_client, request_id, file, doc_language, convert_to_pdf_timeout_sec,
-                             pdf_to_images_timeout_sec, char_coords_debug_enable, output_format, remove_ocr_layer)
+    await _run_sync_pdf_processing(storage, request_id, file, doc_language, convert_to_pdf_timeout_sec,
+                                   pdf_to_images_timeout_sec, char_coords_debug_enable, output_format, remove_ocr_layer)
 
     # Wait until celery finishes extracting else return TimeoutError
-    if not _wait_for_pdf_extraction_finish(request_id, full_extract_timeout_sec):
+    if not await _wait_for_pdf_extraction_finish(request_id, full_extract_timeout_sec):
         await purge_data_extraction_task(request_id)
         raise HTTPException(status_code=504, detail="Input file is too big")
 
     # Get extracted text-based pdf file and clean temp data
-    filename: str = load_request_metadata(request_id).pdf_file
-    pdf_file: Response = _proxy_request(
-        webdav_client=webdav_client,
+    filename: str = (await load_request_metadata_or_raise(request_id, max_age_sec=0)).pdf_file
+    pdf_file: Response = await _proxy_request(
+        storage=storage,
         request_id=request_id,
         fn=filename,
         headers={
@@ -466,7 +596,7 @@ async def extract_text_from_document_and_generate_searchable_pdf(
             'Content-Disposition': f'attachment; filename={filename}'
         }
     )
-    webdav_client.clean(f'{request_id}/')
+    pdf_file.background = BackgroundTask(_delete_request_files, storage, request_id)
     return pdf_file
 
 
@@ -482,6 +612,14 @@ async def get_system_info():
                       pandas_version=pandas.__version__).to_dict()
 
 
+@app.get('/api/v1/result_cache_stats.json', tags=["Others"])
+async def get_result_cache_stats():
+    result_cache = get_result_cache()
+    if not result_cache:
+        raise HTTPException(HTTP_404_NOT_FOUND, 'Result cache is disabled.')
+    return await run_in_threadpool(result_cache.get_stats)
+
+
 @app.get('/api/v1/download_python_api_client', tags=["Others"])
 async def download_python_api_client_and_dtos():
     folder_exclude = {'lexpredict_text_extraction_system_api.egg-info', '__pycache__'}
@@ -506,56 +644,87 @@ async def download_python_api_client_and_dtos():
     })
 
 
-def _proxy_request(webdav_client,
-                   request_id: str,
-                   fn: str,
-                   headers: Dict[str, str] = None,
-                   type_conversion: Optional[Callable[[Any], Any]] = None):
+def _parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parses the single-range "Range: bytes=<start>-<end>" header.
+    Returns the inclusive (start, end) positions or None if the whole file should be sent.
+    """
+    if not range_header:
+        return None
+    unit, _, spec = range_header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        # multiple ranges are not supported - the whole file is sent which is allowed by RFC 7233
+        return None
+    first, _, last = spec.strip().partition('-')
     try:
-        resp: WebDavClient = webdav_client.execute_request('download', f'/{request_id}/{fn}')
-        content = resp.content
-        if content is not None and type_conversion:
-            content = type_conversion(content)
-        return Response(content=content, status_code=resp.status_code, headers=headers)
+        if not first:
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start > end:
+        raise HTTPException(HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers={'Content-Range': f'bytes */{size}'})
+    return start, end
+
+
+async def _proxy_request(storage: AsyncFileStorage,
+                         request_id: str,
+                         fn: str,
+                         headers: Dict[str, str] = None,
+                         type_conversion: Optional[Callable[[Any], Any]] = None,
+                         range_header: Optional[str] = None):
+    try:
+        remote_path = f'{request_id}/{fn}'
+        if type_conversion:
+            content = type_conversion(b''.join([chunk async for chunk in await storage.stream(remote_path)]))
+            return Response(content=content, status_code=200, headers=headers)
+
+        size = await storage.get_size(remote_path)
+        byte_range = _parse_range(range_header, size)
+        headers = dict(headers or {})
+        headers['Accept-Ranges'] = 'bytes'
+        if byte_range is None:
+            local_path = storage.local_path(remote_path)
+            if local_path:
+                # the storage is on a local / shared volume - serve the file directly
+                return FileResponse(local_path, headers=headers)
+            headers['Content-Length'] = str(size)
+            return StreamingResponse(await storage.stream(remote_path), headers=headers)
+        # the file is passed through chunk by chunk - never loaded to memory as a whole
+        start, end = byte_range
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        headers['Content-Length'] = str(end - start + 1)
+        return StreamingResponse(await storage.stream(remote_path, start=start, end=end),
+                                 status_code=HTTP_206_PARTIAL_CONTENT,
+                                 headers=headers)
     except RemoteResourceNotFound:
         raise HTTPException(HTTP_404_NOT_FOUND, f'No such request or there is no filename `{fn}` in the request results')
 
 
-def _wait_for_pdf_extraction_finish(request_id: str, timeout_sec: int) -> bool:
+async def _wait_for_pdf_extraction_finish(request_id: str, timeout_sec: int) -> bool:
     """Wait until celery tasks finish
     """
-    waiting_time_seconds = 0
-    no_errors = True
-
-    # Check finish_pdf_processing task status
-    while load_request_metadata(request_id).status not in (STATUS_FAILURE, STATUS_DONE):
-        # Get dynamic time_delay_sec and wait
-        if waiting_time_seconds < 30:
-            time_delay_sec = 3
-        elif waiting_time_seconds < 5 * 60:
-            time_delay_sec = 5
-        elif waiting_time_seconds < 15 * 60:
-            time_delay_sec = 10
-        else:
-            time_delay_sec = 15
-        time.sleep(time_delay_sec)
-        waiting_time_seconds += time_delay_sec
-        # Check if processing takes too much time
-        if waiting_time_seconds > timeout_sec:
-            no_errors = False
-            break
-    return no_errors
-
-
-def _run_sync_pdf_processing(webdav_client,
-                             request_id: str,
-                             file: UploadFile,
-                             doc_language: str,
-                             convert_to_pdf_timeout_sec: int,
-                             pdf_to_images_timeout_sec: int,
-                             char_coords_debug_enable: bool,
-                             output_format: OutputFormat,
-                             remove_ocr_layer: bool):
+    async def is_finished() -> bool:
+        req = await load_request_metadata_async(request_id, max_age_sec=0)
+        return not req or req.status in (STATUS_FAILURE, STATUS_DONE)
+
+    return await get_request_completion_listener().wait_for_finish(
+        request_id,
+        timeout_sec,
+        is_finished,
+        recheck_interval_sec=get_settings().sync_extraction_recheck_interval_sec)
+
+
+async def _run_sync_pdf_processing(storage: AsyncFileStorage,
+                                   request_id: str,
+                                   file: UploadFile,
+                                   doc_language: str,
+                                   convert_to_pdf_timeout_sec: int,
+                                   pdf_to_images_timeout_sec: int,
+                                   char_coords_debug_enable: bool,
+                                   output_format: OutputFormat,
+                                   remove_ocr_layer: bool):
     """Run celery tasks to extract data from document
     """
     req = RequestMetadata(original_file_name=file.filename,
@@ -571,12 +740,10 @@ def _run_sync_pdf_processing(webdav_client,
                           request_callback_info=RequestCallbackInfo(
                               request_id=request_id,
                               original_file_name=file.filename))
-    webdav_client.mkdir(f'/{req.request_id}')
-    save_request_metadata(req)
-    webdav_client.upload_to(file.file, f'{req.request_id}/{req.original_document}')
-    async_task = process_document.apply_async(
-        (req.request_id, req.request_callback_info.to_dict(), req.remove_ocr_layer)
-    )
-    webdav_client.mkdir(f'{req.request_id}/{task_ids}')
-    register_task_id(webdav_client, req.request_id, async_task.id)
+    await storage.mkdir(f'/{req.request_id}')
+    await asyncio.gather(save_request_metadata_async(req),
+                         storage.upload_to(file.file, f'{req.request_id}/{req.original_document}'))
+    async_task = await run_in_threadpool(
+        process_document.apply_async, (req.request_id, req.request_callback_info.to_dict(), req.remove_ocr_layer))
+    await register_first_task_id_async(storage, req.request_id, async_task.id)
 
@@ -3,6 +3,7 @@ package com.lexpredict.textextraction;
 import com.fasterxml.jackson.databind.ObjectMapper;
 import com.lexpredict.textextraction.dto.PDFPlainText;
 import com.lexpredict.textextraction.dto.PDFPlainTextPage;
+import com.lexpredict.textextraction.dto.PackedCharBBoxesSerializer;
 import org.apache.commons.cli.*;
 import org.apache.pdfbox.pdmodel.PDDocument;
 import org.apache.pdfbox.pdmodel.PDPage;
@@ -19,13 +20,16 @@ public class GetTextFromPDF {
     public static final String PAGES_JSON = "pages_json";
     public static final String PLAIN_TEXT = "plain_text";
     public static final String PAGES_MSGPACK = "pages_msgpack";
+    // the same as pages_msgpack but the char boxes are a single little-endian float32 blob
+    public static final String PAGES_MSGPACK_PACKED_BOXES = "pages_msgpack_packed_boxes";
 
     public static void main(String[] args) throws Exception {
         if (args.length < 2) {
             System.out.println("Extract text from text-based PDF (no OCR).");
             System.out.println("Usage: java -classpath .... "
                     + GetTextFromPDF.class.getName()
-                    + " <pdf_fn> <output_fn> [" + PLAIN_TEXT + "|" + PAGES_JSON + "|" + PAGES_MSGPACK + "] [password]");
+                    + " <pdf_fn> <output_fn> [" + PLAIN_TEXT + "|" + PAGES_JSON + "|" + PAGES_MSGPACK + "|"
+                    + PAGES_MSGPACK_PACKED_BOXES + "] [password]");
             ObjectMapper om = new ObjectMapper();
             PDFPlainText p = new PDFPlainText();
             p.text = "This is the extracted plain text of the document.\n" +
@@ -73,7 +77,8 @@ public class GetTextFromPDF {
         try (PDDocument document = PDDocument.load(new File(pdf), password)) {
             PDFPlainText res = PDFToTextWithCoordinates.process(document, correctedPDFOutput != null);
 
-            try (OutputStream os = new FileOutputStream(outFn)) {
+            // outFn may be a named pipe read by the caller while the result is being written
+            try (OutputStream os = new BufferedOutputStream(new FileOutputStream(outFn), 1024 * 1024)) {
                 if (PLAIN_TEXT.equals(format)) {
                     try (Writer w = new OutputStreamWriter(os)) {
                         w.write(res.text);
@@ -84,6 +89,10 @@ public class GetTextFromPDF {
                 } else if (PAGES_MSGPACK.equals(format)) {
                     ObjectMapper om = new ObjectMapper(new MessagePackFactory());
                     om.writeValue(os, res);
+                } else if (PAGES_MSGPACK_PACKED_BOXES.equals(format)) {
+                    ObjectMapper om = new ObjectMapper(new MessagePackFactory());
+                    om.addMixIn(PDFPlainText.class, PackedCharBBoxesSerializer.PDFPlainTextMixIn.class);
+                    om.writeValue(os, res);
                 }
             }
 
@@ -0,0 +1,133 @@
+package com.lexpredict.textextraction;
+
+import com.fasterxml.jackson.databind.ObjectMapper;
+
+import java.io.*;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.nio.charset.StandardCharsets;
+import java.security.Permission;
+import java.util.HashMap;
+import java.util.List;
+import java.util.Map;
+
+/**
+ * Long-living JVM worker executing the command line tools of this module (and the PDFBox tools)
+ * without paying the JVM startup and class loading / JIT warm-up price on each call.
+ * <p>
+ * Protocol: one JSON object per line.
+ * <p>
+ * Request (stdin):  {"id": 1, "cls": "com.lexpredict.textextraction.RotatePdf", "args": ["--original-pdf", ...]}
+ * <p>
+ * Response (stdout): {"id": 1, "code": 0, "out": "...", "err": "..."}
+ * <p>
+ * The "main" method of the requested class is called with the specified arguments. Everything the tool writes
+ * to System.out / System.err is captured and returned in "out" / "err". Exceptions thrown by the tool
+ * and calls of System.exit() are converted to a non-zero "code" the same way the JVM would report them
+ * when running the tool as a separate process.
+ * <p>
+ * The requests are executed one by one. The worker stops when its stdin is closed.
+ */
+public class JVMWorkerServer {
+
+    public static final String READY_MARKER = "{\"ready\": true}";
+
+    static class ExitTrappedException extends SecurityException {
+        final int status;
+
+        ExitTrappedException(int status) {
+            super("System.exit(" + status + ") called");
+            this.status = status;
+        }
+    }
+
+    static class ExitTrappingSecurityManager extends SecurityManager {
+        @Override
+        public void checkPermission(Permission perm) {
+        }
+
+        @Override
+        public void checkPermission(Permission perm, Object context) {
+        }
+
+        @Override
+        public void checkExit(int status) {
+            throw new ExitTrappedException(status);
+        }
+    }
+
+    public static void main(String[] args) throws IOException {
+        PrintStream protocolOut = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        PrintStream originalErr = System.err;
+        BufferedReader protocolIn = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        ObjectMapper om = new ObjectMapper();
+
+        // anything printed outside of a request must not break the protocol
+        System.setOut(originalErr);
+
+        try {
+            System.setSecurityManager(new ExitTrappingSecurityManager());
+        } catch (UnsupportedOperationException | SecurityException e) {
+            // Newer JVMs do not allow installing a security manager.
+            // System.exit() called by a tool stops the worker then and the caller restarts it.
+            originalErr.println("Unable to trap System.exit() calls: " + e.getMessage());
+        }
+
+        Map<String, Method> mainMethods = new HashMap<>();
+
+        protocolOut.println(READY_MARKER);
+
+        String line;
+        while ((line = protocolIn.readLine()) != null) {
+            if (line.trim().isEmpty())
+                continue;
+
+            Map<String, Object> response = new HashMap<>();
+            ByteArrayOutputStream out = new ByteArrayOutputStream();
+            ByteArrayOutputStream err = new ByteArrayOutputStream();
+            int code = 0;
+            try (PrintStream outStream = new PrintStream(out, true, "UTF-8");
+                 PrintStream errStream = new PrintStream(err, true, "UTF-8")) {
+                System.setOut(outStream);
+                System.setErr(errStream);
+                try {
+                    @SuppressWarnings("unchecked")
+                    Map<String, Object> request = om.readValue(line, Map.class);
+                    response.put("id", request.get("id"));
+                    String cls = (String) request.get("cls");
+                    @SuppressWarnings("unchecked")
+                    List<String> clsArgs = (List<String>) request.get("args");
+
+                    Method main = mainMethods.get(cls);
+                    if (main == null) {
+                        main = Class.forName(cls).getMethod("main", String[].class);
+                        mainMethods.put(cls, main);
+                    }
+                    main.invoke(null, (Object) clsArgs.toArray(new String[0]));
+                } catch (InvocationTargetException ite) {
+                    Throwable cause = ite.getCause();
+                    if (cause instanceof ExitTrappedException) {
+                        code = ((ExitTrappedException) cause).status;
+                    } else {
+                        code = 1;
+                        errStream.print("Exception in thread \"main\" ");
+                        cause.printStackTrace(errStream);
+                    }
+                } catch (ExitTrappedException ete) {
+                    code = ete.status;
+                } catch (Throwable t) {
+                    code = 1;
+                    t.printStackTrace(errStream);
+                } finally {
+                    System.setOut(originalErr);
+                    System.setErr(originalErr);
+                }
+            }
+
+            response.put("code", code);
+            response.put("out", new String(out.toByteArray(), StandardCharsets.UTF_8));
+            response.put("err", new String(err.toByteArray(), StandardCharsets.UTF_8));
+            protocolOut.println(om.writeValueAsString(response));
+        }
+    }
+}
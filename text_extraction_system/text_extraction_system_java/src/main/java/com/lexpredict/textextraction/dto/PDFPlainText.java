@@ -1,7 +1,14 @@
 package com.lexpredict.textextraction.dto;
 
+import com.fasterxml.jackson.annotation.JsonPropertyOrder;
+
 import java.util.List;
 
+/**
+ * The character boxes are serialized last: the reader of a streamed result gets the text, pages
+ * and table of contents first and can decode the largest part - the boxes - chunk by chunk.
+ */
+@JsonPropertyOrder({"text", "pages", "tableOfContents", "charBBoxes"})
 public class PDFPlainText {
 
     public String text;
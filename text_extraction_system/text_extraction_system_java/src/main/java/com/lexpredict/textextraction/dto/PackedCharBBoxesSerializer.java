@@ -0,0 +1,42 @@
+package com.lexpredict.textextraction.dto;
+
+import com.fasterxml.jackson.core.JsonGenerator;
+import com.fasterxml.jackson.databind.JsonSerializer;
+import com.fasterxml.jackson.databind.SerializerProvider;
+import com.fasterxml.jackson.databind.annotation.JsonSerialize;
+
+import java.io.IOException;
+import java.nio.ByteBuffer;
+import java.nio.ByteOrder;
+import java.util.List;
+
+/**
+ * Writes the character boxes as a single binary value: little-endian float32 [x, y, width, height]
+ * of the characters following each other, NaN-s for the characters having no box.
+ * The boxes of a page start at byte location[0] * BOX_SIZE of the blob (see PDFPlainTextPage.location).
+ * Readers wrap the blob as an (N, 4) float32 array instead of decoding a list of arrays per character.
+ */
+public class PackedCharBBoxesSerializer extends JsonSerializer<List<double[]>> {
+
+    public static final int BOX_SIZE = 4 * Float.BYTES;
+
+    @Override
+    public void serialize(List<double[]> boxes, JsonGenerator gen, SerializerProvider serializers)
+            throws IOException {
+        ByteBuffer buf = ByteBuffer.allocate(boxes.size() * BOX_SIZE).order(ByteOrder.LITTLE_ENDIAN);
+        for (double[] box : boxes) {
+            for (int i = 0; i < 4; i++)
+                buf.putFloat(box == null ? Float.NaN : (float) box[i]);
+        }
+        gen.writeBinary(buf.array());
+    }
+
+    /**
+     * Mix-in switching PDFPlainText.charBBoxes to the packed format:
+     * objectMapper.addMixIn(PDFPlainText.class, PackedCharBBoxesSerializer.PDFPlainTextMixIn.class)
+     */
+    public abstract static class PDFPlainTextMixIn {
+        @JsonSerialize(using = PackedCharBBoxesSerializer.class)
+        public List<double[]> charBBoxes;
+    }
+}
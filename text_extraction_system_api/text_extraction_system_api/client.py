@@ -3,7 +3,7 @@ import os
 import tempfile
 from io import BufferedReader, BytesIO
 from contextlib import contextmanager
-from typing import Generator, Optional, Dict, List, Union
+from typing import Generator, Optional, Dict, List, Union, Tuple
 
 import msgpack
 import requests
@@ -13,6 +13,7 @@ from requests.auth import HTTPBasicAuth
 from text_extraction_system_api.dto import PlainTextStructure, PDFCoordinates, TableList, RequestStatus, \
     PlainTextPage, PlainTextSentence, PlainTextParagraph, PlainTextSection, PlainTableOfContentsRecord, \
     Table, OutputFormat, TaskCancelResult, TableParser
+from text_extraction_system_api.pdf_coordinates.paged_char_boxes import parse_boxes
 
 
 class TextExtractionSystemWebClient:
@@ -252,6 +253,28 @@ class TextExtractionSystemWebClient:
         self.raise_for_status(resp)
         return resp.content
 
+    def get_extracted_pdf_coordinates_of_page(self,
+                                              request_id: str,
+                                              page_num: int) -> Tuple[int, List[Optional[List[float]]]]:
+        """
+        Returns the index of the first character of the page (0-based) and the boxes of the page characters.
+        Only the boxes of the requested page are transferred.
+        """
+        url = f'{self.base_url}/api/v1/data_extraction_tasks/{request_id}/results/pdf_coordinates/page/{page_num}'
+        resp = requests.get(url, auth=self.auth)
+        self.raise_for_status(resp)
+        return int(resp.headers['X-Char-Start']), parse_boxes(resp.content)
+
+    def get_extracted_pdf_coordinates_pages_raw(self, request_id: str) -> Optional[bytes]:
+        """
+        Returns the char boxes file with the page offset table
+        (see text_extraction_system_api.pdf_coordinates.paged_char_boxes).
+        """
+        url = f'{self.base_url}/api/v1/data_extraction_tasks/{request_id}/results/pdf_coordinates.pages'
+        resp = requests.get(url, auth=self.auth)
+        self.raise_for_status(resp)
+        return resp.content
+
     def get_extracted_tables_as_json(self, request_id: str) -> TableList:
         url = f'{self.base_url}/api/v1/data_extraction_tasks/{request_id}/results/extracted_tables.json'
         resp = requests.get(url, auth=self.auth)
@@ -25,7 +25,6 @@
 # -*- coding: utf-8 -*-
 
 from collections import defaultdict
-from math import isclose
 from typing import Optional, List, Dict, Any, Set, Tuple
 
 __author__ = "ContraxSuite, LLC; LexPredict, LLC"
@@ -36,6 +35,7 @@ __maintainer__ = "LexPredict, LLC"
 __email__ = "support@contraxsuite.com"
 
 from text_extraction_system_api.pdf_coordinates.pdf_coords_common import XYWH, PdfMarkup
+from text_extraction_system_api.pdf_coordinates.page_char_index import PageCharIndex
 
 
 class CoordTextMap:
@@ -71,17 +71,22 @@ class CoordTextMap:
                                 x: float,
                                 y: float,
                                 page_loc_start: int,
-                                page_loc_end: int) -> int:
+                                page_loc_end: int,
+                                page_index: Optional[PageCharIndex] = None) -> int:
         """
         :param doc_char_bboxes: list of [[x0, y0, w0, h0], [x1, ...], ] all characters' areas
         :param x: X coordinate of the point we're searching a symbol pos for
         :param y: Y coordinate of the point we're searching a symbol pos for
         :param page_loc_start: index of the page's first index
         :param page_loc_end: index of the page's last index + 1
+        :param page_index: spatial index of the page (PdfMarkup.get_page_index()) - if passed
+                           only the characters near the point are checked instead of the whole page
         :return: position of the symbol closest (by left: top) to the (x, y) coordinates pair
         """
         if page_loc_start == page_loc_end:
             return page_loc_start
+        if page_index is not None:
+            return page_index.closest_symbol_pos(x, y)
 
         index, min_dist = -1, 99999999.0
         for i in range(page_loc_start, page_loc_end):
@@ -99,7 +104,10 @@ class CoordTextMap:
                                          sel_area: XYWH,
                                          page_loc_start: int,
                                          page_loc_end: int,
-                                         debug_full_text: str = None) -> Tuple[int, int]:
+                                         debug_full_text: str = None,
+                                         page_index: Optional[PageCharIndex] = None) -> Tuple[int, int]:
+        if page_index is not None:
+            return page_index.longest_continuous_location(sel_area)
         longest_location: Optional[Tuple[int, int]] = None
         location_start: Optional[int] = None
         location_end: Optional[int] = None
@@ -154,7 +162,8 @@ class CoordTextMap:
                     cls.find_longest_continuous_location(doc_char_bboxes=doc_char_bboxes,
                                                          sel_area=sel_area,
                                                          page_loc_start=page_loc_start,
-                                                         page_loc_end=page_loc_end)  # , debug_full_text=doc_text)
+                                                         page_loc_end=page_loc_end,
+                                                         page_index=markup.get_page_index(page))
                 if sel_area_location:
                     location_start = min(location_start, sel_area_location[0]) \
                         if location_start is not None \
@@ -178,38 +187,33 @@ class CoordTextMap:
         # from apps.document.models import DocumentText
         # pdf_text = DocumentText.objects.get(document_id=document_id).full_text
 
-        # number, start, end, bbox
-        pages: List[Dict[str, Any]] = markup.pages_list
-        doc_char_bboxes: List[XYWH] = markup.char_bboxes_list
-
         test_page_num_first: Optional[int] = None
         test_page_num_last: Optional[int] = None
         test_areas_by_page: Dict[int, Set[XYWH]] = defaultdict(set)
         for selection in selections:
             page_num: int = selection['page']
             sel_areas: List[XYWH] = selection['areas']  # areas should be replaced with first_bbox/last_bbox
-            test_page_num_first = max(test_page_num_first, page_num)
-            test_page_num_last = min(test_page_num_last, page_num)
-            test_areas_by_page[page_num].update(sel_areas)
+            test_page_num_first = min(test_page_num_first, page_num) if test_page_num_first is not None \
+                else page_num
+            test_page_num_last = max(test_page_num_last, page_num) if test_page_num_last is not None \
+                else page_num
+            test_areas_by_page[page_num].update(tuple(sel_area) for sel_area in sel_areas)
 
+        if test_page_num_first is None:
+            raise Exception(f'No text found for the specified selection PDF coordinates')
+
+        # the selected characters are searched in the page indexes: the first continuous run of them
+        # starting on the first page with a selection and continuing from the beginnings of the next pages
         location_first: Optional[int] = None
         location_last: Optional[int] = None
         for test_page_num in range(test_page_num_first, test_page_num_last + 1):
-            test_char_location_start: int = pages[test_page_num]['start']
-            test_char_location_end: int = pages[test_page_num]['end']
-            page_test_areas = test_areas_by_page[test_page_num]
-            for test_char_location in range(test_char_location_start, test_char_location_end):
-                test_char_bbox = doc_char_bboxes[test_char_location]
-                test_char_area = cls.area(test_char_bbox)
-                if isclose(test_char_area, 0, abs_tol=1e-10):
-                    continue
-                if cls.overlaps_any_sel_area_on_page(test_char_area, test_char_bbox, page_test_areas):
-                    if location_first is None:
-                        location_first = test_char_location
-                    location_last = test_char_location
-                else:
-                    if location_first is not None:
-                        break
+            location = markup.get_page_index(test_page_num) \
+                .first_continuous_location(test_areas_by_page[test_page_num],
+                                           continue_from_page_start=location_first is not None)
+            if location:
+                if location_first is None:
+                    location_first = location[0]
+                location_last = location[1]
 
         if location_first is None:
             raise Exception(f'No text found for the specified selection PDF coordinates')
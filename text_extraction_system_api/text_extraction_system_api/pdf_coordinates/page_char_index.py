@@ -0,0 +1,223 @@
+"""
+    Copyright (C) 2017, ContraxSuite, LLC
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    You can also be released from the requirements of the license by purchasing
+    a commercial license from ContraxSuite, LLC. Buying such a license is
+    mandatory as soon as you develop commercial activities involving ContraxSuite
+    software without disclosing the source code of your own applications.  These
+    activities include: offering paid services to customers as an ASP or "cloud"
+    provider, processing documents on the fly in a web application,
+    or shipping ContraxSuite within a closed source product.
+"""
+# -*- coding: utf-8 -*-
+
+from collections import defaultdict
+from math import floor, isclose
+from typing import Optional, List, Dict, Tuple, Iterable
+
+
+__author__ = "ContraxSuite, LLC; LexPredict, LLC"
+__copyright__ = "Copyright 2015-2021, ContraxSuite, LLC"
+__license__ = "https://github.com/LexPredict/lexpredict-contraxsuite/blob/2.0.0/LICENSE"
+__version__ = "2.0.0"
+__maintainer__ = "LexPredict, LLC"
+__email__ = "support@contraxsuite.com"
+
+from text_extraction_system_api.pdf_coordinates.pdf_coords_common import XYWH
+
+# the same limit as in CoordTextMap.find_closest_symbol_pos()
+MAX_SYMBOL_DISTANCE_SQ = 99999999.0
+
+# share of the character area to be covered by a selection area to consider the character selected
+SELECTED_AREA_SHARE = 0.2
+
+DEFAULT_CELL_SIZE = 10.0
+
+
+def is_printable(bbox: Optional[XYWH]) -> bool:
+    return bbox is not None and bbox[2] >= 0.00001 and bbox[3] >= 0.00001
+
+
+def has_area(bbox: Optional[XYWH]) -> bool:
+    return bbox is not None and not isclose(bbox[2] * bbox[3], 0, abs_tol=1e-10)
+
+
+def is_selected(sel_area: XYWH, bbox: XYWH) -> bool:
+    dx = min(sel_area[0] + sel_area[2], bbox[0] + bbox[2]) - max(sel_area[0], bbox[0])
+    dy = min(sel_area[1] + sel_area[3], bbox[1] + bbox[3]) - max(sel_area[1], bbox[1])
+    overlap = dx * dy if dx >= 0 and dy >= 0 else 0
+    return overlap > SELECTED_AREA_SHARE * bbox[2] * bbox[3]
+
+
+class PageCharIndex:
+    """
+    Spatial index of the characters of a single page: a uniform grid of square cells.
+    The character boxes are put into all the cells they cover and their left-top corners -
+    into the cell containing the corner. The cell size is twice the median character height
+    so a cell contains a few characters of one or two lines.
+
+    Built once per page (see PdfMarkup.get_page_index()) and reused by all the lookups,
+    so a lookup checks only the characters near the searched point or area instead of the whole page.
+    Returns exactly the same results as the page scans of CoordTextMap.
+    """
+
+    def __init__(self, doc_char_bboxes: List[Optional[XYWH]], page_loc_start: int, page_loc_end: int):
+        self.doc_char_bboxes = doc_char_bboxes
+        self.page_loc_start = page_loc_start
+        self.page_loc_end = page_loc_end
+
+        heights = sorted(doc_char_bboxes[i][3] for i in range(page_loc_start, page_loc_end)
+                         if is_printable(doc_char_bboxes[i]))
+        self.cell_size: float = 2 * heights[len(heights) // 2] if heights else DEFAULT_CELL_SIZE
+
+        self.box_cells: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        self.corner_cells: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        # number of the characters before each position of the page which break the continuous selections
+        self._printable_before: List[int] = [0]
+        self._with_area_before: List[int] = [0]
+        for i in range(page_loc_start, page_loc_end):
+            bbox = doc_char_bboxes[i]
+            self._printable_before.append(self._printable_before[-1] + is_printable(bbox))
+            self._with_area_before.append(self._with_area_before[-1] + has_area(bbox))
+            if bbox is None:
+                continue
+            self.corner_cells[self._cell(bbox[0], bbox[1])].append(i)
+            x0, y0 = self._cell(bbox[0], bbox[1])
+            x1, y1 = self._cell(bbox[0] + bbox[2], bbox[1] + bbox[3])
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    self.box_cells[(cx, cy)].append(i)
+
+        if self.corner_cells:
+            self._min_cx = min(cx for cx, _cy in self.corner_cells)
+            self._max_cx = max(cx for cx, _cy in self.corner_cells)
+            self._min_cy = min(cy for _cx, cy in self.corner_cells)
+            self._max_cy = max(cy for _cx, cy in self.corner_cells)
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        return floor(x / self.cell_size), floor(y / self.cell_size)
+
+    def _ring_cells(self, qx: int, qy: int, r: int) -> Iterable[Tuple[int, int]]:
+        # cells at the Chebyshev distance r from the (qx, qy) cell clipped to the cells having corners
+        if r == 0:
+            yield qx, qy
+            return
+        for cx in range(max(qx - r, self._min_cx), min(qx + r, self._max_cx) + 1):
+            if self._min_cy <= qy - r:
+                yield cx, qy - r
+            if qy + r <= self._max_cy:
+                yield cx, qy + r
+        for cy in range(max(qy - r + 1, self._min_cy), min(qy + r - 1, self._max_cy) + 1):
+            if self._min_cx <= qx - r:
+                yield qx - r, cy
+            if qx + r <= self._max_cx:
+                yield qx + r, cy
+
+    def closest_symbol_pos(self, x: float, y: float) -> int:
+        """
+        Returns the position of the character which left-top corner is closest to the (x, y) point,
+        the first one of the equally distant characters. -1 if there is no such character.
+        """
+        if self.page_loc_start == self.page_loc_end:
+            return self.page_loc_start
+        if not self.corner_cells:
+            return -1
+        qx, qy = self._cell(x, y)
+        # the cells closer than the grid bounds are empty
+        r = max(self._min_cx - qx, qx - self._max_cx, self._min_cy - qy, qy - self._max_cy, 0)
+        r_max = max(qx - self._min_cx, self._max_cx - qx, qy - self._min_cy, self._max_cy - qy)
+        best: Optional[Tuple[float, int]] = None
+        while r <= r_max:
+            for cell in self._ring_cells(qx, qy, r):
+                for i in self.corner_cells.get(cell, ()):
+                    dx = x - self.doc_char_bboxes[i][0]
+                    dy = y - self.doc_char_bboxes[i][1]
+                    candidate = (dx * dx + dy * dy, i)
+                    if best is None or candidate < best:
+                        best = candidate
+            # the corners in the next rings are at least r cells away from the point
+            if best is not None and best[0] < (r * self.cell_size) ** 2:
+                break
+            r += 1
+        if best is None or best[0] >= MAX_SYMBOL_DISTANCE_SQ:
+            return -1
+        return best[1]
+
+    def selected_positions(self, sel_areas: Iterable[XYWH]) -> List[int]:
+        """
+        Returns the sorted positions of the characters covered by any of the selection areas.
+        """
+        candidates = set()
+        for sel_area in sel_areas:
+            x0, y0 = self._cell(sel_area[0], sel_area[1])
+            x1, y1 = self._cell(sel_area[0] + sel_area[2], sel_area[1] + sel_area[3])
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    for i in self.box_cells.get((cx, cy), ()):
+                        if i not in candidates and is_selected(sel_area, self.doc_char_bboxes[i]):
+                            candidates.add(i)
+        return sorted(candidates)
+
+    def _continuous(self, breaking_before: List[int], a: int, b: int) -> bool:
+        # no breaking character between the positions a < b
+        return breaking_before[b - self.page_loc_start] == breaking_before[a + 1 - self.page_loc_start]
+
+    def _runs(self, positions: List[int], breaking_before: List[int]) -> List[Tuple[int, int]]:
+        runs: List[Tuple[int, int]] = list()
+        for i in positions:
+            if runs and self._continuous(breaking_before, runs[-1][1], i):
+                runs[-1] = runs[-1][0], i
+            else:
+                runs.append((i, i))
+        return runs
+
+    def longest_continuous_location(self, sel_area: XYWH) -> Optional[Tuple[int, int]]:
+        """
+        See CoordTextMap.find_longest_continuous_location().
+        The non-printable characters are ignored - they neither belong to nor break the selection.
+        """
+        positions = [i for i in self.selected_positions([sel_area]) if is_printable(self.doc_char_bboxes[i])]
+        runs = self._runs(positions, self._printable_before)
+        if not runs:
+            return None
+        # the first longest run except the one reaching the page end which is taken only if it is the single one
+        longest_location: Optional[Tuple[int, int]] = None
+        for run in runs:
+            closed = self._printable_before[-1] > self._printable_before[run[1] + 1 - self.page_loc_start]
+            if closed and (longest_location is None or run[1] - run[0] > longest_location[1] - longest_location[0]):
+                longest_location = run
+        return longest_location or runs[-1]
+
+    def first_continuous_location(self,
+                                  sel_areas: Iterable[XYWH],
+                                  continue_from_page_start: bool = False) -> Optional[Tuple[int, int]]:
+        """
+        Returns the first run of the characters having area covered by the selection areas.
+        If continue_from_page_start is set, the run is searched only at the page start
+        (as the continuation of a run from the previous page).
+        """
+        positions = [i for i in self.selected_positions(sel_areas) if has_area(self.doc_char_bboxes[i])]
+        runs = self._runs(positions, self._with_area_before)
+        if not runs:
+            return None
+        first = runs[0]
+        if continue_from_page_start and self._with_area_before[first[0] - self.page_loc_start] > 0:
+            return None
+        return first
+
+    def has_chars_with_area(self) -> bool:
+        return self._with_area_before[-1] > 0
+
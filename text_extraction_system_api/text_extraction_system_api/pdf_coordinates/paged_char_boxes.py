@@ -0,0 +1,145 @@
+"""
+    Copyright (C) 2017, ContraxSuite, LLC
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    You can also be released from the requirements of the license by purchasing
+    a commercial license from ContraxSuite, LLC. Buying such a license is
+    mandatory as soon as you develop commercial activities involving ContraxSuite
+    software without disclosing the source code of your own applications.  These
+    activities include: offering paid services to customers as an ASP or "cloud"
+    provider, processing documents on the fly in a web application,
+    or shipping ContraxSuite within a closed source product.
+"""
+# -*- coding: utf-8 -*-
+
+import struct
+import sys
+from array import array
+from dataclasses import dataclass
+from typing import List, Optional, Tuple, BinaryIO
+
+
+__author__ = "ContraxSuite, LLC; LexPredict, LLC"
+__copyright__ = "Copyright 2015-2021, ContraxSuite, LLC"
+__license__ = "https://github.com/LexPredict/lexpredict-contraxsuite/blob/2.0.0/LICENSE"
+__version__ = "2.0.0"
+__maintainer__ = "LexPredict, LLC"
+__email__ = "support@contraxsuite.com"
+
+# Compact binary file of the character boxes with random access to the pages.
+# All numbers are little-endian:
+#
+#     header:     4 bytes magic b'TECB', uint32 format version, uint64 number of characters,
+#                 uint32 number of pages, uint32 offset of the boxes from the beginning of the file
+#     page table: (uint64 start, uint64 end) character index range of each page
+#                 - the same as PlainTextPage.start / end
+#     padding:    zeros up to the offset of the boxes (aligned to 16 bytes)
+#     boxes:      4 float32 (left, top, width, height) per character,
+#                 NaN values for the characters having no box
+#
+# The boxes of a page are a contiguous byte range of the file, so they can be fetched with a single
+# range request and the whole file can be mapped with numpy without parsing:
+#
+#     numpy.memmap(fn, dtype='<f4', mode='r', offset=header.boxes_offset, shape=(header.char_count, 4))
+
+MAGIC = b'TECB'
+VERSION = 1
+HEADER = struct.Struct('<4sIQII')
+PAGE_ENTRY = struct.Struct('<QQ')
+BOX_SIZE = 16
+BOXES_ALIGNMENT = 16
+
+
+class PagedCharBoxesFormatError(ValueError):
+    pass
+
+
+@dataclass
+class PagedCharBoxesHeader:
+    char_count: int
+    page_count: int
+    boxes_offset: int
+
+    @classmethod
+    def for_document(cls, char_count: int, page_count: int) -> 'PagedCharBoxesHeader':
+        table_end = HEADER.size + page_count * PAGE_ENTRY.size
+        boxes_offset = (table_end + BOXES_ALIGNMENT - 1) // BOXES_ALIGNMENT * BOXES_ALIGNMENT
+        return cls(char_count=char_count, page_count=page_count, boxes_offset=boxes_offset)
+
+    @classmethod
+    def parse(cls, data: bytes) -> 'PagedCharBoxesHeader':
+        if len(data) < HEADER.size:
+            raise PagedCharBoxesFormatError('Char boxes file is truncated.')
+        magic, version, char_count, page_count, boxes_offset = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise PagedCharBoxesFormatError('Not a char boxes file.')
+        if version != VERSION:
+            raise PagedCharBoxesFormatError(f'Unsupported char boxes file version: {version}.')
+        return cls(char_count=char_count, page_count=page_count, boxes_offset=boxes_offset)
+
+    def pack(self) -> bytes:
+        return HEADER.pack(MAGIC, VERSION, self.char_count, self.page_count, self.boxes_offset)
+
+    def page_entry_offset(self, page_num: int) -> int:
+        if not 0 <= page_num < self.page_count:
+            raise IndexError(f'Page {page_num} is out of range 0..{self.page_count - 1}.')
+        return HEADER.size + page_num * PAGE_ENTRY.size
+
+    def boxes_byte_range(self, start: int, end: int) -> Tuple[int, int]:
+        """
+        Returns the byte range [first, last + 1) of the boxes of the characters [start, end).
+        """
+        start, end = min(start, self.char_count), min(end, self.char_count)
+        return self.boxes_offset + start * BOX_SIZE, self.boxes_offset + max(end, start) * BOX_SIZE
+
+
+def parse_page_entry(data: bytes) -> Tuple[int, int]:
+    """
+    Returns the (start, end) character index range of the page table entry.
+    """
+    if len(data) < PAGE_ENTRY.size:
+        raise PagedCharBoxesFormatError('Char boxes file is truncated.')
+    return PAGE_ENTRY.unpack_from(data)
+
+
+def parse_boxes(data: bytes) -> List[Optional[List[float]]]:
+    """
+    Converts the packed boxes to the [[x, y, w, h], ...] lists used by PdfMarkup.
+    The characters having no box are returned as None.
+    """
+    values = array('f')
+    values.frombytes(data[:len(data) // BOX_SIZE * BOX_SIZE])
+    if sys.byteorder != 'little':
+        values.byteswap()
+    boxes: List[Optional[List[float]]] = list()
+    for i in range(0, len(values), 4):
+        box = values[i:i + 4].tolist()
+        # NaN is the only value not equal to itself
+        boxes.append(box if box[0] == box[0] else None)
+    return boxes
+
+
+def read_page_boxes(f: BinaryIO, page_num: int) -> Tuple[int, List[Optional[List[float]]]]:
+    """
+    Reads the boxes of a page from the seekable char boxes file.
+    Returns the index of the first character of the page and the boxes of its characters.
+    """
+    f.seek(0)
+    header = PagedCharBoxesHeader.parse(f.read(HEADER.size))
+    f.seek(header.page_entry_offset(page_num))
+    start, end = parse_page_entry(f.read(PAGE_ENTRY.size))
+    first_byte, end_byte = header.boxes_byte_range(start, end)
+    f.seek(first_byte)
+    return start, parse_boxes(f.read(end_byte - first_byte))
@@ -35,6 +35,21 @@ class PdfMarkup:
         # [{'number': 0, 'start': 0, 'end': 1109,
         #   'bbox': [0.0, 0.0, 595.2999877929688, 841.8900146484375]}, ...
         self.pages_list: List[Dict[str, Any]] = pages_list
+        self._page_indexes: Dict[int, Any] = dict()
+
+    def get_page_index(self, page_num: int):
+        """
+        Returns the spatial index (PageCharIndex) of the characters of the page.
+        It is built on the first call and reused by all the following lookups on the page,
+        so the markup should not be changed after that.
+        """
+        page_index = self._page_indexes.get(page_num)
+        if page_index is None:
+            from text_extraction_system_api.pdf_coordinates.page_char_index import PageCharIndex
+            page = self.pages_list[page_num]
+            page_index = PageCharIndex(self.char_bboxes_list, page['start'], page['end'])
+            self._page_indexes[page_num] = page_index
+        return page_index
 
 
 def find_page_by_smb_index(pages: List[Tuple[int, int]], char_index: int) -> int:
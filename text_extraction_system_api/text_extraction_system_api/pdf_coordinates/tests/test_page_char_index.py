@@ -0,0 +1,126 @@
+"""
+    Copyright (C) 2017, ContraxSuite, LLC
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    You can also be released from the requirements of the license by purchasing
+    a commercial license from ContraxSuite, LLC. Buying such a license is
+    mandatory as soon as you develop commercial activities involving ContraxSuite
+    software without disclosing the source code of your own applications.  These
+    activities include: offering paid services to customers as an ASP or "cloud"
+    provider, processing documents on the fly in a web application,
+    or shipping ContraxSuite within a closed source product.
+"""
+# -*- coding: utf-8 -*-
+
+
+__author__ = "ContraxSuite, LLC; LexPredict, LLC"
+__copyright__ = "Copyright 2015-2021, ContraxSuite, LLC"
+__license__ = "https://github.com/LexPredict/lexpredict-contraxsuite/blob/2.0.0/LICENSE"
+__version__ = "2.0.0"
+__maintainer__ = "LexPredict, LLC"
+__email__ = "support@contraxsuite.com"
+
+import random
+from math import isclose
+
+from text_extraction_system_api.pdf_coordinates.coord_text_map import CoordTextMap
+from text_extraction_system_api.pdf_coordinates.pdf_coords_common import PdfMarkup
+
+
+def _build_markup(seed: int = 1, pages: int = 3, lines: int = 20, chars_per_line: int = 40) -> PdfMarkup:
+    rnd = random.Random(seed)
+    boxes = list()
+    pages_list = list()
+    for page_num in range(pages):
+        start = len(boxes)
+        for line in range(lines):
+            x = 50.0
+            y = 50.0 + line * 14
+            for _ in range(chars_per_line):
+                w = rnd.choice([0, 4.5, 6.0, 7.25])
+                boxes.append([x, y, w, 0 if w == 0 else 10.0])
+                x += w + rnd.choice([0, 0.5, 3])
+            # line break character without a box
+            boxes.append([x, y, 0, 0])
+        pages_list.append({'number': page_num, 'start': start, 'end': len(boxes), 'bbox': [0, 0, 600, 800]})
+    return PdfMarkup(boxes, pages_list)
+
+
+def _first_continuous_location_by_scan(markup: PdfMarkup, page_num: int, sel_areas):
+    # the original page scan of CoordTextMap.get_text_location_by_coords_needs_all_sel_areas()
+    location_first = location_last = None
+    page = markup.pages_list[page_num]
+    for i in range(page['start'], page['end']):
+        bbox = markup.char_bboxes_list[i]
+        area = CoordTextMap.area(bbox)
+        if isclose(area, 0, abs_tol=1e-10):
+            continue
+        if CoordTextMap.overlaps_any_sel_area_on_page(area, bbox, sel_areas):
+            if location_first is None:
+                location_first = i
+            location_last = i
+        elif location_first is not None:
+            break
+    return location_first, location_last
+
+
+def test_closest_symbol_pos():
+    markup = _build_markup()
+    rnd = random.Random(2)
+    for page_num, page in enumerate(markup.pages_list):
+        page_index = markup.get_page_index(page_num)
+        for _ in range(200):
+            x, y = rnd.uniform(-100, 700), rnd.uniform(-100, 900)
+            expected = CoordTextMap.find_closest_symbol_pos(markup.char_bboxes_list, x, y, page['start'], page['end'])
+            assert CoordTextMap.find_closest_symbol_pos(markup.char_bboxes_list, x, y, page['start'], page['end'],
+                                                        page_index=page_index) == expected
+        # exactly at the character corner
+        bbox = markup.char_bboxes_list[page['start'] + 5]
+        assert page_index.closest_symbol_pos(bbox[0], bbox[1]) == CoordTextMap.find_closest_symbol_pos(
+            markup.char_bboxes_list, bbox[0], bbox[1], page['start'], page['end'])
+
+
+def test_longest_continuous_location():
+    markup = _build_markup()
+    rnd = random.Random(3)
+    for page_num, page in enumerate(markup.pages_list):
+        page_index = markup.get_page_index(page_num)
+        for _ in range(200):
+            sel_area = (rnd.uniform(0, 400), rnd.uniform(0, 300), rnd.uniform(0, 300), rnd.uniform(0, 60))
+            expected = CoordTextMap.find_longest_continuous_location(markup.char_bboxes_list, sel_area,
+                                                                     page['start'], page['end'])
+            assert page_index.longest_continuous_location(sel_area) == expected
+
+
+def test_first_continuous_location():
+    markup = _build_markup()
+    rnd = random.Random(4)
+    for page_num in range(len(markup.pages_list)):
+        page_index = markup.get_page_index(page_num)
+        for _ in range(200):
+            sel_areas = {(rnd.uniform(0, 400), rnd.uniform(0, 300), rnd.uniform(0, 300), rnd.uniform(0, 30))
+                         for _ in range(rnd.randint(1, 3))}
+            expected = _first_continuous_location_by_scan(markup, page_num, sel_areas)
+            location = page_index.first_continuous_location(sel_areas)
+            assert (location or (None, None)) == expected
+
+
+def test_text_location_by_coords():
+    markup = _build_markup()
+    line = markup.char_bboxes_list[markup.pages_list[1]['start'] + 41]
+    selections = [{'page': 1, 'areas': [(line[0], line[1], 60, 10)]}]
+    start, end = CoordTextMap.get_text_location_by_coords(markup, selections)
+    assert markup.pages_list[1]['start'] + 41 <= start < end
+    assert CoordTextMap.get_text_location_by_coords_needs_all_sel_areas(markup, selections)[0] == start
@@ -0,0 +1,82 @@
+"""
+    Copyright (C) 2017, ContraxSuite, LLC
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    You can also be released from the requirements of the license by purchasing
+    a commercial license from ContraxSuite, LLC. Buying such a license is
+    mandatory as soon as you develop commercial activities involving ContraxSuite
+    software without disclosing the source code of your own applications.  These
+    activities include: offering paid services to customers as an ASP or "cloud"
+    provider, processing documents on the fly in a web application,
+    or shipping ContraxSuite within a closed source product.
+"""
+# -*- coding: utf-8 -*-
+
+
+__author__ = "ContraxSuite, LLC; LexPredict, LLC"
+__copyright__ = "Copyright 2015-2021, ContraxSuite, LLC"
+__license__ = "https://github.com/LexPredict/lexpredict-contraxsuite/blob/2.0.0/LICENSE"
+__version__ = "2.0.0"
+__maintainer__ = "LexPredict, LLC"
+__email__ = "support@contraxsuite.com"
+
+import io
+import struct
+
+import pytest
+
+from text_extraction_system_api.pdf_coordinates.paged_char_boxes import PagedCharBoxesHeader, \
+    PagedCharBoxesFormatError, read_page_boxes, parse_boxes, HEADER, PAGE_ENTRY
+
+
+def _build_file(boxes, pages) -> bytes:
+    header = PagedCharBoxesHeader.for_document(char_count=len(boxes), page_count=len(pages))
+    table = b''.join(PAGE_ENTRY.pack(start, end) for start, end in pages)
+    padding = bytes(header.boxes_offset - len(header.pack()) - len(table))
+    nan = float('nan')
+    data = b''.join(struct.pack('<4f', *(box if box is not None else (nan, nan, nan, nan))) for box in boxes)
+    return header.pack() + table + padding + data
+
+
+def test_read_page_boxes():
+    boxes = [[1, 2, 3, 4], [5, 6, 7, 8], None, [9, 10, 11, 12]]
+    f = io.BytesIO(_build_file(boxes, [(0, 2), (2, 4)]))
+    assert read_page_boxes(f, 0) == (0, [[1, 2, 3, 4], [5, 6, 7, 8]])
+    assert read_page_boxes(f, 1) == (2, [None, [9, 10, 11, 12]])
+    with pytest.raises(IndexError):
+        read_page_boxes(f, 2)
+
+
+def test_boxes_aligned():
+    header = PagedCharBoxesHeader.for_document(char_count=10, page_count=3)
+    assert header.boxes_offset % 16 == 0
+    assert header.boxes_byte_range(2, 4) == (header.boxes_offset + 32, header.boxes_offset + 64)
+    # the page ranges never exceed the boxes
+    assert header.boxes_byte_range(8, 12) == (header.boxes_offset + 128, header.boxes_offset + 160)
+
+
+def test_wrong_format():
+    with pytest.raises(PagedCharBoxesFormatError):
+        PagedCharBoxesHeader.parse(b'{"char_bboxes": []}' + bytes(10))
+    assert parse_boxes(b'') == []
+
+
+def test_truncated():
+    data = _build_file([[1, 2, 3, 4], [5, 6, 7, 8]], [(0, 1), (1, 2)])
+    with pytest.raises(PagedCharBoxesFormatError):
+        # the table entry of the second page is cut
+        read_page_boxes(io.BytesIO(data[:HEADER.size + PAGE_ENTRY.size + 4]), 1)
+    with pytest.raises(PagedCharBoxesFormatError):
+        read_page_boxes(io.BytesIO(data[:10]), 0)
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# source: contract_tables.proto
+"""Generated protocol buffer code."""
+from google.protobuf.internal import builder as _builder
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import symbol_database as _symbol_database
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x15\x63ontract_tables.proto\"E\n\tRectangle\x12\x0c\n\x04left\x18\x01 \x01(\x02\x12\x0b\n\x03top\x18\x02 \x01(\x02\x12\r\n\x05width\x18\x03 \x01(\x02\x12\x0e\n\x06height\x18\x04 \x01(\x02\"\x19\n\x08TableRow\x12\r\n\x05\x63\x65lls\x18\x01 \x03(\t\"O\n\x05Table\x12\x1f\n\x0b\x63oordinates\x18\x01 \x01(\x0b\x32\n.Rectangle\x12\x17\n\x04\x64\x61ta\x18\x02 \x03(\x0b\x32\t.TableRow\x12\x0c\n\x04page\x18\x03 \x01(\x05\"#\n\tTableList\x12\x16\n\x06tables\x18\x01 \x03(\x0b\x32\x06.Table')
+
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'contract_tables_pb2', globals())
+if _descriptor._USE_C_DESCRIPTORS == False:
+
+  DESCRIPTOR._options = None
+  _RECTANGLE._serialized_start=25
+  _RECTANGLE._serialized_end=94
+  _TABLEROW._serialized_start=96
+  _TABLEROW._serialized_end=121
+  _TABLE._serialized_start=123
+  _TABLE._serialized_end=202
+  _TABLELIST._serialized_start=204
+  _TABLELIST._serialized_end=239
+# @@protoc_insertion_point(module_scope)